@@ -0,0 +1,187 @@
+"""
+Canonical description of one factor-analysis request and its result.
+
+Two requests that ask the same question get equal keys however the filters
+were ordered or the dates typed, so cached results can be shared between
+sessions.
+"""
+from typing import NamedTuple
+import pandas as pd
+from sales_index import FILTER_DIMS
+from kernel import PRICE_COL, COST_COL, VOL_COL, FACTOR_COLS
+from drill import CellIndex, DrillDown
+
+
+def canonical_values(values) -> tuple:
+    return tuple(sorted({int(value) for value in values or ()}))
+
+
+def canonical_filters(filters: dict) -> tuple:
+    """
+    Hashable form of a {sales column: accepted values} filter dict
+    """
+    return tuple((col, canonical_values(filters.get(col))) for col in FILTER_DIMS.values())
+
+
+def canonical_window(dt_start, dt_end) -> tuple:
+    return pd.Timestamp(dt_start).isoformat(), pd.Timestamp(dt_end).isoformat()
+
+
+class StaleResult(Exception):
+    """
+    Raised by a lazy member of a result whose DataSets was replaced by a refresh
+    """
+
+
+class AnalysisRequest(NamedTuple):
+    channels: tuple
+    depts: tuple
+    brands: tuple
+    managers: tuple
+    groups: tuple
+    marks: tuple
+    dt_base_start: pd.Timestamp
+    dt_base_end: pd.Timestamp
+    dt_fact_start: pd.Timestamp
+    dt_fact_end: pd.Timestamp
+    x_ax: str
+    y_ax: str
+    abc_cutoff: float = 1.0
+
+    @classmethod
+    def create(cls, channels, depts, brands, managers, groups, marks,
+               dt_base_start, dt_base_end, dt_fact_start, dt_fact_end, x_ax, y_ax, abc_cutoff=1.0) -> 'AnalysisRequest':
+        """
+        Takes the arguments of filter_data and preprocess_data in any form the app passes them
+        """
+        return cls(
+            canonical_values(channels), canonical_values(depts), canonical_values(brands),
+            canonical_values(managers), canonical_values(groups), canonical_values(marks),
+            pd.Timestamp(dt_base_start), pd.Timestamp(dt_base_end),
+            pd.Timestamp(dt_fact_start), pd.Timestamp(dt_fact_end),
+            x_ax, y_ax, round(float(abc_cutoff), 4),
+        )
+
+    def filters(self) -> dict:
+        """
+        {sales column: accepted values} as used by SalesIndex and SalesCube
+        """
+        return {FILTER_DIMS[name]: list(getattr(self, name)) for name in FILTER_DIMS}
+
+    def filter_args(self) -> tuple:
+        """
+        Positional arguments of DataSets.filter_data
+        """
+        return (list(self.channels), list(self.depts), list(self.brands), list(self.managers),
+                list(self.groups), list(self.marks),
+                self.dt_base_start, self.dt_base_end, self.dt_fact_start, self.dt_fact_end)
+
+    def data_key(self) -> tuple:
+        """
+        Everything the product-client table depends on
+        """
+        return (canonical_filters(self.filters()),
+                canonical_window(self.dt_base_start, self.dt_base_end),
+                canonical_window(self.dt_fact_start, self.dt_fact_end))
+
+    def unfiltered(self) -> 'AnalysisRequest':
+        """
+        The same request without dimension filters
+        """
+        return self._replace(**{name: () for name in FILTER_DIMS})
+
+    def key(self) -> tuple:
+        """
+        Everything the pivots depend on
+        """
+        return self.data_key() + (self.x_ax, self.y_ax, self.abc_cutoff)
+
+
+class AnalysisResult():
+    """
+    Read-only outcome of one request, safe to share between sessions and threads.
+    The frames are shared as well: renderers must not modify them in place.
+    """
+    # __weakref__: views keeps the drawn specs of a result for as long as it lives
+    __slots__ = ('_dm1', '_load_dm1', '_load_cells', 'pivots', 'x_ax', 'y_ax', 'totals', 'bounds', '_cell_index', '__weakref__')
+
+    def __init__(self, dm1, pivots, x_ax: str, y_ax: str, totals: dict = None, bounds=None, cells=None) -> None:
+        """
+        dm1 is the product-client table, or a function returning it that is
+        called on every access: it reads the table from a cache entry of its
+        own (see DataSets.analyze), so the result never holds it. cells is the
+        function returning the CellIndex of such a result.
+        totals are the sums shown with the charts
+        (factors, revenue, profits, pairs), taken from dm1 when not given.
+        bounds (see preview.py) are set when pivots and totals are estimates
+        """
+        loaded = isinstance(dm1, pd.DataFrame)
+        object.__setattr__(self, '_dm1', dm1 if loaded else None)
+        object.__setattr__(self, '_load_dm1', None if loaded else dm1)
+        object.__setattr__(self, '_load_cells', cells)
+        object.__setattr__(self, 'pivots', pivots)
+        object.__setattr__(self, 'x_ax', x_ax)
+        object.__setattr__(self, 'y_ax', y_ax)
+        if totals is None:
+            totals = {col: float(dm1[col].sum()) for col in FACTOR_COLS + ['Revenue fact', 'Profit base', 'Profit fact']}
+            totals['pairs'] = len(dm1)
+        object.__setattr__(self, 'totals', totals)
+        object.__setattr__(self, 'bounds', bounds)
+        object.__setattr__(self, '_cell_index', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('AnalysisResult is read-only')
+
+    @property
+    def mode(self) -> str:
+        return 'exact' if self.bounds is None else 'preview'
+
+    @property
+    def dm1(self) -> pd.DataFrame:
+        """
+        Product-client table, only built when asked for (export, drill-down)
+        """
+        if self._load_dm1 is not None:
+            return self._load_dm1()
+        return self._dm1
+
+    def cell(self, x_value, y_value) -> DrillDown:
+        """
+        Drill-down into the product-client rows of one heatmap cell. The cell
+        index is built from dm1 on the first call, kept with the result or in
+        the cache entry `cells` reads
+        """
+        dm1 = self.dm1
+        if self._load_cells is not None:
+            cell_index = self._load_cells()
+        else:
+            if self._cell_index is None:
+                object.__setattr__(self, '_cell_index', CellIndex(dm1, self.pivots))
+            cell_index = self._cell_index
+        return DrillDown(dm1, cell_index.rows(x_value, y_value), ((self.pivots.x_axis, x_value), (self.pivots.y_axis, y_value)))
+
+    @property
+    def pivot_price(self) -> pd.DataFrame:
+        return self.pivots.pivot_price
+
+    @property
+    def pivot_cost(self) -> pd.DataFrame:
+        return self.pivots.pivot_cost
+
+    @property
+    def pivot_vol(self) -> pd.DataFrame:
+        return self.pivots.pivot_vol
+
+    # long forms are built on every access, callers may modify them
+
+    @property
+    def aa(self) -> pd.DataFrame:
+        return self.pivots.long(PRICE_COL)
+
+    @property
+    def bb(self) -> pd.DataFrame:
+        return self.pivots.long(COST_COL)
+
+    @property
+    def cc(self) -> pd.DataFrame:
+        return self.pivots.long(VOL_COL)
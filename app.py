@@ -1,31 +1,80 @@
+import logging
+import os
+import time
 import streamlit as st
 import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-import io
-from datasets import DataSets
-from views import Render
+from datasets import DataSets, LiveDataSets
+from analysis import AnalysisRequest, StaleResult
+from kernel import FACTOR_COLS
+from series import SeriesRequest
+from drill import DRILL_LEVELS
+from views import Render, RENDERERS, trend_spec
+from export import Exporter, EXPORT_FORMATS
+from instrument import Trace, STAGE_STATS
+from background import BackgroundExecutor, SessionToken
 
 DEBUG = False
+# aggregate from the Parquet file instead of keeping the sales in memory
+STREAMING = os.environ.get('FACTOR_STREAMING') == '1'
+MEMORY_BUDGET_MB = int(os.environ.get('FACTOR_MEMORY_BUDGET_MB', 256))
+# a run with a job in the background reruns after this many seconds to check on it
+POLL_SECONDS = 0.25
 def log(s: str):
     if DEBUG:
         print(s)
 
+# one JSON line per pipeline span on stderr with FACTOR_LOG_SPANS=1
+span_logger = logging.getLogger('factor.spans')
+if not span_logger.handlers:
+    span_logger.addHandler(logging.StreamHandler())
+    span_logger.setLevel(logging.DEBUG if os.environ.get('FACTOR_LOG_SPANS') == '1' else logging.INFO)
+    span_logger.propagate = False
+
 ## -------------- SETTING LAYOUT ---------------
 st.set_page_config(layout="wide")
-tab_graphs, tab_df, tab_params = st.tabs(["Graphs", "DataFrames", "Parameters"])
+tab_graphs, tab_df, tab_trend, tab_params = st.tabs(["Graphs", "DataFrames", "Trend", "Parameters"])
 
 ## ------------- DATA LOADING ------------
 @st.experimental_singleton
 def load_data():
     """
-    Purpose: load/pull datasets
+    Purpose: load/pull datasets, refreshed in the background when data/ changes
     """
     if 'datasets' not in st.session_state:
         log("Reloading datasets...")
-        return DataSets()
+        return LiveDataSets(DataSets(streaming=STREAMING, memory_budget=MEMORY_BUDGET_MB << 20))
+
+@st.experimental_singleton
+def load_exporter():
+    """
+    Purpose: export files shared by all sessions
+    """
+    return Exporter()
 
-datasets = load_data()
+@st.experimental_singleton
+def load_executor():
+    """
+    Purpose: background jobs of all sessions, so that the script never waits on a superseded request
+    """
+    return BackgroundExecutor()
+
+def poll():
+    """
+    Reruns the script shortly to pick up the result of a background job, the
+    run itself never waits for the job so that a newer click is served at once
+    """
+    time.sleep(POLL_SECONDS)
+    st.experimental_rerun()
+
+live_datasets = load_data()
+# one snapshot per run, a refresh swaps it for the next runs
+datasets = live_datasets.get()
+exporter = load_exporter()
+executor = load_executor()
+if 'session_token' not in st.session_state:
+    st.session_state['session_token'] = SessionToken()
 st.session_state['datasets'] = datasets
 
 df_sales = st.session_state['datasets'].df_sales
@@ -73,6 +122,8 @@ axes_options = {
 
 x_ax = st.sidebar.selectbox("➡️ what's on the X axis?", list(axes_options.keys()), 2)
 y_ax = st.sidebar.selectbox("⬆️ what's on the Y axis?", list(axes_options.keys()), 0)
+abc_cutoff = st.sidebar.slider("🔠 X values making up this % of revenue, the rest go to 'Other'", 50, 100, 100, 5)
+preview_mode = st.sidebar.checkbox("⚡ Preview from a sample of pairs, exact on demand")
 
 
 ## -------------- SIDEBAR FILTERS -------------
@@ -90,6 +141,7 @@ try:
     with tab_graphs:
 
         st.markdown("# Factor analysis demo 🔐 ")
+        status = st.empty()
         draw_column, left_column, mid_column, right_column = st.columns(4)
         left_column.markdown(
                 f'> 📅  Base : {dt_base[0].strftime("%d.%m.%Y")} - {dt_base[1].strftime("%d.%m.%Y")}\n>\n' \
@@ -112,37 +164,113 @@ try:
         my_group = [k for k, v in group_dict.items() if v in m_group]
         my_mark = [k for k, v in mark_dict.items() if v in m_mark]
         
-        # filtering
-        dm = datasets.filter_data(my_channel, my_dept, my_brand, my_manager, my_group, my_mark, date_base_start, date_base_end_convert, date_fact_start, date_fact_end_convert)
-        dm1, pivot_price, pivot_cost, pivot_vol = datasets.preprocess_data(dm, df_products, df_clients, branch_dict, x_ax, y_ax)
-        renderer = Render(datasets)
-
+        # filtering, in the background unless the result is cached
+        run_trace = Trace()
+        request = AnalysisRequest.create(my_channel, my_dept, my_brand, my_manager, my_group, my_mark, date_base_start, date_base_end_convert, date_fact_start, date_fact_end_convert, x_ax, y_ax, abc_cutoff / 100)
+        result, job, job_spans = datasets.analyzed(request), None, []
+        if result is None and preview_mode and st.session_state.get('exact_key') != datasets.result_key(request):
+            # estimates in a fraction of the time, the exact result is computed on a click
+            with run_trace:
+                result = datasets.preview(request)
+        if result is None:
+            job = executor.submit(st.session_state['session_token'], datasets.result_key(request), datasets.analyze, request)
+            if job.done():
+                result, job_spans, job = job.result(), job.spans, None
+        if result is not None:
+            st.session_state['last_good'] = (request, result)
+        elif 'last_good' not in st.session_state:
+            # nothing to show meanwhile
+            status.info(f'⏳ Computing: {job.progress()}')
+            poll()
+        else:
+            # the last good result stays on screen until the job is done
+            request, result = st.session_state['last_good']
+            status.info(f'⏳ Showing the previous result, computing the new one: {job.progress()}')
+        totals, pivot_price, pivot_cost, pivot_vol = result.totals, result.pivot_price, result.pivot_cost, result.pivot_vol
+        renderer = Render(result)
+
+        approx = '≈' if result.bounds is not None else ''
         mid_column.markdown(
-            f"> 💰 Profit of base period = {dm1['Profit base'].sum():,.0f}\n>\n" \
-            f"> 💰 Profit of fact period = {dm1['Profit fact'].sum():,.0f}")
+            f"> 💰 Profit of base period = {approx}{totals['Profit base']:,.0f}\n>\n" \
+            f"> 💰 Profit of fact period = {approx}{totals['Profit fact']:,.0f}")
         
         right_column.markdown(
-            f"> 💰 Difference = {dm1['Profit fact'].sum() - dm1['Profit base'].sum():,.0f}\n>\n" \
+            f"> 💰 Difference = {approx}{totals['Profit fact'] - totals['Profit base']:,.0f}\n>\n" \
             f"> ⍨"
             )
 
+        # the figures say which mode produced them
+        if result.bounds is None:
+            draw_column.markdown('> 🎯 Exact result')
+        else:
+            draw_column.markdown(f'> ⚡ Preview from {result.bounds.pairs_sampled:,} of {result.bounds.pairs_total:,} pairs, ± are 95% bounds')
+            if right_column.button('Compute exact result'):
+                st.session_state['exact_key'] = datasets.result_key(request)
+                st.experimental_rerun()
+
         # DRAWING
         with draw_column:
-            drawing_method = st.radio(label="Drawing method:", options=['Seaborn', 'Plotly', 'Altair'], index=2)
+            drawing_method = st.radio(label="Drawing method:", options=list(RENDERERS), index=list(RENDERERS).index('Altair'))
 
-        renderer.render(st, method=drawing_method, angle=-60)
+        with run_trace:
+            renderer.render(st, method=drawing_method, angle=-60)
 
 
     # show df
     with tab_df:
         st.markdown('# Output DataFrames')
-        st.write("dm shape:", dm1.shape)
+        st.write("product-client pairs:", totals['pairs'])
         st.markdown('### Price:')
         st.table(pivot_price)
         st.markdown('### Cost:')
         st.table(pivot_cost)
         st.markdown('### Volume:')
         st.table(pivot_vol)
+        if result.bounds is not None:
+            st.markdown('### ± of the preview (95% bounds):')
+            for factor_name, factor_col in zip(['Price', 'Cost', 'Volume'], FACTOR_COLS):
+                st.markdown(f'#### {factor_name} ±')
+                st.table(result.bounds.pivot(factor_col))
+
+        # needs dm1, only built when asked for
+        st.markdown('### Drill-down')
+        if st.checkbox('Drill down into a cell'):
+            cell_x_col, cell_y_col, level_col = st.columns(3)
+            cell_x = cell_x_col.selectbox(f'{x_ax}:', list(pivot_price.columns))
+            cell_y = cell_y_col.selectbox(f'{y_ax}:', list(pivot_price.index))
+            level = level_col.selectbox('Top:', list(DRILL_LEVELS) + list(datasets.axes_options))
+            drill = result.cell(cell_x, cell_y)
+
+            # every narrowing step offers the values left in the rows of the previous one
+            step = 0
+            while True:
+                narrow_col, value_col, _ = st.columns(3)
+                narrow_by = narrow_col.selectbox('Narrow to:', ['-'] + list(datasets.axes_options), key=f'drill_by_{step}')
+                if narrow_by == '-':
+                    break
+                dim = datasets.axes_options[narrow_by]
+                drill = drill.where(dim, value_col.selectbox(f'{narrow_by}:', drill.values(dim), key=f'drill_value_{step}'))
+                step += 1
+
+            st.write(' / '.join(f'{col} = {value}' for col, value in drill.path), f'({len(drill)} pairs)')
+            st.dataframe(drill.top(level if level in DRILL_LEVELS else datasets.axes_options[level]))
+
+
+    # consecutive months up to the fact period, aggregated in one pass when asked for
+    with tab_trend:
+        st.markdown('# Factors month by month')
+        if st.checkbox('Decompose consecutive months'):
+            months_col, mode_col, by_col = st.columns(3)
+            trend_months = months_col.slider('Months', 2, 24, 12)
+            trend_mode = mode_col.radio('Compare every month with', ['the month before', 'the first month'])
+            trend_by = by_col.selectbox('Split by', ['-'] + list(datasets.axes_options))
+            trend_start = pd.Timestamp(date_fact_end.year, date_fact_end.month, 1) - relativedelta(months=trend_months - 1)
+            series_request = SeriesRequest.create(my_channel, my_dept, my_brand, my_manager, my_group, my_mark, trend_start, trend_months, 'MS',
+                                                  'adjacent' if trend_mode == 'the month before' else 'fixed', None if trend_by == '-' else trend_by)
+            with run_trace:
+                trend = datasets.series(series_request)
+            st.vega_lite_chart(spec=trend_spec(trend))
+            st.dataframe(trend)
 
 
     # debug info
@@ -150,51 +278,51 @@ try:
         st.markdown('# Parameters and Filters')
         st.write('Axis Х:', x_ax)
         st.write('Axis У:', y_ax)
+        st.write('ABC cutoff on X, %:', abc_cutoff)
         st.write('Branch:', my_dept)
         st.write('Channel:', my_channel)
         st.write('Brand:', my_brand)
         st.write('Manager:', my_manager)
         st.write('Group:', my_group)    
         st.write('Mark:', my_mark)
-
-
-    ## ------ EXPORT TO EXCEL ------
-    @st.experimental_memo
-    def calc_export(dept=my_dept, channel=my_channel, brand=my_brand, manager=my_manager, group=my_group, mark=my_mark):
-        strIO = io.BytesIO()
-        with pd.ExcelWriter(strIO, engine='xlsxwriter') as writer:
-            sheet_name = 'product-client'
-            dm1.to_excel(writer, sheet_name = sheet_name, startrow=0, header=True, index=True, index_label=None)
-            workbook = writer.book
-            worksheet = writer.sheets[sheet_name]
-            format1 = workbook.add_format({'num_format': '#,##0.00'})
-            worksheet.set_column('F:F', 15)
-            worksheet.set_column('R:AI', 12, format1)
-            worksheet.freeze_panes(1, 0)
-            header_format1 = workbook.add_format({
-            'bold': True,
-            'text_wrap': True,
-            'valign': 'top',
-            'fg_color': '#A8CED2',
-            'border': 1})
-            
-            for col_num, value in enumerate(dm1.columns.values):
-                worksheet.write(0, col_num + 1, value, header_format1)      
-        
-        strIO.seek(0)
-        return strIO
-
+        st.markdown('### Data')
+        st.write('Version:', datasets.version)
+        if live_datasets.last_error is not None:
+            st.write('Last refresh failed:', live_datasets.last_error)
+        st.markdown('### Result cache')
+        st.write(datasets.cache.stats())
+        st.markdown('### Stages of this run')
+        st.dataframe(pd.DataFrame([s.record() for s in job_spans] + run_trace.records()))
+        st.markdown('### Stage latency percentiles, s (all sessions)')
+        st.dataframe(pd.DataFrame(STAGE_STATS.summary()))
+
+
+    ## ------ EXPORT ------
+    # dm1 is only built here and streamed to a temp file kept per request key;
+    # the button of the run that prepared it holds the file's bytes until the next rerun
     st.sidebar.markdown('---')
-    st.sidebar.download_button( label="💾 Export to excel", 
-                                data=calc_export(),
-                                file_name='profit_analysis.xlsx',
-                                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                            )
+    export_format = st.sidebar.selectbox("💾 Export format", list(EXPORT_FORMATS))
+    export_key = (datasets.version,) + request.data_key()
+    if st.sidebar.button("Prepare export"):
+        file_name, mime = EXPORT_FORMATS[export_format]
+        with exporter.served(result.dm1, export_key, export_format) as export_file:
+            st.sidebar.download_button( label=f"💾 Download {file_name}",
+                                        data=export_file,
+                                        file_name=file_name,
+                                        mime=mime,
+                                    )
     st.sidebar.markdown('---')
 
+    # the page shows the previous result until a rerun finds the new one
+    if job is not None:
+        poll()
+
 except IndexError as ie:
     st.error("Pick an appropriate date interval please.")
 
+except StaleResult:
+    st.info("The data was refreshed, the new result is on its way.")
+
 except ValueError as ve:
     st.error("You should choose different values for X and Y axes.")
 
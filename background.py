@@ -0,0 +1,149 @@
+"""
+Background computation of the analysis requests of the app sessions.
+
+Every sidebar click reruns app.py from the top. Instead of computing in the
+script thread, a run submits its request to the BackgroundExecutor:
+  * a job waits DEBOUNCE_SECONDS on a timer before it is handed to the
+    pool, so of a burst of clicks only the last request is computed and
+    waiting jobs hold no pool thread,
+  * a newer request of the same session cancels the previous job: it is
+    dropped when it has not started yet, stopped at the start of its next
+    pipeline stage otherwise (every stage opens a span, see instrument.py),
+  * sessions asking for the same request at the same time share one job; a
+    request that comes back later is answered from the DataSets result cache.
+Meanwhile the session shows its last good result and the stage the job is in.
+The pool has FACTOR_JOB_WORKERS threads (0 for every core).
+"""
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from instrument import Trace
+
+DEBOUNCE_SECONDS = 0.3
+DEFAULT_JOB_WORKERS = 4
+
+
+def job_workers() -> int:
+    """
+    FACTOR_JOB_WORKERS from the environment, 0 meaning every core
+    """
+    workers = int(os.environ.get('FACTOR_JOB_WORKERS', DEFAULT_JOB_WORKERS))
+    return workers if workers > 0 else os.cpu_count()
+
+
+class Cancelled(Exception):
+    """
+    Raised in a job whose request was replaced by a newer one
+    """
+
+
+class SessionToken():
+    """
+    Identifies a session to the executor, kept in its session state: the
+    executor forgets the session when the token is gone
+    """
+
+
+class Job(Trace):
+    """
+    One request computed in the background, its spans are recorded like those of an app run
+    """
+    def __init__(self, key) -> None:
+        super().__init__('job')
+        self.key = key
+        # pending until the debounce timer hands the job to the pool
+        self.future = Future()
+        self.timer = None
+        self.stage = None
+        self.sessions = 0
+        self.submitted = time.monotonic()
+        self._cancelled = threading.Event()
+
+    def started(self, s) -> None:
+        if self._cancelled.is_set():
+            raise Cancelled(self.key)
+        self.stage = s.stage
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        if self.timer is not None:
+            self.timer.cancel()
+        self.future.cancel()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: float = None):
+        return self.future.result(timeout)
+
+    def progress(self) -> str:
+        elapsed = time.monotonic() - self.submitted
+        if self.stage is None:
+            return f'waiting to start ({elapsed:.1f} s)'
+        return f'{self.stage}, {len(self.spans)} stages done ({elapsed:.1f} s)'
+
+
+class BackgroundExecutor():
+    def __init__(self, workers: int = None, debounce: float = DEBOUNCE_SECONDS) -> None:
+        self.pool = ThreadPoolExecutor(workers or job_workers(), thread_name_prefix='factor-job')
+        self.debounce = debounce
+        # key -> unfinished job, shared by the sessions asking for it
+        self._jobs = {}
+        # session -> its latest job
+        self._latest = weakref.WeakKeyDictionary()
+        # reentrant: a job finishing at once calls back into _forget under the lock
+        self._lock = threading.RLock()
+
+    def submit(self, session: SessionToken, key, fn, *args) -> Job:
+        """
+        Job computing fn(*args) for the session, key identifying the request:
+        the session's current job when it has the same key, otherwise a new or
+        shared one, the previous job being cancelled unless another session waits for it
+        """
+        with self._lock:
+            job = self._latest.get(session)
+            if job is not None and job.key == key and not job.cancelled:
+                return job
+            if job is not None:
+                self._release(job)
+
+            job = self._jobs.get(key)
+            if job is None:
+                job = Job(key)
+                self._jobs[key] = job
+                job.future.add_done_callback(lambda _, job=job: self._forget(job))
+                # a newer request within the debounce window cancels the job before it starts
+                job.timer = threading.Timer(self.debounce, self.pool.submit, (self._run, job, fn, args))
+                job.timer.daemon = True
+                job.timer.start()
+            job.sessions += 1
+            self._latest[session] = job
+        return job
+
+    def _release(self, job: Job) -> None:
+        job.sessions -= 1
+        if job.sessions == 0 and not job.done():
+            job.cancel()
+            self._forget(job)
+
+    def _forget(self, job: Job) -> None:
+        with self._lock:
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+
+    def _run(self, job: Job, fn, args: tuple) -> None:
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            with job:
+                result = fn(*args)
+        except BaseException as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
@@ -0,0 +1,192 @@
+"""
+Headless batch run of the factor analysis for many slices.
+
+The dataset is loaded once and handed to a pool of worker processes through
+shared memory (see shared.py). Every job runs DataSets.filter_data and
+preprocess_data and writes two partitioned Parquet datasets, plus a summary
+manifest:
+
+    out_dir/cells/job=<id>/part.parquet            (x, y, the three factors, revenue)
+    out_dir/product_client/job=<id>/part.parquet   (dm1)
+    out_dir/manifest.json
+
+Usage:
+    python batch.py jobs.json out_dir [--workers N] [--no-product-client]
+
+jobs.json:
+    {
+        "periods": [{"base": ["2022-01-01", "2022-03-31"], "fact": ["2022-04-01", "2022-06-30"]}],
+        "axes": [["Brand", "Branch"]],
+        "filters": {"marks": [2]},
+        "each": ["depts", "channels"],
+        "jobs": [{"name": "diy", "channels": [1], "base": [...], "fact": [...], "x_ax": "Group", "y_ax": "Brand"}]
+    }
+
+Every period x axes x combination of single values of the "each" filters
+becomes a job, with "filters" applied to all of them. "jobs" lists extra
+jobs explicitly. End dates without a time include the whole day.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from datasets import DataSets
+from analysis import AnalysisRequest
+from shared import SharedPayload, attach
+from kernel import FACTOR_COLS
+from pivots import REVENUE_COL
+
+# filter_data argument -> DataSets dictionary of its values
+FILTER_DICTS = {
+    'channels': 'channel_dict',
+    'depts': 'branch_dict',
+    'brands': 'brand_dict',
+    'managers': 'manager_dict',
+    'groups': 'group_dict',
+    'marks': 'mark_dict',
+}
+
+_datasets = None
+
+
+def parse_window(window) -> tuple:
+    """
+    [start, end] strings to Timestamps, an end without time covers the whole day
+    """
+    start, end = pd.Timestamp(window[0]), pd.Timestamp(window[1])
+    if end == end.normalize():
+        end += pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return start, end
+
+
+def make_request(job: dict) -> AnalysisRequest:
+    base, fact = parse_window(job['base']), parse_window(job['fact'])
+    filters = [job.get(name, []) for name in FILTER_DICTS]
+    return AnalysisRequest.create(*filters, *base, *fact, job['x_ax'], job['y_ax'], job.get('abc_cutoff', 1.0))
+
+
+def expand_jobs(spec: dict, datasets: DataSets) -> list:
+    """
+    (job id, job dict) for every job described by the spec
+    """
+    jobs = []
+    each = spec.get('each', [])
+    values = [sorted(getattr(datasets, FILTER_DICTS[name])) for name in each]
+    for (p, period), axes in itertools.product(enumerate(spec.get('periods', [])), spec.get('axes', [])):
+        for combination in itertools.product(*values):
+            job = dict(spec.get('filters', {}))
+            job.update({name: [value] for name, value in zip(each, combination)})
+            job.update({'base': period['base'], 'fact': period['fact'], 'x_ax': axes[0], 'y_ax': axes[1]})
+            labels = [f'period{p}', f'{axes[0]}-{axes[1]}'] + [f'{name}{value}' for name, value in zip(each, combination)]
+            jobs.append(('_'.join(labels), job))
+
+    for n, job in enumerate(spec.get('jobs', [])):
+        jobs.append((str(job.get('name', f'job{n}')), job))
+    return jobs
+
+
+def _init_worker(payload: bytes) -> None:
+    global _datasets
+    _datasets = attach(payload)
+
+
+def run_job(datasets: DataSets, job_id: str, job: dict, out_dir: str, product_client: bool = True) -> dict:
+    """
+    Runs one job and writes its partitions, returns its manifest entry
+    """
+    started = time.perf_counter()
+    summary = {'job': job_id, 'spec': job}
+    try:
+        request = make_request(job)
+        dm = datasets.filter_data(*request.filter_args())
+        result = datasets.preprocess_data(dm, datasets.df_products, datasets.df_clients, datasets.branch_dict,
+                                          request.x_ax, request.y_ax, request.abc_cutoff)
+
+        cells = result.pivots.cells.rename(columns={result.pivots.x_axis: 'x', result.pivots.y_axis: 'y'})
+        summary['cells_path'] = write_partition(cells, out_dir, 'cells', job_id)
+        if product_client:
+            summary['product_client_path'] = write_partition(result.dm1, out_dir, 'product_client', job_id)
+
+        summary.update({
+            'status': 'ok',
+            'rows': len(result.dm1),
+            'cells': len(cells),
+            'profit_base': float(result.dm1['Profit base'].sum()),
+            'profit_fact': float(result.dm1['Profit fact'].sum()),
+            'revenue_fact': float(result.dm1[REVENUE_COL].sum()),
+        })
+        summary.update({col: float(result.dm1[col].sum()) for col in FACTOR_COLS})
+    except Exception as e:
+        summary.update({'status': 'failed', 'error': f'{type(e).__name__}: {e}'})
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+
+def _run_job_in_worker(job_id: str, job: dict, out_dir: str, product_client: bool) -> dict:
+    return run_job(_datasets, job_id, job, out_dir, product_client)
+
+
+def write_partition(df: pd.DataFrame, out_dir: str, dataset: str, job_id: str) -> str:
+    directory = os.path.join(out_dir, dataset, f'job={job_id}')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'part.parquet')
+    df.to_parquet(path, index=False)
+    return os.path.relpath(path, out_dir)
+
+
+def run_batch(spec: dict, out_dir: str, workers: int = None, product_client: bool = True) -> dict:
+    """
+    Runs every job of the spec on `workers` processes (in this process when 1)
+    and writes out_dir/manifest.json
+    """
+    workers = workers or os.cpu_count()
+    started = time.perf_counter()
+    datasets = DataSets()
+    jobs = expand_jobs(spec, datasets)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {
+        'data_version': datasets.version,
+        'workers': workers,
+        'load_seconds': time.perf_counter() - started,
+    }
+
+    started = time.perf_counter()
+    if workers == 1:
+        results = [run_job(datasets, job_id, job, out_dir, product_client) for job_id, job in jobs]
+        manifest['shared_bytes'] = 0
+    else:
+        with SharedPayload(datasets) as shared:
+            manifest['shared_bytes'] = shared.nbytes
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(shared.payload,))
+            with pool:
+                futures = [pool.submit(_run_job_in_worker, job_id, job, out_dir, product_client) for job_id, job in jobs]
+                results = [future.result() for future in futures]
+
+    manifest['run_seconds'] = time.perf_counter() - started
+    manifest['jobs_per_second'] = len(jobs) / manifest['run_seconds'] if jobs else 0.0
+    manifest['failed'] = sum(result['status'] != 'ok' for result in results)
+    manifest['jobs'] = results
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch factor analysis')
+    parser.add_argument('spec', help='job spec, JSON')
+    parser.add_argument('out_dir', help='output directory')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--no-product-client', action='store_true', help='skip writing dm1 of every job')
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    manifest = run_batch(spec, args.out_dir, args.workers, not args.no_product_client)
+    print(f"{len(manifest['jobs'])} jobs ({manifest['failed']} failed) in {manifest['run_seconds']:.1f} s "
+          f"on {manifest['workers']} workers, {manifest['jobs_per_second']:.2f} jobs/s")
@@ -0,0 +1,167 @@
+"""
+Microbenchmark of the factor-decomposition kernel against the pandas chain
+preprocess_data used before (string keys, in-place replace/fillna, joins, renames).
+
+Usage (from the repository root):
+    python -m benchmarks.kernel [n_rows ...]      default: 1000000 10000000 50000000
+
+Both implementations are warmed up first, the times are the best of REPEAT runs.
+"""
+import gc
+import sys
+import time
+import numpy as np
+import pandas as pd
+from kernel import factor_table, FACTOR_COLS
+
+# best of REPEAT runs, after a warm-up on WARMUP_ROWS
+REPEAT = 3
+WARMUP_ROWS = 10_000
+
+
+def synthetic_merge(n_rows: int, n_products: int = 20000, n_clients: int = 50000, seed: int = 0):
+    """
+    A filter_data-like outer merge of base/fact sums plus matching dictionaries
+    """
+    rng = np.random.default_rng(seed)
+    product_ids = rng.choice(10 * n_products, n_products, replace=False) + 1
+    client_ids = rng.choice(10 * n_clients, n_clients, replace=False) + 1
+
+    df_products = pd.DataFrame({col: rng.choice([f'{col}-{i}' for i in range(20)], n_products)
+                                for col in ['Article', 'Brand', 'Product_group', 'Mark', 'Manager_Marketing', 'Manager_Supply', 'ABC_XYZ']},
+                               index=pd.Index(product_ids, name='ID_product'))
+    df_clients = pd.DataFrame({
+        'id_branch': rng.integers(0, 24, n_clients),
+        'Channel': rng.choice([f'channel-{i}' for i in range(13)], n_clients),
+        'Client_name': [f'client-{i}' for i in client_ids],
+    }, index=pd.Index(client_ids, name='ID_client'))
+    branch_dict = {i: f'branch-{i}' for i in range(24)}
+
+    dm = pd.DataFrame({
+        'id_commodity': rng.choice(product_ids, n_rows),
+        'id_client': rng.choice(client_ids, n_rows),
+    })
+    for period in ('base', 'fact'):
+        qty = rng.integers(0, 50, n_rows).astype(np.float64)
+        amount = qty * rng.uniform(1, 100, n_rows)
+        dm[f'SalesAmount_{period}'] = amount
+        dm[f'SalesCost_{period}'] = amount * rng.uniform(0.5, 1.05, n_rows)
+        dm[f'SalesQty_{period}'] = qty
+        dm[f'id_branch_{period}'] = df_clients['id_branch'].to_numpy()[rng.integers(0, n_clients, n_rows)].astype(np.float64)
+        # pairs sold in one period only come out of the outer merge with NaN
+        missing = rng.random(n_rows) < 0.15
+        for col in ('SalesAmount', 'SalesCost', 'SalesQty', 'id_branch'):
+            dm.loc[missing, f'{col}_{period}'] = np.nan
+    return dm, df_products, df_clients, branch_dict
+
+
+def legacy_factor_table(dm: pd.DataFrame, df_products, df_clients, branch_dict) -> pd.DataFrame:
+    """
+    The pandas chain of preprocess_data before kernel.py
+    """
+    dm['comm_cl'] = dm.id_commodity.astype(str) + dm.id_client.astype(str)
+    dm['id_department'] = dm.id_branch_base
+    dm.loc[dm.id_department.isnull() == True, 'id_department'] = dm.id_branch_fact
+
+    dm['price_base'] = dm.SalesAmount_base/dm.SalesQty_base
+    dm['price_fact'] = dm.SalesAmount_fact/dm.SalesQty_fact
+    dm['cost_base'] = dm.SalesCost_base/dm.SalesQty_base
+    dm['cost_fact'] = dm.SalesCost_fact/dm.SalesQty_fact
+
+    dm.replace([np.inf, -np.inf], np.nan, inplace=True)
+    dm.fillna(0, inplace=True)
+
+    dm['pr_base'] = dm.SalesAmount_base - dm.SalesCost_base
+    dm['pr_fact'] = dm.SalesAmount_fact - dm.SalesCost_fact
+    dm['rent_base'] = dm.pr_base / dm.SalesCost_base
+    dm['rent_fact'] = dm.pr_fact / dm.SalesCost_fact
+
+    dm.reset_index(inplace=True)
+    order_col = ['id_commodity', 'id_client', 'comm_cl', 'id_department',
+                 'SalesAmount_base', 'SalesCost_base', 'SalesQty_base', 'pr_base', 'rent_base',
+                 'SalesAmount_fact', 'SalesCost_fact', 'SalesQty_fact', 'pr_fact', 'rent_fact',
+                 'price_base', 'price_fact', 'cost_base', 'cost_fact']
+    dm = dm[order_col]
+
+    dm['is_absent'] = (dm.SalesQty_base == 0) + (dm.SalesQty_fact == 0) + (dm.SalesCost_base < 0) + (dm.SalesCost_fact < 0)
+    dm['delta_price'] = np.where(dm.is_absent > 0, 0, (dm.price_fact - dm.price_base) * dm.SalesQty_fact)
+    dm['delta_cost'] = np.where(dm.is_absent > 0, 0, (dm.cost_base - dm.cost_fact) * dm.SalesQty_fact)
+    dm['delta_vol'] = np.where(dm.is_absent > 0, dm.pr_fact - dm.pr_base, (dm.SalesQty_fact - dm.SalesQty_base) * (dm.price_base - dm.cost_base))
+
+    my_cols_eng = ['Article', 'Brand', 'Product_group', 'Mark', 'Manager_Marketing', 'Manager_Supply', 'ABC_XYZ']
+    my_cl_cols_eng = ['id_branch', 'Channel', 'Client_name']
+
+    dm1 = df_products[my_cols_eng].join(dm.set_index('id_commodity'), how='right').reset_index().set_index('id_client').join(df_clients[my_cl_cols_eng]).reset_index()
+    dm1.rename(columns = {'level_0': 'id_client', 'index':'id_commodity', 'ID_product': 'id_commodity', 'ID_client': 'id_client'}, inplace=True)
+    dm1['branch'] = dm1.id_branch.map(branch_dict)
+
+    dm1 = dm1.rename(columns = {
+        'SalesAmount_base':'Revenue base', 'SalesCost_base': 'Cost of Sales base', 'SalesQty_base': 'Sales base, pcs',
+        'pr_base': 'Profit base', 'rent_base': 'Profitability base',
+        'SalesAmount_fact' : 'Revenue fact', 'SalesCost_fact': 'Cost of Sales fact', 'SalesQty_fact': 'Sales fact, pcs',
+        'pr_fact': 'Profit fact', 'rent_fact': 'Profitability fact',
+        'price_base': 'Price 1 piece base', 'price_fact': 'Price 1 piece fact',
+        'cost_base': 'Cost 1 piece base', 'cost_fact': 'Cost 1 piece fact',
+        'delta_price': 'Сhange in profit due to price', 'delta_cost': 'Сhange in profit due to cost',
+        'delta_vol': 'Сhange in profit due to structure', 'comm_cl': 'id product-client',
+    })
+    return dm1
+
+
+def check_same(new: pd.DataFrame, old: pd.DataFrame) -> None:
+    """
+    Raises AssertionError when the kernel disagrees with the legacy chain
+    """
+    for col in new.columns:
+        if col == 'id product-client':
+            continue
+        a, b = new[col], old[col]
+        if a.dtype.kind in 'fb':
+            assert np.array_equal(a.to_numpy(dtype=np.float64), b.to_numpy(dtype=np.float64), equal_nan=True), col
+        else:
+            assert a.astype(object).fillna('').tolist() == b.astype(object).fillna('').tolist(), col
+
+
+def best_seconds(fn, make_args, repeat: int):
+    """
+    Calls fn(*make_args()) `repeat` times, returns (last result, best seconds).
+    The arguments are made outside the timing
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        args = make_args()
+        gc.collect()
+        started = time.perf_counter()
+        result = fn(*args)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return result, best
+
+
+def run(n_rows: int, repeat: int = REPEAT) -> dict:
+    dm, df_products, df_clients, branch_dict = synthetic_merge(n_rows)
+
+    # first calls pay for imports, allocator growth and pandas' lazy setup
+    warm = synthetic_merge(WARMUP_ROWS)
+    factor_table(*warm)
+    legacy_factor_table(warm[0].copy(), *warm[1:])
+
+    new, kernel_seconds = best_seconds(factor_table, lambda: (dm, df_products, df_clients, branch_dict), repeat)
+    old, legacy_seconds = best_seconds(legacy_factor_table, lambda: (dm.copy(), df_products, df_clients, branch_dict), repeat)
+
+    check_same(new, old)
+    return {
+        'rows': n_rows,
+        'legacy_seconds': legacy_seconds,
+        'kernel_seconds': kernel_seconds,
+        'speedup': legacy_seconds / kernel_seconds,
+        'factor_sums': new[FACTOR_COLS].sum().round(2).tolist(),
+    }
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000_000, 10_000_000, 50_000_000]
+    print(f"{'rows':>12} {'legacy, s':>10} {'kernel, s':>10} {'speedup':>8}")
+    for n_rows in sizes:
+        result = run(n_rows)
+        print(f"{result['rows']:>12,} {result['legacy_seconds']:>10.2f} {result['kernel_seconds']:>10.2f} {result['speedup']:>7.1f}x")
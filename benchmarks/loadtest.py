@@ -0,0 +1,183 @@
+"""
+Load test of the HTTP service (server.py): requests per second and latency
+percentiles at a given concurrency.
+
+Client threads send POST /analyze (or /batch) bodies of --distinct different
+filter combinations (one channel and one brand each) over the default
+base/fact quarters, in two phases reported separately: the cold phase sends
+every body once, computing each result, then the warm phase cycles through
+them for --requests requests answered from the result cache. Start the
+server yourself and pass --url (a service that saw the bodies before has no
+cold requests left), or let the test start one in-process on the data/ of
+--serve.
+
+Usage (from the repository root):
+    python -m benchmarks.loadtest --url http://127.0.0.1:8056 [--concurrency 8] [--requests 2000]
+    python -m benchmarks.loadtest --serve bench-data/rows-1000000 [--server-workers 8]
+        [--endpoint analyze|batch] [--output pivots|totals|dm1] [--mode exact|preview] [--format json|arrow]
+        [--distinct 50] [--out loadtest.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+from benchmarks.suite import ROOT, windows
+
+PERCENTILES = [50, 90, 99]
+
+
+def get_json(url: str):
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def make_bodies(url: str, endpoint: str, output: str, mode: str, distinct: int) -> list:
+    """
+    JSON bodies of `distinct` different requests, from the service's dimensions and dates
+    """
+    health = get_json(f'{url}/health')
+    dimensions = get_json(f'{url}/dimensions')
+    if health.get('last_sale') is None:
+        sys.exit('the service does not report its dates (streaming mode), pass a data set kept in memory')
+    base_start, base_end, fact_start, fact_end = windows(pd.Series([pd.Timestamp(health['last_sale'])]))['aligned']
+    period = {'base': [str(base_start), str(base_end)], 'fact': [str(fact_start), str(fact_end)]}
+
+    combinations = itertools.islice(itertools.product(sorted(dimensions['channels'], key=int), sorted(dimensions['brands'], key=int)), distinct)
+    bodies = []
+    for channel, brand in combinations:
+        job = dict(period, channels=[int(channel)], brands=[int(brand)], x_ax='Brand', y_ax='Branch', mode=mode)
+        if endpoint == 'analyze':
+            body = dict(job, output=output)
+        else:
+            # the branches of one channel and brand, one slice each
+            body = {'periods': [period], 'axes': [['Group', 'Manager']], 'filters': {'channels': [int(channel)], 'brands': [int(brand)]},
+                    'each': ['depts'], 'output': output, 'mode': mode}
+        bodies.append(json.dumps(body).encode())
+    return bodies
+
+
+def load(url: str, bodies: list, concurrency: int, requests: int, arrow: bool) -> dict:
+    """
+    Statistics of the cold phase, every body sent once, and of the warm
+    phase, `requests` bodies, each sent from `concurrency` threads
+    """
+    headers = {'Content-Type': 'application/json'}
+    if arrow:
+        headers['Accept'] = 'application/vnd.apache.arrow.stream'
+    return {
+        'cold': send(url, bodies, headers, concurrency, len(bodies)),
+        'warm': send(url, bodies, headers, concurrency, requests),
+    }
+
+
+def send(url: str, bodies: list, headers: dict, concurrency: int, requests: int) -> dict:
+    """
+    Sends `requests` bodies in turn from `concurrency` threads, returns the statistics
+    """
+    latencies, errors, received = [], [], [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+
+    def client() -> None:
+        while True:
+            n = next(counter)
+            if n >= requests:
+                return
+            request = urllib.request.Request(url, data=bodies[n % len(bodies)], headers=headers, method='POST')
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    size = len(response.read())
+                error = None
+            except urllib.error.HTTPError as e:
+                size, error = 0, f'{e.code}: {e.read()[:200]!r}'
+            except OSError as e:
+                size, error = 0, f'{type(e).__name__}: {e}'
+            seconds = time.perf_counter() - started
+            with lock:
+                latencies.append(seconds)
+                received[0] += size
+                if error is not None:
+                    errors.append(error)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'bytes_per_request': received[0] / max(len(latencies) - len(errors), 1),
+        'first_errors': errors[:5],
+    }
+    if latencies:
+        stats.update({f'p{p}_ms': float(v) * 1000 for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))})
+    return stats
+
+
+def start_server(data_dir: str, workers: int) -> tuple:
+    """
+    Service on a free local port over data_dir/data, run in a background thread
+    """
+    os.chdir(data_dir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from server import serve
+    server = serve('127.0.0.1', 0, workers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP service load test')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='running service, e.g. http://127.0.0.1:8056')
+    target.add_argument('--serve', help='start a service in-process on the data/ of this directory')
+    parser.add_argument('--server-workers', type=int, default=8, help='worker threads of the in-process service')
+    parser.add_argument('--endpoint', choices=['analyze', 'batch'], default='analyze')
+    parser.add_argument('--output', choices=['pivots', 'totals', 'dm1'], default='pivots')
+    parser.add_argument('--mode', choices=['exact', 'preview'], default='exact')
+    parser.add_argument('--format', choices=['json', 'arrow'], default='json')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--distinct', type=int, default=50, help='different requests cycled through')
+    parser.add_argument('--out', help='write the statistics to this JSON file')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if args.serve:
+        server, url = start_server(os.path.abspath(args.serve), args.server_workers)
+    url = url.rstrip('/')
+    try:
+        bodies = make_bodies(url, args.endpoint, args.output, args.mode, args.distinct)
+        stats = load(f'{url}/{args.endpoint}', bodies, args.concurrency, args.requests, args.format == 'arrow')
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    stats.update({'endpoint': args.endpoint, 'output': args.output, 'mode': args.mode, 'format': args.format,
+                  'concurrency': args.concurrency, 'distinct': len(bodies)})
+    for phase in ['cold', 'warm']:
+        phase_stats = stats[phase]
+        if not phase_stats['requests']:
+            continue
+        print(f"{phase}: {phase_stats['requests']} requests ({phase_stats['errors']} errors) in {phase_stats['seconds']:.1f} s at concurrency {args.concurrency}: "
+              f"{phase_stats['requests_per_second']:.1f} req/s, p50 {phase_stats['p50_ms']:.1f} ms, p90 {phase_stats['p90_ms']:.1f} ms, p99 {phase_stats['p99_ms']:.1f} ms")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(stats, f, indent=2)
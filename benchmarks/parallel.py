@@ -0,0 +1,70 @@
+"""
+Speedup of the commodity-partitioned execution (parallel.py) over the
+single-threaded path, for the default quarter-on-quarter analysis.
+
+For every worker count the same DataSets answers a month-aligned window pair
+(from the cube) and the same pair shifted by half a day (from the raw rows),
+with the result cache cleared, and the product-client table is checked to be
+identical to the single-threaded one.
+
+Usage (from the repository root):
+    python -m benchmarks.parallel --rows 10000000 --workers 1 2 4 8 16 32 [--workdir bench-data] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+from benchmarks.suite import ROOT, scale_data, windows
+
+
+def run(rows: int, workers_list: list, workdir: str, repeat: int) -> list:
+    from store import STORE_PATH, build_store
+    from cube import SalesCube, CUBE_MONTHLY_PATH
+    from datasets import DataSets
+    from analysis import AnalysisRequest
+
+    cwd = os.getcwd()
+    os.chdir(scale_data(rows, workdir))
+    try:
+        if not os.path.exists(STORE_PATH):
+            build_store()
+        if not os.path.exists(CUBE_MONTHLY_PATH):
+            SalesCube.build(pd.read_parquet(STORE_PATH)).save()
+
+        ds = DataSets(workers=1)
+        results, reference = [], {}
+        for window_name, window in windows(ds.df_sales['DocumentDate']).items():
+            request = AnalysisRequest.create([], [], [], [], [], [], *window, 'Brand', 'Branch')
+            for workers in workers_list:
+                ds.workers = workers
+                best = None
+                for _ in range(repeat):
+                    ds.cache.clear()
+                    started = time.perf_counter()
+                    result = ds.analyze(request)
+                    seconds = time.perf_counter() - started
+                    best = seconds if best is None else min(best, seconds)
+
+                if window_name not in reference:
+                    reference[window_name] = (result.dm1, best)
+                pd.testing.assert_frame_equal(result.dm1, reference[window_name][0], check_exact=True)
+                speedup = reference[window_name][1] / best
+                results.append({'window': window_name, 'workers': workers, 'seconds': best, 'speedup': speedup})
+                print(f'{window_name:<10} {workers:>3} workers {best:>8.3f} s {speedup:>6.2f}x  ({len(result.dm1):,} pairs)')
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partitioned aggregation speedup')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--workdir', default=os.path.join(ROOT, 'bench-data'))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.workers[0] != 1:
+        sys.exit('the first worker count is the baseline, use 1')
+    run(args.rows, args.workers, os.path.abspath(args.workdir), args.repeat)
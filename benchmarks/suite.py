@@ -0,0 +1,222 @@
+"""
+Benchmark suite of the data pipeline across data scales and filter selectivities.
+
+For every scale the synthetic data is generated (or reused), the store and
+the cube are built, and each stage is timed (best of --repeat) with its
+peak traced allocations: DataSets.__init__, filter_data, preprocess_data's
+kernel, the pivot construction, the 12-month series decomposition and each
+Render method. Results are written as
+JSON so that runs can be compared.
+
+Usage (from the repository root):
+    python -m benchmarks.suite --rows 1000000 10000000 --out bench.json [--workdir bench-data]
+    python -m benchmarks.suite --compare baseline.json bench.json [--threshold 1.2]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tracemalloc
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import generate
+from instrument import span
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# axes of the pivots, as chosen in the app
+X_AX, Y_AX = 'Brand', 'Branch'
+
+# periods of the series stage
+SERIES_MONTHS = 12
+
+# name -> filter_data dimension arguments, from least to most selective
+SELECTIVITIES = {
+    'all': {},
+    'channel': {'channels': [1]},
+    'channel+brand': {'channels': [1], 'brands': [2, 3]},
+    'branch+brand+mark': {'depts': [0], 'brands': [2], 'marks': [1]},
+}
+
+
+def measure(fn, repeat: int = 1):
+    """
+    Runs fn `repeat` times, returns (result, best seconds, peak traced bytes of the first run)
+    """
+    best, peak, result = None, None, None
+    for n in range(repeat):
+        gc.collect()
+        if n == 0:
+            tracemalloc.start()
+        # the pipeline's own spans reset the tracemalloc peak, an outer span collects theirs
+        with span('benchmark') as s:
+            result = fn()
+        if n == 0:
+            peak = s.alloc_peak
+            tracemalloc.stop()
+        best = s.seconds if best is None else min(best, s.seconds)
+    return result, best, peak
+
+
+def windows(dates: pd.Series) -> dict:
+    """
+    Month-aligned base/fact quarters at the end of the history (the app's
+    defaults), and the same shifted by half a day to hit the raw-row path
+    """
+    last = dates.max().normalize()
+    fact_start = pd.Timestamp(last.year, last.month, 1) - pd.DateOffset(months=3)
+    base_start = fact_start - pd.DateOffset(months=3)
+    second = pd.Timedelta(seconds=1)
+    aligned = (base_start, fact_start - second, fact_start, fact_start + pd.DateOffset(months=3) - second)
+    half_day = pd.Timedelta(hours=12)
+    return {'aligned': aligned, 'unaligned': tuple(ts + half_day for ts in aligned)}
+
+
+def scale_data(rows: int, workdir: str) -> str:
+    """
+    Directory holding data/ with `rows` synthetic sales, generated on first use
+    """
+    scale_dir = os.path.join(workdir, f'rows-{rows}')
+    if not os.path.exists(os.path.join(scale_dir, 'data', 'df-sales.pq')):
+        generate(scale_dir, rows)
+    return scale_dir
+
+
+def bench_scale(rows: int, workdir: str, repeat: int, render: bool) -> list:
+    from store import build_store
+    from cube import SalesCube
+    from datasets import DataSets
+    from kernel import factor_table
+    from pivots import Pivots
+    from analysis import AnalysisResult
+    from series import SeriesRequest
+
+    scale_dir = scale_data(rows, workdir)
+    results = []
+
+    def record(stage, seconds, peak, **extra):
+        results.append(dict({'rows': rows, 'stage': stage, 'seconds': seconds, 'peak_bytes': peak}, **extra))
+        print(f"{rows:>12,} {stage:<48} {seconds:>9.3f} s {peak / 2**20:>10.1f} MiB", file=sys.stderr)
+
+    cwd = os.getcwd()
+    os.chdir(scale_dir)
+    try:
+        _, seconds, peak = measure(build_store)
+        record('store.build_store', seconds, peak)
+        _, seconds, peak = measure(lambda: SalesCube.build(pd.read_parquet('data/sales-store.pq')).save())
+        record('cube.build', seconds, peak)
+
+        ds, seconds, peak = measure(DataSets, repeat)
+        record('DataSets.__init__', seconds, peak, mapped=ds.mapped)
+
+        for window_name, window in windows(ds.df_sales['DocumentDate']).items():
+            for name, filters in SELECTIVITIES.items():
+                args = [filters.get(arg, []) for arg in ('channels', 'depts', 'brands', 'managers', 'groups', 'marks')]
+
+                def run_filter():
+                    ds.cache.clear()
+                    return ds.filter_data(*args, *window)
+
+                dm, seconds, peak = measure(run_filter, repeat)
+                label = f'{window_name}/{name}'
+                record(f'filter_data[{label}]', seconds, peak, rows_out=len(dm))
+
+                dm1, seconds, peak = measure(lambda: factor_table(dm, ds.df_products, ds.df_clients, ds.branch_dict, ds.workers), repeat)
+                record(f'preprocess_data[{label}]', seconds, peak, rows_in=len(dm), rows_out=len(dm1))
+
+                x_axis, y_axis = ds.axes_options[X_AX], ds.axes_options[Y_AX]
+                pivots, seconds, peak = measure(lambda: Pivots(dm1, x_axis, y_axis), repeat)
+                record(f'pivots[{label}]', seconds, peak, rows_in=len(dm1), rows_out=len(pivots.cells))
+
+                if window_name == 'aligned':
+                    # month over month for the year up to the fact period, one pass over the sales
+                    series_start = window[2] + pd.DateOffset(months=3) - pd.DateOffset(months=SERIES_MONTHS)
+                    series_request = SeriesRequest.create(*args, series_start, SERIES_MONTHS)
+
+                    def run_series():
+                        ds.cache.clear()
+                        return ds.series(series_request)
+
+                    table, seconds, peak = measure(run_series, repeat)
+                    record(f'series[{name}]', seconds, peak, rows_out=len(table))
+
+                if render and window_name == 'aligned' and name == 'all':
+                    try:
+                        import streamlit as st
+                        from views import Render, RENDERERS
+                    except ImportError as e:
+                        print(f'Render skipped: {e}', file=sys.stderr)
+                        continue
+                    result = AnalysisResult(dm1, pivots, X_AX, Y_AX)
+                    for method in RENDERERS:
+                        # a new result has no spec yet: builds and shows it
+                        fresh = lambda: Render(AnalysisResult(dm1, pivots, X_AX, Y_AX, result.totals)).render(st, method=method)
+                        try:
+                            _, seconds, peak = measure(fresh, repeat)
+                        except ImportError as e:
+                            print(f'Render[{method}] skipped: {e}', file=sys.stderr)
+                            continue
+                        record(f'Render[{method}]', seconds, peak, rows_in=len(pivots.cells))
+                        # redrawing the same result only shows the kept spec
+                        Render(result).render(st, method=method)
+                        _, seconds, peak = measure(lambda: Render(result).render(st, method=method), repeat)
+                        record(f'Render[{method}, redraw]', seconds, peak, rows_in=len(pivots.cells))
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def run(rows_list: list, workdir: str, repeat: int, render: bool) -> dict:
+    return {
+        'created': pd.Timestamp.now().isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': [result for rows in rows_list for result in bench_scale(rows, workdir, repeat, render)],
+    }
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """
+    Prints every stage present in both runs, returns the number of regressions
+    (new time above threshold x old time)
+    """
+    with open(old_path) as f:
+        old = {(r['rows'], r['stage']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(r['rows'], r['stage']): r for r in json.load(f)['results']}
+
+    regressions = 0
+    print(f"{'rows':>12} {'stage':<48} {'old, s':>9} {'new, s':>9} {'ratio':>7}")
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key]['seconds'] / max(old[key]['seconds'], 1e-9)
+        flag = ''
+        if ratio > threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        print(f"{key[0]:>12,} {key[1]:<48} {old[key]['seconds']:>9.3f} {new[key]['seconds']:>9.3f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Data pipeline benchmarks')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    parser.add_argument('--workdir', default=os.path.join(ROOT, 'bench-data'), help='where synthetic data is kept')
+    parser.add_argument('--out', default='bench.json')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-render', action='store_true', help='skip the Render methods')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    report = run(args.rows, os.path.abspath(args.workdir), args.repeat, not args.no_render)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'written {args.out}', file=sys.stderr)
@@ -0,0 +1,160 @@
+"""
+Synthetic data in the layout of data/: raw sales, products, clients and the
+six dictionary CSVs.
+
+Product and client popularity follow a Zipf-like law (`skew`), prices are
+log-normal per product, margins vary per product and drift over time,
+quantities are geometric. Sales are written in row groups, so the number of
+rows is limited by disk rather than memory.
+
+Usage (from the repository root):
+    python -m benchmarks.synthetic OUT_DIR --rows 10000000 [--products 5000] [--clients 20000]
+                                   [--skew 1.1] [--start 2021-01-01] [--days 730] [--seed 0]
+    writes OUT_DIR/data/...
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CHUNK_ROWS = 5_000_000
+
+# dictionary -> default number of values
+DIMENSIONS = {
+    'branch': 24,
+    'channel': 13,
+    'brand': 10,
+    'group': 12,
+    'manager': 4,
+    'mark': 4,
+}
+
+
+def zipf_weights(n: int, skew: float, rng) -> np.ndarray:
+    """
+    Popularity of n items, 1/rank^skew over a random permutation of the items
+    """
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def make_dictionaries(sizes: dict) -> dict:
+    return {name: pd.Series([f'{name.capitalize()} {i}' for i in range(n)], name='name') for name, n in sizes.items()}
+
+
+def make_products(n: int, dictionaries: dict, rng) -> pd.DataFrame:
+    ids = rng.choice(np.arange(1, 20 * n + 1), n, replace=False)
+    codes = {name: rng.integers(0, len(dictionaries[name]), n) for name in ('brand', 'group', 'manager', 'mark')}
+    df = pd.DataFrame({
+        'Article': [f'AR-{i}' for i in ids],
+        'Brand': dictionaries['brand'].to_numpy()[codes['brand']],
+        'Product_group': dictionaries['group'].to_numpy()[codes['group']],
+        'Mark': dictionaries['mark'].to_numpy()[codes['mark']],
+        'Manager_Marketing': dictionaries['manager'].to_numpy()[codes['manager']],
+        'Manager_Supply': rng.choice([f'Supply {i}' for i in range(6)], n),
+        'ABC_XYZ': rng.choice([a + x for a in 'ABC' for x in 'XYZ'], n),
+        'id_brand': codes['brand'],
+        'id_manager': codes['manager'],
+        'id_group': codes['group'],
+        'id_mark': codes['mark'],
+    }, index=pd.Index(ids, name='ID_product'))
+    return df
+
+
+def make_clients(n: int, dictionaries: dict, rng) -> pd.DataFrame:
+    ids = rng.choice(np.arange(1, 20 * n + 1), n, replace=False)
+    branch = rng.integers(0, len(dictionaries['branch']), n)
+    channel = rng.integers(0, len(dictionaries['channel']), n)
+    return pd.DataFrame({
+        'id_branch': branch,
+        'Channel': dictionaries['channel'].to_numpy()[channel],
+        'Client_name': [f'client-{i}' for i in ids],
+        'id_channel': channel,
+    }, index=pd.Index(ids, name='ID_client'))
+
+
+def sales_chunks(n_rows: int, products: pd.DataFrame, clients: pd.DataFrame, skew: float,
+                 start: pd.Timestamp, days: int, rng):
+    """
+    Yields sales frames of at most CHUNK_ROWS rows
+    """
+    product_p = zipf_weights(len(products), skew, rng)
+    client_p = zipf_weights(len(clients), skew, rng)
+    base_price = np.exp(rng.normal(3, 1, len(products))).round(2)
+    margin = rng.uniform(0.05, 0.4, len(products))
+    drift = rng.normal(0, 0.1, len(products))
+
+    done = 0
+    while done < n_rows:
+        n = min(CHUNK_ROWS, n_rows - done)
+        product = rng.choice(len(products), n, p=product_p)
+        client = rng.choice(len(clients), n, p=client_p)
+        day = rng.integers(0, days, n)
+        time_share = day / max(days - 1, 1)
+
+        qty = rng.geometric(0.3, n).astype(np.float64)
+        price = base_price[product] * (1 + drift[product] * time_share) * rng.normal(1, 0.03, n)
+        unit_cost = price * (1 - margin[product] * rng.normal(1, 0.1, n))
+        # a few returns
+        qty[rng.random(n) < 0.01] *= -1
+
+        yield pd.DataFrame({
+            'DocumentDate': start + pd.to_timedelta(day, unit='D'),
+            'id_commodity': products.index.to_numpy()[product],
+            'id_client': clients.index.to_numpy()[client],
+            'SalesAmount': (qty * price).round(2),
+            'SalesCost': (qty * unit_cost).round(2),
+            'SalesQty': qty,
+        })
+        done += n
+
+
+def generate(out_dir: str, rows: int, products: int = 5000, clients: int = 20000, skew: float = 1.1,
+             start: str = '2021-01-01', days: int = 730, dimensions: dict = None, seed: int = 0) -> str:
+    """
+    Writes a full data/ directory under out_dir, returns its path
+    """
+    rng = np.random.default_rng(seed)
+    data_dir = os.path.join(out_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+
+    dictionaries = make_dictionaries(dict(DIMENSIONS, **(dimensions or {})))
+    for name, values in dictionaries.items():
+        values.to_csv(os.path.join(data_dir, f'{name}.csv'), header=False)
+
+    df_products = make_products(products, dictionaries, rng)
+    df_clients = make_clients(clients, dictionaries, rng)
+    df_products.to_parquet(os.path.join(data_dir, 'products.pq'))
+    df_clients.to_parquet(os.path.join(data_dir, 'clients.pq'))
+
+    writer = None
+    for chunk in sales_chunks(rows, df_products, df_clients, skew, pd.Timestamp(start), days, rng):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(os.path.join(data_dir, 'df-sales.pq'), table.schema)
+        writer.write_table(table, row_group_size=1_000_000)
+    writer.close()
+    return data_dir
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic factor-analysis data')
+    parser.add_argument('out_dir')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=20000)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of product/client popularity')
+    parser.add_argument('--start', default='2021-01-01')
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--seed', type=int, default=0)
+    for name, n in DIMENSIONS.items():
+        parser.add_argument(f'--{name}es' if name == 'branch' else f'--{name}s', dest=name, type=int, default=n,
+                            help=f'number of {name} values')
+    args = parser.parse_args()
+
+    path = generate(args.out_dir, args.rows, args.products, args.clients, args.skew, args.start, args.days,
+                    {name: getattr(args, name) for name in DIMENSIONS}, args.seed)
+    print(f'{args.rows:,} sales written to {path}')
@@ -0,0 +1,140 @@
+"""
+Process-wide LRU cache of intermediate and final analysis results.
+
+Entries are shared by every Streamlit session of the process and have to be
+treated as read-only. The cache holds at most `max_bytes` (estimated) and
+evicts the least recently used entries beyond that. A value larger than the
+whole cache is not stored; stats() counts these as rejected.
+"""
+import logging
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_BYTES = 1 << 30
+
+logger = logging.getLogger('factor.cache')
+
+
+def estimate_bytes(value) -> int:
+    """
+    Approximate memory held by a cached value
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True, index=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(estimate_bytes(item) for item in value.values())
+    if hasattr(value, '__dict__'):
+        return estimate_bytes(vars(value))
+    if hasattr(value, '__slots__'):
+        return sum(estimate_bytes(getattr(value, name, None)) for name in value.__slots__)
+    return sys.getsizeof(value)
+
+
+class ResultCache():
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits, self.misses, self.evictions, self.rejected = 0, 0, 0, 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> lock held while one caller computes it
+        self._computing = {}
+
+    def __getstate__(self) -> dict:
+        # a copy sent to another process starts empty
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['max_bytes'])
+
+    def get(self, key):
+        """
+        Cached value of key or None
+        """
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key][0]
+
+    def put(self, key, value) -> None:
+        size = estimate_bytes(value)
+        if size > self.max_bytes:
+            with self._lock:
+                self.rejected += 1
+                first = self.rejected == 1
+            if first:
+                # once per cache: every later miss of such a key recomputes it
+                logger.warning('%s of %d bytes is larger than the cache (%d bytes) and is not cached',
+                               key[0], size, self.max_bytes)
+            return
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached value of key, computing and storing it with compute() on a miss.
+        Callers missing a key that is being computed wait for that value
+        instead of computing it again
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            computing = self._computing.setdefault(key, threading.Lock())
+        with computing:
+            with self._lock:
+                entry = self._items.get(key)
+            if entry is not None:
+                return entry[0]
+            try:
+                value = compute()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    if self._computing.get(key) is computing:
+                        del self._computing[key]
+        return value
+
+    def retain_version(self, version: str) -> None:
+        """
+        Drops the entries of other data versions, every key being (kind, version, ...)
+        """
+        with self._lock:
+            for key in [key for key in self._items if key[1] != version]:
+                self.nbytes -= self._items.pop(key)[1]
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'rejected': self.rejected,
+            }
@@ -1,27 +1,107 @@
+import copy
+import os
+import threading
+import time
+import weakref
 import pandas as pd
 import numpy as np
 import streamlit as st
+from store import (load_sales, open_mapped, load_dictionary, prepare_sales, sort_by_date, data_version, sales_path, source_stamps,
+                   store_updates, update_paths, file_stamp, PRODUCTS_PATH, CLIENTS_PATH, DICTIONARY_PATHS, MONEY_COLS)
+from sales_index import SalesIndex, FILTER_DIMS
+from cube import SalesCube
+from streaming import StreamingSales, DEFAULT_MEMORY_BUDGET
+from kernel import factor_table
+from parallel import by_commodity, zip_by_commodity, default_workers
+from pivots import Pivots
+from rollup import Rollup
+from cache import ResultCache, DEFAULT_CACHE_BYTES
+from analysis import AnalysisRequest, AnalysisResult, StaleResult, canonical_filters, canonical_window
+from drill import CellIndex
+from series import SeriesRequest, series_table
+from preview import preview, sample_pairs, sample_rows, pair_sizes, probabilities, PREVIEW_PAIRS
+from instrument import span
+
+AGG_DTYPES = {col: 'float64' for col in MONEY_COLS}
+WINDOW_COLS = ['id_commodity', 'id_client', 'id_branch'] + MONEY_COLS
+
+# how often LiveDataSets looks for changes in data/
+REFRESH_SECONDS = 60
+
+
+def sum_pairs(d_w: pd.DataFrame) -> pd.DataFrame:
+    return d_w.groupby(['id_commodity', 'id_client']).agg({'SalesAmount': 'sum', 'SalesCost': 'sum', 'SalesQty': 'sum', 'id_branch': 'max'}).reset_index()
+
+
+def merge_periods(d_b: pd.DataFrame, d_f: pd.DataFrame) -> pd.DataFrame:
+    return pd.merge(d_b, d_f, left_on=['id_commodity', 'id_client'], right_on=['id_commodity', 'id_client'], how='outer', suffixes=('_base', '_fact'))  
+
+
+def weak_loader(datasets: 'DataSets', load):
+    """
+    Function returning load(datasets) for the lazy members of a result. It
+    holds datasets by a weak reference, so a cached result does not keep the
+    sales of a refreshed DataSets alive; load keeps what it computes in the
+    cache of datasets, where it is counted against the budget
+    """
+    ref = weakref.ref(datasets)
+
+    def loader():
+        datasets = ref()
+        if datasets is None:
+            raise StaleResult('the data of this result was replaced by a refresh, analyze the request again')
+        return load(datasets)
+    return loader
+
 
 class DataSets():
-    def __init__(self) -> None:
-        self.df_sales = pd.read_parquet('data/df-sales.pq')
-        self.df_products = pd.read_parquet('data/products.pq')
-        self.df_clients = pd.read_parquet('data/clients.pq')
-
-        self.branch_dict = pd.read_csv('data/branch.csv', index_col=0, header=None, names=['id', 'name'])['name'].to_dict()
-        self.brand_dict = pd.read_csv('data/brand.csv', index_col=0, header=None, names=['id', 'name'])['name'].to_dict()
-        self.manager_dict = pd.read_csv('data/manager.csv', index_col=0, header=None, names=['id', 'name'])['name'].to_dict()
-        self.group_dict = pd.read_csv('data/group.csv', index_col=0, header=None, names=['id', 'name'])['name'].to_dict()
-        self.channel_dict = pd.read_csv('data/channel.csv', index_col=0, header=None, names=['id', 'name'])['name'].to_dict()
-        self.mark_dict = pd.read_csv('data/mark.csv', index_col=0, header=None, names=['id', 'name'])['name'].to_dict()
-
-        ## -------- Assemble working Dataframe ---------
-        self.df_sales['id_branch']  = self.df_sales['id_client'].map(self.df_clients['id_branch'].to_dict())
-        self.df_sales['id_channel'] = self.df_sales['id_client'].map(self.df_clients['id_channel'].to_dict())
-        self.df_sales['id_brand']   = self.df_sales['id_commodity'].map(self.df_products['id_brand'].to_dict())
-        self.df_sales['id_group']   = self.df_sales['id_commodity'].map(self.df_products['id_group'].to_dict())
-        self.df_sales['id_manager'] = self.df_sales['id_commodity'].map(self.df_products['id_manager'].to_dict())
-        self.df_sales['id_mark']    = self.df_sales['id_commodity'].map(self.df_products['id_mark'].to_dict())
+    def __init__(self, cache_bytes: int = DEFAULT_CACHE_BYTES, streaming: bool = False, memory_budget: int = DEFAULT_MEMORY_BUDGET, workers: int = None) -> None:
+        """
+        Loads data/ (see store.py for the files)
+        streaming: leave the sales on disk and aggregate every window from the
+        Parquet file within memory_budget bytes (see streaming.py)
+        workers: threads the aggregation, merge and factor kernel are split
+        over by commodity (see parallel.py), FACTOR_WORKERS by default
+        """
+        self.workers = workers or default_workers()
+        self.streaming, self.memory_budget = streaming, memory_budget
+        with span('DataSets.load', streaming=streaming) as s:
+            self._load()
+            s.rows_out = self.stream.n_rows if streaming else len(self.df_sales)
+            s.set(mapped=self.mapped)
+        # results shared by all sessions, keyed on the canonical request and data version
+        self.cache = ResultCache(cache_bytes)
+
+    def _load(self) -> None:
+        self.sources = source_stamps()
+        self.df_products = pd.read_parquet(PRODUCTS_PATH)
+        self.df_clients = pd.read_parquet(CLIENTS_PATH)
+        self._load_dictionaries()
+
+        ## -------- Open working Dataframe ---------
+        # dimension ids are joined in by the offline build (see store.py)
+        self.store_updates = store_updates()
+        self.updates = dict(self.store_updates)
+        self.mapped = False
+        if self.streaming:
+            self.df_sales, self.sales_index, self.cube = None, None, None
+            self.stream = StreamingSales(sales_path(), self.df_products, self.df_clients, self.memory_budget)
+        else:
+            # mapped when store.py wrote the mapped files, shared with other processes
+            mapped = open_mapped()
+            if mapped is not None:
+                self.df_sales, self.sales_index = mapped
+                self.mapped = True
+            else:
+                self.df_sales = load_sales(self.df_products, self.df_clients)
+                self.sales_index = SalesIndex(self.df_sales)
+            self.cube = SalesCube.load(self.df_sales)
+            self.stream = None
+
+        # update files that arrived after the store was built
+        new_paths, _ = self.pending_updates()
+        self._append_updates(new_paths)
+        self.version = data_version(self.sources, self.updates)
 
         self.axes_options = {
             'Branch': 'branch', 
@@ -32,165 +112,402 @@ class DataSets():
             'Manager': 'Manager_Marketing'
         }
 
+    def _load_dictionaries(self) -> None:
+        self.branch_dict = load_dictionary('branch')
+        self.brand_dict = load_dictionary('brand')
+        self.manager_dict = load_dictionary('manager')
+        self.group_dict = load_dictionary('group')
+        self.channel_dict = load_dictionary('channel')
+        self.mark_dict = load_dictionary('mark')
+
+    def pending_updates(self) -> tuple:
+        """
+        (update files not loaded yet, whether a loaded one changed or disappeared)
+        """
+        paths = update_paths()
+        on_disk = {os.path.basename(path): path for path in paths}
+        new_paths = [path for name, path in on_disk.items() if name not in self.updates]
+        stale = any(name in on_disk and file_stamp(on_disk[name]) != stamp for name, stamp in self.updates.items())
+        stale = stale or any(name not in on_disk for name in self.updates if name not in self.store_updates)
+        return new_paths, stale
+
+    def _append_updates(self, paths: list) -> None:
+        """
+        Adds the sales of update files: encoded once, appended to the rows, the index
+        and the cube. Replaces those attributes, the old objects are not modified
+        """
+        if not paths:
+            return
+        stamps = {os.path.basename(path): file_stamp(path) for path in paths}
+        if self.stream is not None:
+            self.stream = self.stream.append(paths)
+        else:
+            new_sales = prepare_sales(pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True), self.df_products, self.df_clients)
+            if len(new_sales):
+                df_sales = pd.concat([self.df_sales, new_sales], ignore_index=True)
+                if len(self.df_sales) == 0 or new_sales['DocumentDate'].iloc[0] >= self.df_sales['DocumentDate'].iloc[-1]:
+                    sales_index = self.sales_index.append(new_sales)
+                else:
+                    # late sales: rows are re-sorted and the index rebuilt
+                    df_sales = sort_by_date(df_sales)
+                    sales_index = SalesIndex(df_sales)
+                self.df_sales, self.sales_index, self.cube = df_sales, sales_index, self.cube.append(new_sales)
+        self.updates = dict(self.updates, **stamps)
+
+    def refreshed(self) -> 'DataSets':
+        """
+        DataSets for the current content of data/: self when nothing changed,
+        otherwise a new object sharing whatever did not change. New update
+        files are appended and changed dictionaries reloaded; changed sales,
+        products or clients need a full load. self is never modified, so
+        sessions still using it are not affected.
+        """
+        sources = source_stamps()
+        new_paths, stale = self.pending_updates()
+        if sources == self.sources and not new_paths and not stale:
+            return self
+
+        changed = {path for path, stamp in sources.items() if self.sources.get(path) != stamp}
+        with span('DataSets.refresh', files=len(changed) + len(new_paths)) as s:
+            if stale or changed - set(DICTIONARY_PATHS.values()):
+                # existing rows may be recoded or gone. The new object starts
+                # with an empty cache: the old one goes with self
+                s.set(mode='full')
+                return DataSets(self.cache.max_bytes, self.streaming, self.memory_budget, self.workers)
+
+            s.set(mode='incremental')
+            datasets = copy.copy(self)
+            datasets.sources = sources
+            if changed:
+                datasets._load_dictionaries()
+            datasets._append_updates(new_paths)
+            datasets.version = data_version(datasets.sources, datasets.updates)
+            # the shared cache only serves the new version from now on
+            datasets.cache.retain_version(datasets.version)
+        return datasets
+
     def filter_data(self, channels, depts, brands, managers, groups, marks, dt_base_start, dt_base_end, dt_fact_start, dt_fact_end):
         """
         Filters initial df_sales according to passed parameters
         Parameters are lists of values
         """
-        # filtering
-        d_a = self.df_sales
-
-        if channels:
-            d_a = d_a.loc[d_a.id_channel.isin(channels)]
-        if depts: 
-            d_a = d_a.loc[d_a.id_branch.isin(depts)]
-        if brands:
-            d_a = d_a.loc[d_a.id_brand.isin(brands)]
-        if managers:
-            d_a = d_a.loc[d_a.id_manager.isin(managers)]
-        if groups:
-            d_a = d_a.loc[d_a.id_group.isin(groups)]
-        if marks:
-            d_a = d_a.loc[d_a.id_mark.isin(marks)]
-
-        d_b = d_a.loc[(d_a.DocumentDate >= dt_base_start) & (d_a.DocumentDate <= dt_base_end)].copy(deep=True)
-        d_f = d_a.loc[(d_a.DocumentDate >= dt_fact_start) & (d_a.DocumentDate <= dt_fact_end)].copy(deep=True)
-
-        d_b = d_b.groupby(['id_commodity', 'id_client']).agg({'SalesAmount': 'sum', 'SalesCost': 'sum', 'SalesQty': 'sum', 'id_branch': 'max'}).reset_index() #.copy(deep=True)
-        d_f = d_f.groupby(['id_commodity', 'id_client']).agg({'SalesAmount': 'sum', 'SalesCost': 'sum', 'SalesQty': 'sum', 'id_branch': 'max'}).reset_index() #.copy(deep=True)
-
-        dm = pd.merge(d_b, d_f, left_on=['id_commodity', 'id_client'], right_on=['id_commodity', 'id_client'], how='outer', suffixes=('_base', '_fact'))  
+        filters = {
+            FILTER_DIMS['channels']: channels,
+            FILTER_DIMS['depts']: depts,
+            FILTER_DIMS['brands']: brands,
+            FILTER_DIMS['managers']: managers,
+            FILTER_DIMS['groups']: groups,
+            FILTER_DIMS['marks']: marks,
+        }
+
+        with span('filter_data') as s:
+            d_b = self.aggregate_window(filters, dt_base_start, dt_base_end, 'base')
+            d_f = self.aggregate_window(filters, dt_fact_start, dt_fact_end, 'fact')
+
+            with span('merge', rows_in=len(d_b) + len(d_f), workers=self.workers) as m:
+                dm = zip_by_commodity(d_b, d_f, merge_periods, self.workers)
+                m.rows_out = len(dm)
+            s.rows_out = len(dm)
         return dm
 
 
 
-    def preprocess_data(self, dm: pd.DataFrame, df_products, df_clients, branch_dict, x_ax, y_ax):
-        self.x_ax, self.y_ax = x_ax, y_ax
-
-        dm['comm_cl'] = dm.id_commodity.astype(str) + dm.id_client.astype(str)
-        dm['id_department'] = dm.id_branch_base
-        dm.loc[dm.id_department.isnull() == True, 'id_department'] = dm.id_branch_fact
-
-        # adding fact and base price and cost 
-        dm['price_base'] = dm.SalesAmount_base/dm.SalesQty_base
-        dm['price_fact'] = dm.SalesAmount_fact/dm.SalesQty_fact
-        dm['cost_base'] = dm.SalesCost_base/dm.SalesQty_base
-        dm['cost_fact'] = dm.SalesCost_fact/dm.SalesQty_fact
-
-        dm.replace([np.inf, -np.inf], np.nan, inplace=True)
-        dm.fillna(0, inplace=True)
-
-        # adding base and fact profit and profitability
-        dm['pr_base'] = dm.SalesAmount_base - dm.SalesCost_base
-        dm['pr_fact'] = dm.SalesAmount_fact - dm.SalesCost_fact
-        dm['rent_base'] = dm.pr_base / dm.SalesCost_base
-        dm['rent_fact'] = dm.pr_fact / dm.SalesCost_fact
-
-        dm.reset_index(inplace=True)
-        order_col = ['id_commodity', 'id_client', 'comm_cl', 'id_department', 
-                     'SalesAmount_base', 'SalesCost_base', 'SalesQty_base', 'pr_base', 'rent_base', 
-                     'SalesAmount_fact', 'SalesCost_fact', 'SalesQty_fact', 'pr_fact', 'rent_fact',\
-                     'price_base', 'price_fact', 'cost_base', 'cost_fact']
-        dm = dm[order_col]
-
-        # factorial analysis logic: changes due to price, cost, volume (structure)
-        dm['is_absent'] = (dm.SalesQty_base == 0) + (dm.SalesQty_fact == 0) + (dm.SalesCost_base < 0) + (dm.SalesCost_fact < 0)
-        dm['delta_price'] = np.where(dm.is_absent > 0, 0, (dm.price_fact - dm.price_base) * dm.SalesQty_fact)
-        dm['delta_cost'] = np.where(dm.is_absent > 0, 0, (dm.cost_base - dm.cost_fact) * dm.SalesQty_fact)
-        dm['delta_vol'] = np.where(dm.is_absent > 0, dm.pr_fact - dm.pr_base, (dm.SalesQty_fact - dm.SalesQty_base) * (dm.price_base - dm.cost_base))
-
-        # adding reference cols
-        my_cols_eng = ['Article', 'Brand', 'Product_group', 'Mark', 'Manager_Marketing', 'Manager_Supply', 'ABC_XYZ']
-        my_cl_cols_eng = ['id_branch', 'Channel', 'Client_name']
-
-        dm1 = df_products[my_cols_eng].join(dm.set_index('id_commodity'), how='right').reset_index().set_index('id_client').join(df_clients[my_cl_cols_eng]).reset_index()
-        dm1.rename(columns = {'level_0': 'id_client', 'index':'id_commodity'}, inplace=True)
-
-        dm1['branch'] = dm1.id_branch.map(branch_dict)
-
-        cols_order = [
-            'branch',
-            'comm_cl',
-            'id_commodity',
-            'id_client',
-            'id_department',
-            'Article',
-            'Brand',
-            'Product_group',
-            'Mark',
-            'Manager_Marketing',
-            'Manager_Supply',    
-            'ABC_XYZ',
-            'Client_name',
-            'Channel',
-            'SalesAmount_base',
-            'SalesCost_base',
-            'SalesQty_base',
-            'pr_base',
-            'rent_base',
-            'SalesAmount_fact',
-            'SalesCost_fact',
-            'SalesQty_fact',
-            'pr_fact',
-            'rent_fact',
-            'price_base',
-            'price_fact',
-            'cost_base',
-            'cost_fact',
-            'is_absent',
-            'delta_price',
-            'delta_cost',
-            'delta_vol'
-        ]
-
-        dm1 = dm1[cols_order]
-
-        dm1.rename(columns = {
-            'SalesAmount_base':'Revenue base',
-            'SalesCost_base': 'Cost of Sales base',
-            'SalesQty_base': 'Sales base, pcs',
-            'pr_base': 'Profit base',
-            'rent_base': 'Profitability base',
-            'SalesAmount_fact' : 'Revenue fact',
-            'SalesCost_fact': 'Cost of Sales fact',
-            'SalesQty_fact': 'Sales fact, pcs',
-            'pr_fact': 'Profit fact',
-            'rent_fact': 'Profitability fact',
-            'price_base': 'Price 1 piece base',
-            'price_fact': 'Price 1 piece fact',
-            'cost_base': 'Cost 1 piece base',
-            'cost_fact': 'Cost 1 piece fact',
-            'delta_price': 'Сhange in profit due to price',
-            'delta_cost': 'Сhange in profit due to cost',
-            'delta_vol': 'Сhange in profit due to structure',
-            'comm_cl': 'id product-client',
-        }, inplace=True)    
-
-        # lookup axes ids
-        x_axis = self.axes_options[x_ax]
-        y_axis = self.axes_options[y_ax]
-    
-        a = dm1[[x_axis, 'Revenue fact']].groupby(x_axis).sum().sort_values(by='Revenue fact', ascending=False)
-        a['abc_x_axis'] = (a['Revenue fact'] / a['Revenue fact'].sum()).cumsum()
-        good_x = a.reset_index()
-        good_x = good_x.iloc[:, 0]
-            
-        aa = dm1.groupby([x_axis, y_axis])[['Сhange in profit due to price']].sum().reset_index().sort_values('Сhange in profit due to price', ascending=False).loc[(dm1[x_axis].isin(good_x))]# & (dm1[y_axis].isin(good_y))]
-        aa = aa.loc[(aa[x_axis].isin(good_x))]
-        aa.dropna(inplace=True)
-        pivot_price = pd.pivot_table(aa, values = 'Сhange in profit due to price', columns=x_axis, index=y_axis, aggfunc='sum' )
-
-        bb = dm1.groupby([x_axis, y_axis])[['Сhange in profit due to cost']].sum().reset_index().sort_values('Сhange in profit due to cost', ascending=False).loc[(dm1[x_axis].isin(good_x))]# & (dm1[y_axis].isin(good_y))]
-        bb = bb.loc[(bb[x_axis].isin(good_x))]
-        bb.dropna(inplace=True)
-        pivot_cost = pd.pivot_table(bb, values = 'Сhange in profit due to cost', columns=x_axis, index=y_axis, aggfunc='sum' )    
-        
-        cc = dm1.groupby([x_axis, y_axis])[['Сhange in profit due to structure']].sum().reset_index().sort_values('Сhange in profit due to structure', ascending=False).loc[(dm1[x_axis].isin(good_x))]# & (dm1[y_axis].isin(good_y))]
-        cc = cc.loc[(cc[x_axis].isin(good_x))]
-        cc.dropna(inplace=True)
-        pivot_vol = pd.pivot_table(cc, values = 'Сhange in profit due to structure', columns=x_axis, index=y_axis, aggfunc='sum' )
-
-        self.pivot_price, self.pivot_cost, self.pivot_vol = pivot_price, pivot_cost, pivot_vol
-        self.dm1, self.aa, self.bb, self.cc = dm1, aa, bb, cc
-
-        return dm1, pivot_price, pivot_cost, pivot_vol
\ No newline at end of file
+    def aggregate_window(self, filters: dict, dt_start, dt_end, period: str = None) -> pd.DataFrame:
+        """
+        Sums sales per (id_commodity, id_client) over dt_start <= DocumentDate <= dt_end
+        filters maps a sales column to the list of accepted values
+        Day-aligned windows are answered from the cube, others from the raw rows
+        """
+        key = ('window', self.version, canonical_filters(filters), canonical_window(dt_start, dt_end))
+        with span('aggregate_window', period=period) as s:
+            d_w = self.cache.get(key)
+            if d_w is None:
+                d_w = self._aggregate_window(filters, dt_start, dt_end, s)
+                self.cache.put(key, d_w)
+            else:
+                s.set(source='cache')
+            s.rows_out = len(d_w)
+        return d_w
+
+    def _aggregate_window(self, filters: dict, dt_start, dt_end, s) -> pd.DataFrame:
+        if self.stream is not None:
+            return self.stream.aggregate_window(filters, dt_start, dt_end, s)
+
+        d_w = self.cube.window(filters, dt_start, dt_end, self.sales_index, self.workers)
+        if d_w is not None:
+            s.set(source='cube')
+            return d_w
+
+        rows = self.sales_index.rows(filters, dt_start, dt_end)
+        s.set(source='rows')
+        s.rows_in = rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+        return by_commodity(self.gather(rows), sum_pairs, self.workers)
+
+    def gather(self, rows) -> pd.DataFrame:
+        """
+        WINDOW_COLS of the sales at rows in a single gather, money in float64 to be summed
+        """
+        d_w = pd.DataFrame({col: self.df_sales[col].to_numpy()[rows] for col in WINDOW_COLS})
+        for col, dtype in AGG_DTYPES.items():
+            d_w[col] = d_w[col].astype(dtype)
+        return d_w
+
+    def sample_data(self, request: AnalysisRequest, n: int = PREVIEW_PAIRS) -> tuple:
+        """
+        (filter_data of a sample of the request's pairs, inclusion probability
+        of each of its pairs, number of pairs of the request). The pairs are
+        drawn from the rows the sales index selects, only the rows of the
+        sampled pairs are gathered and summed
+        """
+        if self.stream is not None:
+            # no index over the rows on disk: drawn from the exact sums
+            dm = self.filter_data(*request.filter_args())
+            positions, p = sample_pairs(pair_sizes(dm), n)
+            return dm.take(positions).reset_index(drop=True), p, len(dm)
+
+        filters = request.filters()
+        windows = []
+        for dt_start, dt_end in [(request.dt_base_start, request.dt_base_end), (request.dt_fact_start, request.dt_fact_end)]:
+            rows = self.sales_index.rows(filters, dt_start, dt_end)
+            windows.append(np.arange(rows.start, rows.stop) if isinstance(rows, slice) else rows)
+        rows = np.concatenate(windows)
+
+        size = np.abs(self.df_sales['SalesAmount'].to_numpy()[rows].astype('float64'))
+        size += np.abs(self.df_sales['SalesCost'].to_numpy()[rows].astype('float64'))
+        drawn, p, pairs_total = sample_rows(self.df_sales['id_commodity'].to_numpy()[rows], self.df_sales['id_client'].to_numpy()[rows], np.nan_to_num(size), n)
+
+        # both windows of the sampled pairs, summed and merged as in filter_data
+        base = len(windows[0])
+        d_b = sum_pairs(self.gather(rows[:base][drawn[:base]]))
+        d_f = sum_pairs(self.gather(rows[base:][drawn[base:]]))
+        dm = merge_periods(d_b, d_f)
+        return dm, probabilities(dm, p), pairs_total
+
+
+
+    def period_sums(self, filters: dict, edges: pd.DatetimeIndex, s) -> pd.DataFrame:
+        """
+        Sums of MONEY_COLS per (period, id_commodity, id_client) over consecutive
+        periods, period k being edges[k] <= DocumentDate < edges[k + 1]. One pass
+        for all periods: the cube for whole days, one gather of the raw rows or one
+        streaming scan otherwise
+        """
+        if self.stream is not None:
+            return self.stream.aggregate_periods(filters, edges, s)
+
+        d_p = self.cube.periods(filters, edges)
+        if d_p is not None:
+            s.set(source='cube')
+            return d_p
+
+        rows = self.sales_index.rows(filters, edges[0], edges[-1] - pd.Timedelta(1, 'ns'))
+        s.set(source='rows')
+        s.rows_in = rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+
+        d_p = pd.DataFrame({'period': np.searchsorted(edges.to_numpy(), self.sales_index.dates[rows], side='right') - 1})
+        for col in ['id_commodity', 'id_client']:
+            d_p[col] = self.df_sales[col].to_numpy()[rows]
+        for col, dtype in AGG_DTYPES.items():
+            d_p[col] = self.df_sales[col].to_numpy()[rows].astype(dtype)
+        return d_p.groupby(['period', 'id_commodity', 'id_client'], sort=False)[MONEY_COLS].sum().reset_index()
+
+    def series(self, request: SeriesRequest) -> pd.DataFrame:
+        """
+        Decomposition table of consecutive periods (see series.py), shared
+        between sessions like the analysis results
+        """
+        key = ('series', self.version) + request.key()
+        with span('series', periods=len(request.edges) - 1, mode=request.mode) as s:
+            table = self.cache.get(key)
+            if table is not None:
+                s.set(source='cache')
+                return table
+
+            edges = pd.DatetimeIndex(request.edges)
+            d_p = self.period_sums(request.filters(), edges, s)
+            by = None if request.by is None else self.axes_options[request.by]
+            table = series_table(d_p, edges[:-1], request.mode, by, self.df_products, self.df_clients, self.branch_dict, self.workers)
+            if by is not None:
+                table = table.rename(columns={by: request.by})
+            self.cache.put(key, table)
+            s.rows_out = len(table)
+        return table
+
+
+
+    def preprocess_data(self, dm: pd.DataFrame, df_products, df_clients, branch_dict, x_ax, y_ax, abc_cutoff=1.0) -> AnalysisResult:
+        # product-client table with the factor decomposition (see kernel.py)
+        with span('factor_table', rows_in=len(dm)) as s:
+            dm1 = factor_table(dm, df_products, df_clients, branch_dict, self.workers)
+            s.rows_out = len(dm1)
+
+        # one grouped reduction for the three factors (see pivots.py)
+        pivots = self.pivots(dm1, x_ax, y_ax, abc_cutoff)
+
+        return AnalysisResult(dm1, pivots, x_ax, y_ax)
+
+
+
+    def analyze(self, request: AnalysisRequest) -> AnalysisResult:
+        """
+        Pivots and totals of a request from the rollup of its window pair (see
+        rollup.py): changing the axes or the filters only regroups the rollup.
+        The product-client table of the result is built when accessed and
+        cached as an entry of its own.
+        Nothing is stored on self, so sessions can call it concurrently.
+        """
+        with span('analyze') as s:
+            key = self.result_key(request)
+            result = self.cache.get(key)
+            if result is not None:
+                s.set(source='cache')
+                return result
+
+            rollup = self.rollup(request)
+            filters = request.filters()
+            with span('pivots', rows_in=len(rollup.table)) as p:
+                pivots = rollup.pivots(filters, self.axes_options[request.x_ax], self.axes_options[request.y_ax], request.abc_cutoff)
+                p.rows_out = len(pivots.cells)
+            result = self.lazy_result(request, pivots, rollup.totals(filters))
+            self.cache.put(key, result)
+            s.rows_out = result.totals['pairs']
+        return result
+
+    def preview(self, request: AnalysisRequest) -> AnalysisResult:
+        """
+        Estimated pivots and totals of a request with their bounds, from a
+        sample of its pairs (see preview.py). The product-client table of the
+        result is the exact one, built when accessed
+        """
+        with span('preview') as s:
+            key = ('preview', self.version) + request.key()
+            result = self.cache.get(key)
+            if result is not None:
+                s.set(source='cache')
+                return result
+
+            with span('preview.sample') as p:
+                dm, probability, pairs_total = self.sample_data(request)
+                pivots, totals, bounds = preview(dm, probability, pairs_total, self.df_products, self.df_clients, self.branch_dict,
+                                                 self.axes_options[request.x_ax], self.axes_options[request.y_ax], request.abc_cutoff)
+                p.set(pairs_sampled=bounds.pairs_sampled)
+                p.rows_in = pairs_total
+                p.rows_out = len(pivots.cells)
+            result = self.lazy_result(request, pivots, totals, bounds)
+            self.cache.put(key, result)
+            s.rows_out = bounds.pairs_sampled
+        return result
+
+    def lazy_result(self, request: AnalysisRequest, pivots: Pivots, totals: dict, bounds=None) -> AnalysisResult:
+        """
+        Result whose dm1 and cell index are loaded on access, each from a
+        cache entry of its own
+        """
+        mode = 'exact' if bounds is None else 'preview'
+        return AnalysisResult(weak_loader(self, lambda datasets: datasets.product_client(request)), pivots,
+                              request.x_ax, request.y_ax, totals, bounds,
+                              weak_loader(self, lambda datasets: datasets.cell_index(request, pivots, mode)))
+
+    def cell_index(self, request: AnalysisRequest, pivots: Pivots, mode: str = 'exact') -> CellIndex:
+        """
+        CellIndex of the dm1 of request over the cells of pivots, previews having pivots of their own
+        """
+        key = ('cells', self.version, mode) + request.key()
+        return self.cache.get_or_compute(key, lambda: CellIndex(self.product_client(request), pivots))
+
+    def result_key(self, request: AnalysisRequest) -> tuple:
+        return ('result', self.version) + request.key()
+
+    def analyzed(self, request: AnalysisRequest) -> AnalysisResult:
+        """
+        The cached result of request, None when it still has to be computed
+        """
+        return self.cache.get(self.result_key(request))
+
+    def rollup(self, request: AnalysisRequest) -> Rollup:
+        """
+        Rollup of the unfiltered product-client table of the request's window pair
+        """
+        unfiltered = request.unfiltered()
+
+        def build() -> Rollup:
+            dm1 = self.product_client(unfiltered)
+            with span('rollup', rows_in=len(dm1)) as s:
+                rollup = Rollup(dm1, self.df_products, self.df_clients)
+                s.rows_out = len(rollup.table)
+            return rollup
+
+        # concurrent requests of one window pair build its rollup once
+        return self.cache.get_or_compute(('rollup', self.version) + unfiltered.data_key(), build)
+
+    def product_client(self, request: AnalysisRequest) -> pd.DataFrame:
+        """
+        dm1 of the request: filter_data + factor_table without filters,
+        a subset of the unfiltered table with them
+        """
+        def build() -> pd.DataFrame:
+            unfiltered = request.unfiltered()
+            if unfiltered == request:
+                dm = self.filter_data(*request.filter_args())
+                return self.factor_table(dm)
+            return self.rollup(request).product_client(self.product_client(unfiltered), request.filters())
+
+        return self.cache.get_or_compute(('dm1', self.version) + request.data_key(), build)
+
+    def factor_table(self, dm: pd.DataFrame) -> pd.DataFrame:
+        with span('factor_table', rows_in=len(dm)) as s:
+            dm1 = factor_table(dm, self.df_products, self.df_clients, self.branch_dict, self.workers)
+            s.rows_out = len(dm1)
+        return dm1
+
+    def pivots(self, dm1: pd.DataFrame, x_ax, y_ax, abc_cutoff=1.0) -> Pivots:
+        with span('pivots', rows_in=len(dm1)) as s:
+            pivots = Pivots(dm1, self.axes_options[x_ax], self.axes_options[y_ax], abc_cutoff)
+            s.rows_out = len(pivots.cells)
+        return pivots
+
+
+
+class LiveDataSets():
+    """
+    The DataSets sessions use, refreshed in the background when data/ changes.
+    A refresh builds a new DataSets and swaps it in with a single assignment:
+    a session takes `get()` once per run and sees one consistent version.
+    """
+    def __init__(self, datasets: DataSets, check_seconds: float = REFRESH_SECONDS) -> None:
+        self.current = datasets
+        self.check_seconds = check_seconds
+        self.last_error = None
+        self._checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get(self) -> DataSets:
+        """
+        Current DataSets, starting a refresh check when one is due
+        """
+        if time.monotonic() - self._checked >= self.check_seconds and self._lock.acquire(blocking=False):
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return self.current
+
+    def refresh(self) -> DataSets:
+        """
+        Checks data/ now, in the calling thread
+        """
+        with self._lock:
+            self._refresh_locked()
+        return self.current
+
+    def _refresh(self) -> None:
+        try:
+            self._refresh_locked()
+        finally:
+            self._lock.release()
+
+    def _refresh_locked(self) -> None:
+        try:
+            self.current = self.current.refreshed()
+            self.last_error = None
+        except Exception as e:
+            # e.g. a file caught mid-copy: keep serving the current data, retry on the next check
+            self.last_error = f'{type(e).__name__}: {e}'
+        self._checked = time.monotonic()
@@ -0,0 +1,114 @@
+"""
+Drill-down from a heatmap cell to the product-client rows behind it.
+
+CellIndex groups the row positions of dm1 by the (x, y) cell of the pivots
+they are summed into (X values outside the ABC cutoff belong to the
+OTHER_LABEL column), once per analysis result. A DrillDown holds the rows of
+one cell and narrows them by any dm1 column, step by step:
+
+    drill = result.cell('Brand A', 'Branch 3')
+    drill.top('clients')
+    drill.where('Article', 'Widget').top('pairs', factor=PRICE_COL)
+
+Every step works on the rows of the cell only, the base/fact aggregates are
+not recomputed.
+"""
+import numpy as np
+import pandas as pd
+from kernel import FACTOR_COLS
+
+TOTAL_COL = 'Total effect'
+PAIRS_COL = 'pairs'
+DRILL_SUMS = FACTOR_COLS + ['Revenue fact', 'Profit base', 'Profit fact']
+
+# level of detail -> dm1 columns identifying a row of it; any other dm1 column is a level of its own
+DRILL_LEVELS = {
+    'pairs': ['id product-client', 'id_commodity', 'Article', 'id_client', 'Client_name'],
+    'products': ['id_commodity', 'Article'],
+    'clients': ['id_client', 'Client_name'],
+}
+DEFAULT_TOP = 20
+
+
+class CellIndex():
+    def __init__(self, dm1: pd.DataFrame, pivots) -> None:
+        """
+        Positions of the dm1 rows of every cell of pivots, built from dm1
+        """
+        x_labels, y_labels = pivots.cell_labels(dm1)
+        x_codes, self.x_values = pd.factorize(x_labels)
+        y_codes, self.y_values = pd.factorize(y_labels)
+        # rows with an unknown label are in no cell, as in the pivots
+        cell = np.where((x_codes >= 0) & (y_codes >= 0), x_codes.astype(np.int64) * len(self.y_values) + y_codes, -1)
+
+        order = np.argsort(cell, kind='stable')
+        order = order[np.searchsorted(cell[order], 0):]
+        codes, starts = np.unique(cell[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        self.order = order.astype(np.int32 if len(dm1) < np.iinfo(np.int32).max else np.int64)
+        self.slices = {
+            (self.x_values[code // len(self.y_values)], self.y_values[code % len(self.y_values)]): (start, end)
+            for code, start, end in zip(codes.tolist(), starts.tolist(), ends.tolist())
+        }
+
+    def rows(self, x_value, y_value) -> np.ndarray:
+        """
+        Ascending positions in dm1 of the rows of the cell, empty for a cell without rows
+        """
+        start, end = self.slices.get((x_value, y_value), (0, 0))
+        return self.order[start:end]
+
+
+class DrillDown():
+    def __init__(self, dm1: pd.DataFrame, rows: np.ndarray, path: tuple = ()) -> None:
+        """
+        rows: positions in dm1, path: the (column, value) steps that led to them
+        """
+        self.dm1 = dm1
+        self.rows = rows
+        self.path = path
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def where(self, col: str, value) -> 'DrillDown':
+        """
+        The rows with dm1[col] == value, one step further down
+        """
+        values = self.dm1[col].to_numpy()[self.rows]
+        keep = pd.isna(values) if pd.isna(value) else values == value
+        return DrillDown(self.dm1, self.rows[keep], self.path + ((col, value),))
+
+    def values(self, col: str) -> list:
+        """
+        Distinct values of dm1[col] in these rows, sorted, to pick the next step from
+        """
+        values = self.dm1[col].to_numpy()[self.rows]
+        return sorted(pd.unique(values[pd.notna(values)]).tolist())
+
+    def frame(self) -> pd.DataFrame:
+        """
+        The dm1 rows themselves
+        """
+        return self.dm1.take(self.rows)
+
+    def top(self, by: str = 'pairs', n: int = DEFAULT_TOP, factor: str = None) -> pd.DataFrame:
+        """
+        The n largest contributors at the `by` level (a DRILL_LEVELS key or a dm1
+        column) with their factor sums, ranked by the absolute `factor` or, by
+        default, the absolute total effect (the sum of the three factors)
+        """
+        keys = DRILL_LEVELS.get(by, [by])
+        rows = self.dm1[keys + DRILL_SUMS].take(self.rows)
+        if by == 'pairs':
+            table = rows.reset_index(drop=True)
+        else:
+            grouped = rows.groupby(keys, sort=False, dropna=False)
+            table = grouped[DRILL_SUMS].sum()
+            table[PAIRS_COL] = grouped.size()
+            table = table.reset_index()
+        table[TOTAL_COL] = table[FACTOR_COLS].sum(axis=1)
+
+        score = np.abs(table[factor or TOTAL_COL].to_numpy(dtype=np.float64))
+        ranked = np.argsort(-score, kind='stable')[:n]
+        return table.take(ranked).reset_index(drop=True)
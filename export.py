@@ -0,0 +1,174 @@
+"""
+Streaming export of the product-client table.
+
+Rows are written in chunks straight to a file (xlsxwriter in constant_memory
+mode, or CSV/Parquet), so the frame, the serialized sheet and the zip are
+never in memory together. Files are kept per request key and reused until
+evicted, so preparing the same export again does not write it again.
+"""
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+from instrument import span
+
+CHUNK_ROWS = 50_000
+MAX_FILES = 32
+
+# format -> (file name, mime type)
+EXPORT_FORMATS = {
+    'Excel': ('profit_analysis.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'CSV': ('profit_analysis.csv', 'text/csv'),
+    'Parquet': ('profit_analysis.parquet', 'application/octet-stream'),
+}
+
+
+def chunks(df: pd.DataFrame, size: int = CHUNK_ROWS):
+    for start in range(0, len(df), size):
+        yield df.iloc[start:start + size]
+
+
+def sheet_values(values: np.ndarray) -> list:
+    """
+    Cells of one column as write_row takes them: blank (None) for missing
+    values, 'inf'/'-inf' text for infinities, text for anything not a number
+    """
+    if values.dtype.kind == 'f':
+        cells = values.astype(object)
+        cells[np.isnan(values)] = None
+        cells[np.isposinf(values)] = 'inf'
+        cells[np.isneginf(values)] = '-inf'
+        return cells.tolist()
+    if values.dtype.kind in 'iub':
+        return values.tolist()
+    return [None if pd.isna(value) else str(value) for value in values]
+
+
+def write_xlsx(dm1: pd.DataFrame, path: str) -> None:
+    """
+    Same layout as the former pd.ExcelWriter export: index in column A,
+    formatted header, number format on the measures, frozen header row
+    """
+    # text is written as text, never as a formula or a link
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False})
+    worksheet = workbook.add_worksheet('product-client')
+    format1 = workbook.add_format({'num_format': '#,##0.00'})
+    header_format1 = workbook.add_format({
+        'bold': True,
+        'text_wrap': True,
+        'valign': 'top',
+        'fg_color': '#A8CED2',
+        'border': 1})
+
+    # constant_memory flushes row by row: column settings go first
+    worksheet.set_column('F:F', 15)
+    worksheet.set_column('R:AI', 12, format1)
+    worksheet.freeze_panes(1, 0)
+    for col_num, value in enumerate(dm1.columns.values):
+        worksheet.write_string(0, col_num + 1, str(value), header_format1)
+
+    row_num = 1
+    for chunk in chunks(dm1):
+        # converted column by column, written row by row as constant_memory requires
+        columns = [chunk.index.tolist()] + [sheet_values(chunk[col].to_numpy()) for col in chunk.columns]
+        for row in zip(*columns):
+            worksheet.write_row(row_num, 0, row)
+            row_num += 1
+    workbook.close()
+
+
+def write_csv(dm1: pd.DataFrame, path: str) -> None:
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        # the header comes with the first chunk, quoted by pandas like the values
+        dm1.iloc[:0].to_csv(f, header=True, index=False)
+        for chunk in chunks(dm1):
+            chunk.to_csv(f, header=False, index=False)
+
+
+def write_parquet(dm1: pd.DataFrame, path: str) -> None:
+    writer = None
+    for chunk in chunks(dm1):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+    if writer is None:
+        pq.write_table(pa.Table.from_pandas(dm1, preserve_index=False), path)
+    else:
+        writer.close()
+
+
+WRITERS = {
+    'Excel': write_xlsx,
+    'CSV': write_csv,
+    'Parquet': write_parquet,
+}
+
+
+class Exporter():
+    def __init__(self, directory: str = None, max_files: int = MAX_FILES) -> None:
+        """
+        Export files are written to directory (a fresh temp dir by default),
+        the max_files most recently used ones are kept
+        """
+        self.directory = directory or tempfile.mkdtemp(prefix='factor-export-')
+        self.max_files = max_files
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        # (key, fmt) -> lock held while its file is written, one per
+        # key for the life of the exporter so that no two writers hold different ones
+        self._writing = {}
+
+    def _file_lock(self, name: tuple) -> threading.RLock:
+        with self._lock:
+            return self._writing.setdefault(name, threading.RLock())
+
+    def export(self, dm1: pd.DataFrame, key: tuple, fmt: str) -> str:
+        """
+        Path of the export of dm1 in fmt, written on first request for (key, fmt).
+        key must identify dm1, e.g. the data version plus AnalysisRequest.data_key().
+        Concurrent calls for one (key, fmt) write it once
+        """
+        name = (key, fmt)
+        with self._file_lock(name):
+            with self._lock:
+                path = self._files.get(name)
+                if path is not None and os.path.exists(path):
+                    self._files.move_to_end(name)
+                    return path
+
+            suffix = os.path.splitext(EXPORT_FORMATS[fmt][0])[1]
+            fd, tmp_path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+            os.close(fd)
+            try:
+                with span(f'export.{fmt}', rows_in=len(dm1)):
+                    WRITERS[fmt](dm1, tmp_path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+
+            with self._lock:
+                # a file of the key that went missing is replaced, not leaked
+                stale = [self._files.pop(name)] if name in self._files else []
+                self._files[name] = tmp_path
+                while len(self._files) > self.max_files:
+                    stale.append(self._files.popitem(last=False)[1])
+            for path in stale:
+                if os.path.exists(path):
+                    os.remove(path)
+        return tmp_path
+
+    @contextmanager
+    def served(self, dm1: pd.DataFrame, key: tuple, fmt: str):
+        """
+        The export of dm1 in fmt opened for reading, e.g. by a download
+        button. The file stays for the next request of the same key
+        """
+        with open(self.export(dm1, key, fmt), 'rb') as f:
+            yield f
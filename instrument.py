@@ -0,0 +1,219 @@
+"""
+Lightweight spans around the pipeline stages.
+
+    with span('filter_data', rows_in=len(df)) as s:
+        ...
+        s.rows_out = len(result)
+
+Each span records wall time, the change of the process RSS, row counts and
+any extra attributes, plus the peak RSS of the process so far (ru_maxrss, a
+process-lifetime maximum, not the peak of the span). It costs a couple of system calls, so
+it stays on in production. Allocation peaks (tracemalloc) are recorded only
+while tracemalloc is tracing, e.g. under benchmarks or with FACTOR_TRACEMALLOC=1.
+
+Finished spans are
+  * appended to the Trace of the current thread, if any (one app run),
+  * emitted as one JSON line on the 'factor.spans' logger, at DEBUG level,
+  * added to STAGE_STATS, the process-wide latency percentiles per stage.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+import numpy as np
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger('factor.spans')
+
+# durations kept per stage for the percentiles
+STATS_WINDOW = 1000
+PERCENTILES = [50, 90, 99]
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+# ru_maxrss is in kilobytes on Linux, bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+_local = threading.local()
+
+if os.environ.get('FACTOR_TRACEMALLOC') == '1' and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def current_rss() -> int:
+    """
+    Resident set size of the process in bytes, 0 when unknown
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def peak_rss() -> int:
+    """
+    Peak resident set size of the process in bytes, 0 when unknown
+    """
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+class StageStats():
+    def __init__(self, window: int = STATS_WINDOW) -> None:
+        self.window = window
+        self._seconds = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self._seconds:
+                self._seconds[stage] = deque(maxlen=self.window)
+            self._seconds[stage].append(seconds)
+
+    def summary(self) -> list:
+        """
+        [{stage, count, p50, p90, p99}] over the last `window` spans of every stage, seconds
+        """
+        with self._lock:
+            samples = {stage: np.array(seconds) for stage, seconds in self._seconds.items()}
+        rows = []
+        for stage, seconds in sorted(samples.items()):
+            row = {'stage': stage, 'count': len(seconds)}
+            row.update({f'p{p}': float(v) for p, v in zip(PERCENTILES, np.percentile(seconds, PERCENTILES))})
+            rows.append(row)
+        return rows
+
+    def clear(self) -> None:
+        with self._lock:
+            self._seconds.clear()
+
+
+STAGE_STATS = StageStats()
+
+
+class Trace():
+    """
+    Spans finished in this thread while the trace is active, in finishing order
+    """
+    def __init__(self, name: str = 'run') -> None:
+        self.name = name
+        self.spans = []
+
+    def __enter__(self) -> 'Trace':
+        self._previous = getattr(_local, 'trace', None)
+        _local.trace = self
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _local.trace = self._previous
+
+    def started(self, s: 'Span') -> None:
+        """
+        Called when a span starts in this thread, before it runs; raising stops the stage
+        """
+
+    def records(self) -> list:
+        return [s.record() for s in self.spans]
+
+
+class Span():
+    def __init__(self, stage: str, **attrs) -> None:
+        self.stage = stage
+        self.attrs = attrs
+        self.rows_in = attrs.pop('rows_in', None)
+        self.rows_out = None
+        self.seconds = None
+        self.rss_delta = None
+        self.process_peak_rss = None
+        self.alloc_peak = None
+        self.depth = 0
+        self.error = None
+
+    def __enter__(self) -> 'Span':
+        trace = current_trace()
+        if trace is not None:
+            trace.started(self)
+        stack = _stack()
+        self.depth = len(stack)
+        self._tracing = tracemalloc.is_tracing()
+        if self._tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # the reset below drops the enclosing span's peak so far, it keeps it
+            if stack and stack[-1]._tracing:
+                stack[-1]._saved_peak = max(stack[-1]._saved_peak, peak)
+            self._alloc_start = current
+            # traced bytes at the peaks tracemalloc no longer reports: before
+            # a nested span reset it and within nested spans
+            self._saved_peak = 0
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self._rss_start = current_rss()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.seconds = time.perf_counter() - self._started
+        self.rss_delta = current_rss() - self._rss_start
+        self.process_peak_rss = peak_rss()
+        if self._tracing and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self._saved_peak)
+            self.alloc_peak = peak - self._alloc_start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+
+        stack = _stack()
+        stack.pop()
+        if stack and self.alloc_peak is not None and stack[-1]._tracing:
+            stack[-1]._saved_peak = max(stack[-1]._saved_peak, self.alloc_peak + self._alloc_start)
+        _finish(self)
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def record(self) -> dict:
+        record = {
+            'stage': self.stage,
+            'depth': self.depth,
+            'seconds': self.seconds,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rss_delta': self.rss_delta,
+            'process_peak_rss': self.process_peak_rss,
+            'alloc_peak': self.alloc_peak,
+        }
+        record.update(self.attrs)
+        if self.error is not None:
+            record['error'] = self.error
+        return record
+
+
+def span(stage: str, **attrs) -> Span:
+    return Span(stage, **attrs)
+
+
+def current_trace() -> Trace:
+    return getattr(_local, 'trace', None)
+
+
+def _stack() -> list:
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _finish(s: Span) -> None:
+    trace = current_trace()
+    if trace is not None:
+        trace.spans.append(s)
+    if s.error is None:
+        STAGE_STATS.add(s.stage, s.seconds)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(s.record(), default=str))
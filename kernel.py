@@ -0,0 +1,181 @@
+"""
+NumPy kernel of the factor decomposition.
+
+Takes the merged base/fact sums produced by ``DataSets.filter_data`` and
+builds the product-client table ``dm1`` in one go: the measures are computed
+on contiguous float64 arrays, product and client attributes are added with
+positional takes, and the frame is assembled once with its final column names.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+from parallel import row_chunks, run
+from store import MISSING_CODE
+
+PRODUCT_COLS = ['Article', 'Brand', 'Product_group', 'Mark', 'Manager_Marketing', 'Manager_Supply', 'ABC_XYZ']
+CLIENT_COLS = ['Client_name', 'Channel']
+
+PRICE_COL = 'Сhange in profit due to price'
+COST_COL = 'Сhange in profit due to cost'
+VOL_COL = 'Сhange in profit due to structure'
+FACTOR_COLS = [PRICE_COL, COST_COL, VOL_COL]
+
+# digits id_client is padded to in the product-client key
+PAIR_KEY_CLIENT_DIGITS = 9
+PAIR_KEY_BASE = 10 ** PAIR_KEY_CLIENT_DIGITS
+
+
+def pair_key(id_commodity: np.ndarray, id_client: np.ndarray) -> np.ndarray:
+    """
+    Unambiguous integer product-client key: id_commodity followed by id_client
+    zero-padded to PAIR_KEY_CLIENT_DIGITS, e.g. 12 and 3 give 12000000003.
+    The width is fixed, so a pair has the same key in every table it is in
+    """
+    id_commodity = id_commodity.astype(np.int64)
+    id_client = id_client.astype(np.int64)
+    if len(id_client) and (id_client.min() < 0 or id_client.max() >= PAIR_KEY_BASE):
+        raise ValueError(f'client ids have to be within 0 and {PAIR_KEY_BASE - 1} for the product-client key')
+    return id_commodity * PAIR_KEY_BASE + id_client
+
+
+# kernel name -> dm1 column of every float measure, in dm1 order
+MEASURE_COLS = {
+    'amount_b': 'Revenue base',
+    'cost_b': 'Cost of Sales base',
+    'qty_b': 'Sales base, pcs',
+    'pr_b': 'Profit base',
+    'rent_b': 'Profitability base',
+    'amount_f': 'Revenue fact',
+    'cost_f': 'Cost of Sales fact',
+    'qty_f': 'Sales fact, pcs',
+    'pr_f': 'Profit fact',
+    'rent_f': 'Profitability fact',
+    'price_b': 'Price 1 piece base',
+    'price_f': 'Price 1 piece fact',
+    'unit_cost_b': 'Cost 1 piece base',
+    'unit_cost_f': 'Cost 1 piece fact',
+    'delta_price': PRICE_COL,
+    'delta_cost': COST_COL,
+    'delta_vol': VOL_COL,
+}
+
+# filter_data column -> kernel input
+INPUT_COLS = {
+    'SalesAmount_base': 'amount_b',
+    'SalesCost_base': 'cost_b',
+    'SalesQty_base': 'qty_b',
+    'SalesAmount_fact': 'amount_f',
+    'SalesCost_fact': 'cost_f',
+    'SalesQty_fact': 'qty_f',
+}
+
+
+def to_float(values: pd.Series) -> np.ndarray:
+    """
+    float64 values of a column, NaN where it is missing
+    """
+    return values.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def divide(num: np.ndarray, den: np.ndarray, out: np.ndarray, finite: bool = True) -> None:
+    """
+    out = num / den, with 0 where the ratio is not finite unless finite is False
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(num, den, out=out)
+    if finite:
+        out[~np.isfinite(out)] = 0
+
+
+def decompose(m: dict) -> np.ndarray:
+    """
+    Fills the measures of m (float64 column views keyed as in MEASURE_COLS) from
+    amount/cost/qty of both periods, missing periods already set to 0.
+    Returns is_absent.
+    """
+    for p in ('b', 'f'):
+        divide(m[f'amount_{p}'], m[f'qty_{p}'], out=m[f'price_{p}'])
+        divide(m[f'cost_{p}'], m[f'qty_{p}'], out=m[f'unit_cost_{p}'])
+        np.subtract(m[f'amount_{p}'], m[f'cost_{p}'], out=m[f'pr_{p}'])
+        # profitability keeps inf/nan for pairs without cost, as it always did
+        divide(m[f'pr_{p}'], m[f'cost_{p}'], out=m[f'rent_{p}'], finite=False)
+
+    # a pair missing from one period (or with negative cost) only has a volume effect
+    is_absent = (m['qty_b'] == 0) | (m['qty_f'] == 0) | (m['cost_b'] < 0) | (m['cost_f'] < 0)
+
+    np.subtract(m['price_f'], m['price_b'], out=m['delta_price'])
+    m['delta_price'] *= m['qty_f']
+    m['delta_price'][is_absent] = 0
+
+    np.subtract(m['unit_cost_b'], m['unit_cost_f'], out=m['delta_cost'])
+    m['delta_cost'] *= m['qty_f']
+    m['delta_cost'][is_absent] = 0
+
+    np.subtract(m['qty_f'], m['qty_b'], out=m['delta_vol'])
+    m['delta_vol'] *= m['price_b'] - m['unit_cost_b']
+    m['delta_vol'][is_absent] = (m['pr_f'] - m['pr_b'])[is_absent]
+
+    return is_absent
+
+
+def lookup(dictionary: pd.DataFrame, keys: np.ndarray, cols: list) -> dict:
+    """
+    dictionary[cols] aligned to keys by position, NaN for unknown keys
+    """
+    pos = dictionary.index.get_indexer(keys)
+    return {col: take(dictionary[col].array, pos, allow_fill=True) for col in cols}
+
+
+def factor_table(dm: pd.DataFrame, df_products: pd.DataFrame, df_clients: pd.DataFrame, branch_dict: dict, workers: int = 1) -> pd.DataFrame:
+    """
+    Builds dm1 (one row per product-client pair, in the order of dm) from the output of filter_data.
+    The measures of large tables are computed on `workers` threads, over disjoint row ranges
+    """
+    id_commodity = dm['id_commodity'].to_numpy()
+    id_client = dm['id_client'].to_numpy()
+
+    # all float measures live in one Fortran-ordered block: every column is contiguous
+    # and the block becomes the frame's float storage without another copy
+    block = np.empty((len(dm), len(MEASURE_COLS) + 1), order='F')
+    m = {name: block[:, j + 1] for j, name in enumerate(MEASURE_COLS)}
+    inputs = {name: to_float(dm[col]) for col, name in INPUT_COLS.items()}
+    is_absent = np.empty(len(dm), dtype=bool)
+
+    def measures(rows: slice) -> None:
+        chunk = {name: values[rows] for name, values in m.items()}
+        for name, values in inputs.items():
+            chunk[name][:] = values[rows]
+            chunk[name][np.isnan(chunk[name])] = 0
+        is_absent[rows] = decompose(chunk)
+
+    run(measures, row_chunks(len(dm), workers), workers)
+
+    id_department = block[:, 0]
+    id_department[:] = to_float(dm['id_branch_base'])
+    missing = np.isnan(id_department)
+    id_department[missing] = to_float(dm['id_branch_fact'])[missing]
+    # unknown clients: NaN before the store encoded them, MISSING_CODE since, 0 in dm1 either way
+    id_department[np.isnan(id_department) | (id_department == MISSING_CODE)] = 0
+
+    dm1 = pd.DataFrame(block, columns=['id_department'] + list(MEASURE_COLS.values()), copy=False)
+    dm1.insert(dm1.columns.get_loc(PRICE_COL), 'is_absent', is_absent)
+
+    products = lookup(df_products, id_commodity, PRODUCT_COLS)
+    clients = lookup(df_clients, id_client, CLIENT_COLS + ['id_branch'])
+    branches = pd.Series(branch_dict)
+    branch = take(branches.array, branches.index.get_indexer(clients['id_branch']), allow_fill=True)
+
+    # reference columns go in front of the measures
+    front = {
+        'branch': branch,
+        'id product-client': pair_key(id_commodity, id_client),
+        'id_commodity': id_commodity,
+        'id_client': id_client,
+    }
+    for loc, (col, values) in enumerate(front.items()):
+        dm1.insert(loc, col, values)
+    loc = dm1.columns.get_loc('Revenue base')
+    for col in PRODUCT_COLS + CLIENT_COLS:
+        dm1.insert(loc, col, products[col] if col in products else clients[col])
+        loc += 1
+    return dm1
@@ -0,0 +1,143 @@
+"""
+Memory-mapped Arrow IPC files of the prepared sales, their posting lists and
+the cube.
+
+Opening such a file maps it instead of parsing it: every column is a
+read-only NumPy view of the mapping, so startup costs a few system calls and
+all processes that open the same file (app replicas, batch workers) share
+one copy of it in the page cache. Pages are read from disk the first time
+they are touched. Anything derived from a mapped column (filters, appended
+update rows) is private memory as usual.
+
+Files are uncompressed, one record batch, fixed-width columns without nulls.
+"""
+import os
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+# id of the mapping buffer -> (weak reference to it, path, stamp) of every file mapped here
+_mapped = {}
+_mapped_lock = threading.Lock()
+
+# (path, stamp) -> mapping buffer reopened by attach()
+_reopened = {}
+
+
+def file_stamp(path: str) -> str:
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+def write_table(table: pa.Table, path: str, metadata: dict = None) -> None:
+    """
+    Writes table as a mappable Arrow IPC file, replacing path atomically:
+    processes still mapping the old file keep reading it
+    """
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    table = table.combine_chunks()
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def read_metadata(path: str) -> dict:
+    """
+    Schema metadata of an Arrow IPC file, without mapping its columns
+    """
+    with pa.memory_map(path) as source:
+        return ipc.open_file(source).schema.metadata or {}
+
+
+def _numpy_dtype(arrow_type) -> np.dtype:
+    if pa.types.is_timestamp(arrow_type):
+        return np.dtype(f'datetime64[{arrow_type.unit}]')
+    return np.dtype(arrow_type.to_pandas_dtype())
+
+
+def _map(path: str) -> tuple:
+    stamp = file_stamp(path)
+    buffer = pa.memory_map(path).read_buffer()
+    with _mapped_lock:
+        key = id(buffer)
+        _mapped[key] = (weakref.ref(buffer, lambda _: _mapped.pop(key, None)), path, stamp)
+    return buffer, stamp
+
+
+def open_table(path: str) -> tuple:
+    """
+    Maps an Arrow IPC file: ({column: read-only array view of the mapping}, schema metadata)
+    """
+    buffer, _ = _map(path)
+    table = ipc.open_file(buffer).read_all()
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if column.num_chunks != 1:
+            raise ValueError(f'{path}: column {name} is not one record batch')
+        array = column.chunk(0)
+        fixed_width = pa.types.is_integer(array.type) or pa.types.is_floating(array.type) or pa.types.is_timestamp(array.type)
+        if array.null_count or not fixed_width:
+            raise ValueError(f'{path}: column {name} is not a fixed-width column without nulls')
+        dtype = _numpy_dtype(array.type)
+        if len(array) == 0:
+            columns[name] = np.empty(0, dtype=dtype)
+            continue
+        offset = array.buffers()[1].address - buffer.address + array.offset * dtype.itemsize
+        # the view's base is the mapping buffer, which stays mapped as long as any view is alive
+        columns[name] = np.frombuffer(buffer, dtype=dtype, count=len(array), offset=offset)
+    return columns, table.schema.metadata or {}
+
+
+def open_frame(path: str) -> tuple:
+    """
+    (DataFrame of mapped columns, schema metadata)
+    """
+    columns, metadata = open_table(path)
+    # copy=False keeps every column a view of the mapping rather than consolidating them
+    return pd.DataFrame(columns, copy=False), metadata
+
+
+def mapped_location(values: np.ndarray):
+    """
+    (path, stamp, offset) of an array that is a contiguous view of a mapped
+    file still unchanged on disk, None otherwise
+    """
+    if not values.flags.c_contiguous:
+        return None
+    base = values
+    while isinstance(base, np.ndarray):
+        base = base.base
+    with _mapped_lock:
+        entry = _mapped.get(id(base))
+    if entry is None or entry[0]() is not base:
+        return None
+    _, path, stamp = entry
+    try:
+        if file_stamp(path) != stamp:
+            return None
+    except OSError:
+        return None
+    offset = values.__array_interface__['data'][0] - base.address
+    return path, stamp, offset
+
+
+def map_array(path: str, stamp: str, offset: int, dtype: str, shape: tuple) -> np.ndarray:
+    """
+    The array at offset of a mapped file, as located by mapped_location in another process
+    """
+    key = (path, stamp)
+    if key not in _reopened:
+        buffer, current = _map(path)
+        if current != stamp:
+            raise RuntimeError(f'{path} changed since it was shared')
+        _reopened[key] = buffer
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    return np.frombuffer(_reopened[key], dtype=dtype, count=count, offset=offset).reshape(shape)
@@ -0,0 +1,138 @@
+"""
+Commodity-partitioned parallel execution of the window aggregation, the
+base/fact merge and the factor kernel.
+
+Shards are contiguous ranges of id_commodity cut at quantiles of the data
+being split, so every (commodity, client) pair lives in exactly one shard and
+the per-shard results, concatenated in shard order, are the single-threaded
+result in the same (id_commodity, id_client) order. The shards run on a
+thread pool: they read the in-memory columns without copying them to
+workers, and the hashing, group sums and NumPy arithmetic release the GIL.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+DEFAULT_WORKERS = 1
+
+# shards per worker, evens out shards that turn out slower
+SHARDS_PER_WORKER = 2
+
+# inputs with fewer rows are processed in one piece
+MIN_PARALLEL_ROWS = 100_000
+
+_pools = {}
+_pools_lock = threading.Lock()
+# set on the threads of the pools
+_local = threading.local()
+
+
+def default_workers() -> int:
+    """
+    FACTOR_WORKERS from the environment, 0 meaning every core
+    """
+    workers = int(os.environ.get('FACTOR_WORKERS', DEFAULT_WORKERS))
+    return workers if workers > 0 else os.cpu_count()
+
+
+def _on_pool() -> None:
+    _local.on_pool = True
+
+
+def get_pool(workers: int) -> ThreadPoolExecutor:
+    """
+    Process-wide thread pool of `workers` threads
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(workers, thread_name_prefix='factor-shard', initializer=_on_pool)
+        return _pools[workers]
+
+
+def run(fn, items: list, workers: int) -> list:
+    """
+    [fn(item) for item in items], on the pool when workers > 1. Called on a
+    pool thread it runs inline: waiting there for items queued behind the
+    caller could deadlock the pool
+    """
+    if workers <= 1 or len(items) <= 1 or getattr(_local, 'on_pool', False):
+        return [fn(item) for item in items]
+    return list(get_pool(workers).map(fn, items))
+
+
+def n_shards(n_rows: int, workers: int) -> int:
+    if workers <= 1 or n_rows < MIN_PARALLEL_ROWS:
+        return 1
+    return workers * SHARDS_PER_WORKER
+
+
+def shard_bounds(id_commodity: np.ndarray, shards: int) -> np.ndarray:
+    """
+    Ascending cut points splitting id_commodity into at most `shards` ranges of
+    about equal row counts, shard k holds bounds[k-1] <= id_commodity < bounds[k]
+    """
+    if shards <= 1 or len(id_commodity) == 0:
+        return np.empty(0, dtype=np.int64)
+    kth = (np.arange(1, shards) * len(id_commodity)) // shards
+    return np.unique(np.partition(id_commodity, kth)[kth].astype(np.int64))
+
+
+def split_rows(id_commodity: np.ndarray, bounds: np.ndarray) -> list:
+    """
+    Positions into id_commodity of every shard, ascending within a shard
+    """
+    if len(bounds) == 0:
+        return [np.arange(len(id_commodity))]
+    shard = np.searchsorted(bounds, id_commodity, side='right').astype(np.int16)
+    # stable sort of small ints is a radix sort
+    order = np.argsort(shard, kind='stable')
+    cuts = np.cumsum(np.bincount(shard, minlength=len(bounds) + 1))[:-1]
+    return np.split(order, cuts)
+
+
+def split_sorted(id_commodity: np.ndarray, bounds: np.ndarray) -> list:
+    """
+    Row slices of every shard of an id_commodity-sorted array
+    """
+    cuts = [0] + np.searchsorted(id_commodity, bounds, side='left').tolist() + [len(id_commodity)]
+    return [slice(lo, hi) for lo, hi in zip(cuts[:-1], cuts[1:])]
+
+
+def row_chunks(n_rows: int, workers: int) -> list:
+    """
+    Equal contiguous row slices for elementwise work
+    """
+    shards = n_shards(n_rows, workers)
+    cuts = np.linspace(0, n_rows, shards + 1).astype(np.int64).tolist()
+    return [slice(lo, hi) for lo, hi in zip(cuts[:-1], cuts[1:])]
+
+
+def by_commodity(df: pd.DataFrame, fn, workers: int) -> pd.DataFrame:
+    """
+    fn applied to every commodity shard of df (rows in any order), results
+    concatenated in shard order
+    """
+    id_commodity = df['id_commodity'].to_numpy()
+    bounds = shard_bounds(id_commodity, n_shards(len(df), workers))
+    if len(bounds) == 0:
+        return fn(df)
+    parts = run(lambda rows: fn(df.take(rows)), split_rows(id_commodity, bounds), workers)
+    return pd.concat(parts, ignore_index=True)
+
+
+def zip_by_commodity(left: pd.DataFrame, right: pd.DataFrame, fn, workers: int) -> pd.DataFrame:
+    """
+    fn(left shard, right shard) over the same commodity ranges of two frames
+    sorted by id_commodity, results concatenated in shard order
+    """
+    left_ids, right_ids = left['id_commodity'].to_numpy(), right['id_commodity'].to_numpy()
+    shards = n_shards(len(left) + len(right), workers)
+    sorted_ids = left['id_commodity'].is_monotonic_increasing and right['id_commodity'].is_monotonic_increasing
+    if shards == 1 or not sorted_ids:
+        return fn(left, right)
+    bounds = shard_bounds(np.concatenate([left_ids, right_ids]), shards)
+    pairs = list(zip(split_sorted(left_ids, bounds), split_sorted(right_ids, bounds)))
+    parts = run(lambda pair: fn(left.iloc[pair[0]], right.iloc[pair[1]]), pairs, workers)
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,129 @@
+"""
+Heatmap data for the three factors built from one grouped reduction.
+
+dm1 is grouped once by (x, y) for the price, cost and structure effects and
+the fact revenue. The cells feed the renderers in long form (one row per
+cell) and in wide form (y by x pivot per factor). X values outside the ABC
+cutoff are rolled into a single OTHER_LABEL column. For the charts,
+fold_cells also caps the number of labels on both axes the same way.
+"""
+import numpy as np
+import pandas as pd
+from kernel import PRICE_COL, COST_COL, VOL_COL, FACTOR_COLS
+
+REVENUE_COL = 'Revenue fact'
+OTHER_LABEL = 'Other'
+
+
+def abc_keep(revenue: pd.Series, cutoff: float) -> pd.Index:
+    """
+    Values of the axis that make up the top `cutoff` share of revenue,
+    including the one that crosses it
+    """
+    if cutoff >= 1:
+        return revenue.index
+    revenue = revenue.sort_values(ascending=False)
+    total = revenue.sum()
+    if total <= 0:
+        return revenue.index
+    share_before = (revenue.cumsum() - revenue) / total
+    return revenue.index[share_before.to_numpy() < cutoff]
+
+
+def axis_order(labels: pd.Series) -> list:
+    """
+    Distinct labels sorted, OTHER_LABEL last
+    """
+    distinct = set(labels)
+    order = sorted(label for label in distinct if label != OTHER_LABEL)
+    if OTHER_LABEL in distinct:
+        order.append(OTHER_LABEL)
+    return order
+
+
+def wide_forms(cells: pd.DataFrame, x_axis: str, y_axis: str) -> dict:
+    """
+    y by x pivot of every factor of the long-form cells
+    """
+    x_order = axis_order(cells[x_axis])
+    wide = {}
+    for col in FACTOR_COLS:
+        wide[col] = cells.pivot(index=y_axis, columns=x_axis, values=col).reindex(columns=x_order)
+        wide[col].columns.name = x_axis
+    return wide
+
+
+def fold_cells(cells: pd.DataFrame, x_axis: str, y_axis: str, max_labels: int) -> pd.DataFrame:
+    """
+    cells with at most max_labels values per axis besides OTHER_LABEL: the values
+    with the smallest total absolute effect are folded into OTHER_LABEL
+    """
+    weight = pd.Series(np.abs(cells[FACTOR_COLS].to_numpy(dtype=np.float64)).sum(axis=1), index=cells.index)
+    labels, folded = {}, False
+    for axis in (x_axis, y_axis):
+        totals = weight.groupby(cells[axis]).sum()
+        totals = totals.drop(OTHER_LABEL, errors='ignore')
+        labels[axis] = cells[axis]
+        if len(totals) > max_labels:
+            keep = totals.nlargest(max_labels).index
+            labels[axis] = cells[axis].where(cells[axis].isin(keep), OTHER_LABEL)
+            folded = True
+    if not folded:
+        return cells
+    return cells.groupby([labels[x_axis], labels[y_axis]], sort=False)[FACTOR_COLS + [REVENUE_COL]].sum().reset_index()
+
+
+class Pivots():
+    def __init__(self, dm1: pd.DataFrame, x_axis: str, y_axis: str, abc_cutoff: float = 1.0) -> None:
+        """
+        x_axis/y_axis are dm1 columns, abc_cutoff is the share of fact revenue
+        whose X values keep their own column
+        """
+        if x_axis == y_axis:
+            raise ValueError("X and Y axes have to differ")
+        self.x_axis, self.y_axis = x_axis, y_axis
+
+        cells = dm1.groupby([x_axis, y_axis], sort=False)[FACTOR_COLS + [REVENUE_COL]].sum()
+
+        keep = abc_keep(cells[REVENUE_COL].groupby(level=0).sum(), abc_cutoff)
+        x_values = cells.index.get_level_values(0)
+        # X values with their own column, None when all of them have one
+        self.x_keep = None
+        if len(keep) < len(x_values.unique()):
+            self.x_keep = keep
+            x_labels = x_values.where(x_values.isin(keep), OTHER_LABEL)
+            cells = cells.groupby([x_labels, cells.index.get_level_values(1)], sort=False).sum()
+            cells.index.names = [x_axis, y_axis]
+
+        # long form: one row per (x, y) cell with every factor
+        self.cells = cells.reset_index()
+
+        # wide form: y by x pivot of every factor
+        self.wide = wide_forms(self.cells, x_axis, y_axis)
+
+    def cell_labels(self, dm1: pd.DataFrame) -> tuple:
+        """
+        (x, y) labels of the cell every dm1 row is summed into
+        """
+        x_labels = dm1[self.x_axis]
+        if self.x_keep is not None:
+            x_labels = x_labels.where(x_labels.isin(self.x_keep) | x_labels.isna(), OTHER_LABEL)
+        return x_labels, dm1[self.y_axis]
+
+    def long(self, col: str) -> pd.DataFrame:
+        """
+        Columns x_axis, y_axis, col of one factor, largest effect first
+        """
+        return self.cells[[self.x_axis, self.y_axis, col]].sort_values(col, ascending=False)
+
+    @property
+    def pivot_price(self) -> pd.DataFrame:
+        return self.wide[PRICE_COL]
+
+    @property
+    def pivot_cost(self) -> pd.DataFrame:
+        return self.wide[COST_COL]
+
+    @property
+    def pivot_vol(self) -> pd.DataFrame:
+        return self.wide[VOL_COL]
@@ -0,0 +1,96 @@
+"""
+Rollup of the factor results of one base/fact window pair over the six
+dimensions of the sidebar.
+
+The factors are computed per product-client pair and are not additive in
+amount/cost/qty (price and cost effects are weighted by each pair's own fact
+quantity), so the rollup sums the per-pair results: the three effects, fact
+revenue and both profits. Every dimension filter selects whole pairs, so any
+X/Y pair under any combination of filters is a groupby over the few rollup
+rows that pass the filters, equal to grouping the filtered product-client
+table.
+"""
+import numpy as np
+import pandas as pd
+from store import lookup_codes
+from kernel import FACTOR_COLS
+from pivots import Pivots, REVENUE_COL
+
+# sales column of the filter -> dm1 column shown on the axis
+ROLLUP_DIMS = {
+    'id_branch': 'branch',
+    'id_channel': 'Channel',
+    'id_brand': 'Brand',
+    'id_group': 'Product_group',
+    'id_mark': 'Mark',
+    'id_manager': 'Manager_Marketing',
+}
+CLIENT_CODES = ['id_branch', 'id_channel']
+
+ROLLUP_SUMS = FACTOR_COLS + [REVENUE_COL, 'Profit base', 'Profit fact']
+PAIRS_COL = 'pairs'
+
+
+def pair_codes(dm1: pd.DataFrame, df_products: pd.DataFrame, df_clients: pd.DataFrame) -> pd.DataFrame:
+    """
+    Dimension codes of every dm1 row, MISSING_CODE where the product or client is unknown
+    """
+    codes = pd.DataFrame(index=dm1.index)
+    for col in ROLLUP_DIMS:
+        if col in CLIENT_CODES:
+            codes[col] = lookup_codes(dm1['id_client'], df_clients, col)
+        else:
+            codes[col] = lookup_codes(dm1['id_commodity'], df_products, col)
+    return codes
+
+
+def filter_mask(codes: pd.DataFrame, filters: dict) -> np.ndarray:
+    """
+    Rows of codes passing every non-empty filter
+    """
+    mask = np.ones(len(codes), dtype=bool)
+    for col, values in filters.items():
+        if values:
+            mask &= codes[col].isin(values).to_numpy()
+    return mask
+
+
+class Rollup():
+    def __init__(self, dm1: pd.DataFrame, df_products: pd.DataFrame, df_clients: pd.DataFrame) -> None:
+        """
+        dm1 is the unfiltered product-client table of the window pair
+        """
+        self.codes = pair_codes(dm1, df_products, df_clients)
+
+        keys = pd.concat([self.codes, dm1[list(ROLLUP_DIMS.values())]], axis=1)
+        table = pd.concat([keys, dm1[ROLLUP_SUMS]], axis=1)
+        table[PAIRS_COL] = 1
+        # unknown labels are kept here and dropped by the final groupby, as in Pivots
+        self.table = table.groupby(list(keys.columns), sort=False, dropna=False).sum().reset_index()
+
+    def select(self, filters: dict) -> pd.DataFrame:
+        """
+        Rollup rows passing the filters
+        """
+        return self.table.loc[filter_mask(self.table, filters)]
+
+    def pivots(self, filters: dict, x_axis: str, y_axis: str, abc_cutoff: float = 1.0) -> Pivots:
+        return Pivots(self.select(filters), x_axis, y_axis, abc_cutoff)
+
+    def totals(self, filters: dict) -> dict:
+        """
+        Sums of ROLLUP_SUMS and the number of pairs passing the filters
+        """
+        selected = self.select(filters)
+        totals = {col: float(selected[col].sum()) for col in ROLLUP_SUMS}
+        totals[PAIRS_COL] = int(selected[PAIRS_COL].sum())
+        return totals
+
+    def product_client(self, dm1: pd.DataFrame, filters: dict) -> pd.DataFrame:
+        """
+        Rows of the unfiltered dm1 this rollup was built from that pass the filters,
+        the same table filter_data and factor_table give for the filters
+        """
+        if not any(filters.values()):
+            return dm1
+        return dm1.loc[filter_mask(self.codes, filters)].reset_index(drop=True)
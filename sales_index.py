@@ -0,0 +1,151 @@
+"""
+Row index over the date-sorted sales.
+
+Date windows are resolved with a binary search over DocumentDate. Each
+dimension filter is answered from a per-value posting list (ascending row
+positions). The lists are intersected before any sales column is read.
+"""
+import numpy as np
+import pandas as pd
+
+# filter_data argument -> sales column it filters on
+FILTER_DIMS = {
+    'channels': 'id_channel',
+    'depts': 'id_branch',
+    'brands': 'id_brand',
+    'managers': 'id_manager',
+    'groups': 'id_group',
+    'marks': 'id_mark',
+}
+
+
+def to_datetime64(ts) -> np.datetime64:
+    return pd.Timestamp(ts).to_datetime64()
+
+
+class SalesIndex():
+    def __init__(self, df_sales: pd.DataFrame) -> None:
+        """
+        df_sales has to be sorted by DocumentDate
+        """
+        self.n_rows = len(df_sales)
+        self.dates = df_sales['DocumentDate'].to_numpy()
+        self.pos_dtype = np.int32 if self.n_rows < np.iinfo(np.int32).max else np.int64
+
+        # per dimension: row positions grouped by value, plus the slice of every value
+        self.postings = {}
+        for col in FILTER_DIMS.values():
+            codes = df_sales[col].to_numpy()
+            order = np.argsort(codes, kind='stable').astype(self.pos_dtype)
+            values, starts = np.unique(codes[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            self.postings[col] = (order, dict(zip(values.tolist(), zip(starts.tolist(), ends.tolist()))))
+
+    def append(self, new_sales: pd.DataFrame) -> 'SalesIndex':
+        """
+        New index of the sales followed by new_sales, which must be sorted and
+        not earlier than the last indexed sale. The old postings are copied
+        into place rather than re-sorted.
+        """
+        index = SalesIndex.__new__(SalesIndex)
+        index.n_rows = self.n_rows + len(new_sales)
+        index.dates = np.concatenate([self.dates, new_sales['DocumentDate'].to_numpy().astype(self.dates.dtype)])
+        index.pos_dtype = np.int32 if index.n_rows < np.iinfo(np.int32).max else np.int64
+
+        index.postings = {}
+        for col in FILTER_DIMS.values():
+            order, slices = self.postings[col]
+            codes = new_sales[col].to_numpy()
+            new_order = np.argsort(codes, kind='stable')
+            values, starts = np.unique(codes[new_order], return_index=True)
+            ends = np.append(starts[1:], len(new_order))
+            new_slices = dict(zip(values.tolist(), zip(starts.tolist(), ends.tolist())))
+            new_order = (new_order + self.n_rows).astype(index.pos_dtype)
+
+            # per value: its old positions, then its new ones
+            parts, merged, at = [], {}, 0
+            for value in sorted(set(slices) | set(new_slices)):
+                start = at
+                for positions, value_slices in ((order, slices), (new_order, new_slices)):
+                    if value in value_slices:
+                        lo, hi = value_slices[value]
+                        parts.append(positions[lo:hi])
+                        at += hi - lo
+                merged[value] = (start, at)
+            combined = np.concatenate(parts).astype(index.pos_dtype, copy=False) if parts else order.astype(index.pos_dtype)
+            index.postings[col] = (combined, merged)
+        return index
+
+    def posting_lists(self) -> tuple:
+        """
+        ({column: row positions grouped by value}, {column: [[value, start, end], ...]}),
+        what from_posting_lists takes back
+        """
+        orders = {col: order for col, (order, _) in self.postings.items()}
+        slices = {col: [[value, start, end] for value, (start, end) in value_slices.items()]
+                  for col, (_, value_slices) in self.postings.items()}
+        return orders, slices
+
+    @classmethod
+    def from_posting_lists(cls, df_sales: pd.DataFrame, orders: dict, slices: dict) -> 'SalesIndex':
+        """
+        Index of df_sales from the posting lists of posting_lists(), e.g. mapped from a file
+        """
+        index = cls.__new__(cls)
+        index.n_rows = len(df_sales)
+        index.dates = df_sales['DocumentDate'].to_numpy()
+        index.pos_dtype = np.int32 if index.n_rows < np.iinfo(np.int32).max else np.int64
+        index.postings = {}
+        for col in FILTER_DIMS.values():
+            if len(orders[col]) != index.n_rows:
+                raise ValueError(f'posting list of {col} does not match the sales')
+            index.postings[col] = (orders[col], {value: (start, end) for value, start, end in slices[col]})
+        return index
+
+    def position(self, ts, side: str = 'left') -> int:
+        """
+        Insertion point of ts into the sorted DocumentDate
+        """
+        return int(np.searchsorted(self.dates, to_datetime64(ts), side=side))
+
+    def date_range(self, dt_start, dt_end) -> tuple:
+        """
+        Row range [lo, hi) of dt_start <= DocumentDate <= dt_end
+        """
+        lo, hi = self.position(dt_start), self.position(dt_end, side='right')
+        return lo, max(lo, hi)
+
+    def posting(self, col: str, value, lo: int, hi: int) -> np.ndarray:
+        """
+        Ascending positions in [lo, hi) where df_sales[col] == value
+        """
+        order, slices = self.postings[col]
+        if value not in slices:
+            return order[:0]
+        start, end = slices[value]
+        rows = order[start:end]
+        return rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)]
+
+    def rows(self, filters: dict, dt_start, dt_end):
+        """
+        Positions of the sales matching the date window and every non-empty filter.
+        filters maps a sales column to the list of accepted values.
+        Returns a slice when no dimension filter is set.
+        """
+        lo, hi = self.date_range(dt_start, dt_end)
+        active = {col: values for col, values in filters.items() if values}
+        if not active:
+            return slice(lo, hi)
+
+        if len(active) == 1:
+            (col, values), = active.items()
+            if len(set(values)) == 1:
+                return self.posting(col, values[0], lo, hi)
+
+        # values of one dimension are disjoint, so a hit counter over the
+        # window marks the rows that every dimension accepts
+        hits = np.zeros(hi - lo, dtype=np.uint8)
+        for col, values in active.items():
+            for value in set(values):
+                hits[self.posting(col, value, lo, hi) - lo] += 1
+        return (np.flatnonzero(hits == len(active)) + lo).astype(self.pos_dtype)
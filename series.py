@@ -0,0 +1,197 @@
+"""
+Factor decomposition of N consecutive periods in one pass.
+
+The sales of all periods are summed per (period, commodity, client) once
+(see DataSets.period_sums: the monthly cube for whole months, one gather of
+the raw rows or one streaming scan otherwise). The pairs are then laid out
+as dense (pairs x periods) arrays and every comparison is decomposed by the
+kernel of a base/fact window pair, all comparisons of a chunk of pairs in one
+vectorized call:
+  * 'adjacent': every period against the one before it. The effects are
+    also chained, i.e. cumulated from the first period, so the last chained
+    profit change is the change from the first period to the last,
+  * 'fixed': every period against the first one.
+The table has one row per comparison, or per comparison and value of a
+product or client column, with the three effects, revenue and profit of
+both periods and the pairs sold in either of them.
+"""
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+from sales_index import FILTER_DIMS
+from store import MONEY_COLS
+from kernel import FACTOR_COLS, CLIENT_COLS, MEASURE_COLS, decompose, lookup, pair_key
+from analysis import canonical_values, canonical_filters
+from parallel import run
+
+SERIES_MODES = ['adjacent', 'fixed']
+
+# (pair, comparison) cells decomposed at once: bounds the measure block,
+# len(MEASURE_COLS) float64 arrays of that many cells
+CHUNK_CELLS = 1 << 18
+
+CHANGE_COL = 'Profit change'
+PAIRS_COL = 'pairs'
+SERIES_SUMS = FACTOR_COLS + ['Revenue base', 'Revenue fact', 'Profit base', 'Profit fact']
+
+# period_sums column -> kernel inputs of the base and the fact period
+SERIES_INPUTS = {
+    'SalesAmount': ('amount_b', 'amount_f'),
+    'SalesCost': ('cost_b', 'cost_f'),
+    'SalesQty': ('qty_b', 'qty_f'),
+}
+
+
+def chained(col: str) -> str:
+    return f'{col}, chained'
+
+
+class SeriesRequest(NamedTuple):
+    channels: tuple
+    depts: tuple
+    brands: tuple
+    managers: tuple
+    groups: tuple
+    marks: tuple
+    # N + 1 period edges: period k is edges[k] <= DocumentDate < edges[k + 1]
+    edges: tuple
+    mode: str = 'adjacent'
+    # axis option (a key of DataSets.axes_options) the effects are split by, None for totals only
+    by: str = None
+
+    @classmethod
+    def create(cls, channels, depts, brands, managers, groups, marks,
+               start, periods: int, freq: str = 'MS', mode: str = 'adjacent', by: str = None) -> 'SeriesRequest':
+        """
+        `periods` consecutive periods of a pandas frequency ('MS' months, 'W-MON'
+        weeks, 'D' days), the first one starting at start rolled forward to the frequency
+        """
+        if mode not in SERIES_MODES:
+            raise ValueError(f'Unknown series mode {mode}, expected one of {SERIES_MODES}')
+        if periods < 2:
+            raise ValueError('A series needs at least two periods')
+        edges = pd.date_range(pd.Timestamp(start), periods=periods + 1, freq=freq)
+        return cls(
+            canonical_values(channels), canonical_values(depts), canonical_values(brands),
+            canonical_values(managers), canonical_values(groups), canonical_values(marks),
+            tuple(edges), mode, by,
+        )
+
+    def filters(self) -> dict:
+        """
+        {sales column: accepted values} as used by SalesIndex and SalesCube
+        """
+        return {FILTER_DIMS[name]: list(getattr(self, name)) for name in FILTER_DIMS}
+
+    def key(self) -> tuple:
+        return (canonical_filters(self.filters()), tuple(edge.isoformat() for edge in self.edges), self.mode, self.by)
+
+
+def comparisons(n_periods: int, mode: str) -> tuple:
+    """
+    (base period, fact period) index arrays of every comparison
+    """
+    fact = np.arange(1, n_periods)
+    base = fact - 1 if mode == 'adjacent' else np.zeros_like(fact)
+    return base, fact
+
+
+def pair_labels(col: str, id_commodity: np.ndarray, id_client: np.ndarray,
+                df_products: pd.DataFrame, df_clients: pd.DataFrame, branch_dict: dict) -> np.ndarray:
+    """
+    dm1[col] of the pairs, as factor_table fills it
+    """
+    if col == 'branch':
+        id_branch = lookup(df_clients, id_client, ['id_branch'])['id_branch']
+        branches = pd.Series(branch_dict)
+        return take(branches.array, branches.index.get_indexer(id_branch), allow_fill=True)
+    if col in CLIENT_COLS:
+        return lookup(df_clients, id_client, [col])[col]
+    return lookup(df_products, id_commodity, [col])[col]
+
+
+def series_table(sums: pd.DataFrame, periods: pd.DatetimeIndex, mode: str, by: str = None,
+                 df_products: pd.DataFrame = None, df_clients: pd.DataFrame = None, branch_dict: dict = None,
+                 workers: int = 1) -> pd.DataFrame:
+    """
+    Decomposition table of the comparisons of `periods` (their start dates).
+    sums holds the MONEY_COLS sums per (period, id_commodity, id_client), period
+    being the position in periods, one row per key. Chunks of pairs run on
+    `workers` threads
+    """
+    base, fact = comparisons(len(periods), mode)
+    n_cmp = len(base)
+
+    id_commodity = sums['id_commodity'].to_numpy()
+    id_client = sums['id_client'].to_numpy()
+    period = sums['period'].to_numpy().astype(np.int64)
+    money = {col: sums[col].to_numpy(dtype=np.float64) for col in MONEY_COLS}
+    codes, pairs = pd.factorize(pair_key(id_commodity, id_client))
+    n_pairs = len(pairs)
+
+    # label of every pair, from its first row
+    if by is None:
+        pair_group, labels = np.zeros(n_pairs, dtype=np.int64), None
+    else:
+        _, first = np.unique(codes, return_index=True)
+        pair_group, labels = pd.factorize(pair_labels(by, id_commodity[first], id_client[first], df_products, df_clients, branch_dict))
+        labels = list(labels)
+        # pairs without a label keep a group of their own, so the groups add up to the totals
+        if (pair_group < 0).any():
+            pair_group = np.where(pair_group < 0, len(labels), pair_group)
+            labels.append(np.nan)
+    n_groups = 1 if labels is None else len(labels)
+
+    positions = {col: j for j, col in enumerate(MEASURE_COLS.values())}
+    order = np.argsort(codes, kind='stable')
+    chunk_pairs = max(1, CHUNK_CELLS // n_cmp)
+    bounds = np.searchsorted(codes[order], np.arange(0, n_pairs + chunk_pairs, chunk_pairs).clip(max=n_pairs))
+    chunks = [(p0, min(p0 + chunk_pairs, n_pairs), lo, hi)
+              for p0, lo, hi in zip(range(0, n_pairs, chunk_pairs), bounds[:-1], bounds[1:])]
+
+    def decompose_chunk(chunk: tuple) -> dict:
+        p0, p1, lo, hi = chunk
+        rows = order[lo:hi]
+        local, at = codes[rows] - p0, period[rows]
+
+        sold = np.zeros((p1 - p0, len(periods)), dtype=bool)
+        sold[local, at] = True
+        block = np.zeros((len(MEASURE_COLS), p1 - p0, n_cmp))
+        m = {name: block[j] for j, name in enumerate(MEASURE_COLS)}
+        for col, (name_b, name_f) in SERIES_INPUTS.items():
+            dense = np.zeros((p1 - p0, len(periods)))
+            dense[local, at] = money[col][rows]
+            m[name_b][:] = dense[:, base]
+            m[name_f][:] = dense[:, fact]
+        decompose(m)
+
+        # one bincount per measure over (group, comparison) cells
+        cell = (pair_group[p0:p1, None] * n_cmp + np.arange(n_cmp)).ravel()
+        cells = {col: np.bincount(cell, weights=block[positions[col]].ravel(), minlength=n_groups * n_cmp)
+                 for col in SERIES_SUMS}
+        cells[PAIRS_COL] = np.bincount(cell, weights=(sold[:, base] | sold[:, fact]).ravel(), minlength=n_groups * n_cmp)
+        return cells
+
+    totals = {col: np.zeros(n_groups * n_cmp) for col in SERIES_SUMS + [PAIRS_COL]}
+    for part in run(decompose_chunk, chunks, workers):
+        for col, values in part.items():
+            totals[col] += values
+
+    table = pd.DataFrame({
+        'base': np.tile(periods[base], n_groups),
+        'fact': np.tile(periods[fact], n_groups),
+    })
+    if labels is not None:
+        table[by] = np.repeat(np.array(labels, dtype=object), n_cmp)
+    for col in SERIES_SUMS:
+        table[col] = totals[col]
+    table[PAIRS_COL] = totals[PAIRS_COL].astype(np.int64)
+    table[CHANGE_COL] = table['Profit fact'] - table['Profit base']
+
+    if mode == 'adjacent':
+        # cumulated per group, rows of a group are in period order
+        group = np.repeat(np.arange(n_groups), n_cmp)
+        for col in FACTOR_COLS + [CHANGE_COL]:
+            table[chained(col)] = table[col].groupby(group).cumsum().to_numpy()
+    return table
@@ -0,0 +1,387 @@
+"""
+Local HTTP service of the factor analysis for other tools.
+
+The dataset is loaded once and kept warm, with its result cache, for the life
+of the process (refreshed in the background when data/ changes, see
+LiveDataSets). Requests are served by a fixed pool of worker threads, which
+share the DataSets like the app sessions do.
+
+Usage:
+    python server.py [--host 127.0.0.1] [--port 8056] [--workers 8] [--streaming]
+
+Endpoints, jobs written as in batch.py ({"base": [...], "fact": [...],
+"x_ax": ..., "y_ax": ..., "channels": [...], ..., "abc_cutoff": ...}):
+    GET  /health       data version, number of sales, first and last sale date
+    GET  /dimensions   filter values per filter: {"channels": {"1": "DIY", ...}, ...}
+    POST /analyze      one job
+    POST /batch        a batch.py spec: every job it describes, in one call
+A job may add "output": "pivots" (default), "totals" or "dm1" (not in a batch),
+and "mode": "exact" (default) or "preview" (see preview.py).
+
+Responses are JSON, or an Arrow IPC stream when the request has
+"Accept: application/vnd.apache.arrow.stream" or ?format=arrow: the cells of
+the pivots (with a job column for a batch), dm1, or the totals as one row.
+dm1 is streamed in chunks. Errors are JSON {"error": ...} with status 400 for
+a bad job and 500 otherwise; an error once a dm1 stream has started closes the
+connection before the last chunk.
+
+Load test: python -m benchmarks.loadtest --url http://127.0.0.1:8056
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from datasets import DataSets, LiveDataSets
+from batch import FILTER_DICTS, expand_jobs, make_request
+from export import chunks
+from instrument import span
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8056
+DEFAULT_SERVER_WORKERS = 8
+
+# slices of the batches evaluated at once, on a pool of their own: the
+# shards of every slice run on the pools of parallel.py
+BATCH_WORKERS = 4
+
+# idle keep-alive connections give their worker back after this long
+IDLE_SECONDS = 5
+MAX_BODY_BYTES = 1 << 20
+
+ARROW_MIME = 'application/vnd.apache.arrow.stream'
+JSON_MIME = 'application/json'
+OUTPUTS = ['pivots', 'totals', 'dm1']
+MODES = ['exact', 'preview']
+
+
+class BadRequest(Exception):
+    """
+    The request can not be answered as sent, reported with status 400
+    """
+
+
+def evaluate(datasets: DataSets, job: dict):
+    """
+    AnalysisResult of a job
+    """
+    try:
+        request = make_request(job)
+    except (KeyError, TypeError, ValueError) as e:
+        raise BadRequest(f'invalid job: {type(e).__name__}: {e}')
+    mode = job.get('mode', 'exact')
+    if mode not in MODES:
+        raise BadRequest(f'unknown mode {mode}, expected one of {MODES}')
+    if request.x_ax not in datasets.axes_options or request.y_ax not in datasets.axes_options:
+        raise BadRequest(f'axes have to be among {list(datasets.axes_options)}')
+    if request.x_ax == request.y_ax:
+        raise BadRequest('X and Y axes have to differ')
+    return datasets.preview(request) if mode == 'preview' else datasets.analyze(request)
+
+
+def cells_of(result) -> pd.DataFrame:
+    """
+    Long-form cells of the pivots with x and y columns, as batch.py writes them
+    """
+    return result.pivots.cells.rename(columns={result.pivots.x_axis: 'x', result.pivots.y_axis: 'y'})
+
+
+def pivots_of(result) -> dict:
+    pivots = {
+        'mode': result.mode,
+        'x_axis': result.x_ax,
+        'y_axis': result.y_ax,
+        'totals': result.totals,
+        'cells': records(cells_of(result)),
+    }
+    if result.bounds is not None:
+        pivots['bounds'] = {'totals': result.bounds.totals, 'cells': records(result.bounds.cells.rename(
+            columns={result.pivots.x_axis: 'x', result.pivots.y_axis: 'y'}))}
+    return pivots
+
+
+def records(df: pd.DataFrame) -> list:
+    # to_json turns NaN and inf into null
+    return json.loads(df.to_json(orient='records'))
+
+
+def arrow_table(df: pd.DataFrame, metadata: dict = None) -> pa.Table:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **{k: str(v) for k, v in metadata.items()}})
+    return table
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer handing every connection to a fixed pool of worker threads
+    """
+    def __init__(self, address: tuple, live: LiveDataSets, workers: int = DEFAULT_SERVER_WORKERS) -> None:
+        super().__init__(address, Handler)
+        self.live = live
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='factor-http')
+        self.batch_pool = ThreadPoolExecutor(BATCH_WORKERS, thread_name_prefix='factor-batch')
+
+    def process_request(self, request, client_address) -> None:
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown(wait=False)
+        self.batch_pool.shutdown(wait=False)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'factor/1'
+    timeout = IDLE_SECONDS
+
+    def log_message(self, format, *args) -> None:
+        # every request is logged as a span
+        pass
+
+    ## -------- routing --------
+
+    def do_GET(self) -> None:
+        self._route({'/health': self.health, '/dimensions': self.dimensions})
+
+    def do_POST(self) -> None:
+        self._route({'/analyze': self.analyze, '/batch': self.batch})
+
+    def _route(self, routes: dict) -> None:
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        self.responded = False
+        endpoint = routes.get(url.path)
+        with span(f'server{url.path}') as s:
+            if endpoint is None:
+                s.set(status=404)
+                return self.send_json({'error': f'no endpoint {self.command} {url.path}'}, 404)
+            try:
+                # one DataSets for the whole request, a refresh swaps it for the next ones
+                endpoint(self.server.live.get())
+                s.set(status=200)
+            except BadRequest as e:
+                self.send_error_json(s, str(e), 400)
+            except Exception as e:
+                self.send_error_json(s, f'{type(e).__name__}: {e}', 500)
+
+    def send_error_json(self, s, error: str, status: int) -> None:
+        """
+        Error response, unless the response has started (e.g. a dm1 stream):
+        the connection is closed then, so the client sees it cut short
+        """
+        if self.responded:
+            s.set(status=status, error=error, aborted=True)
+            self.close_connection = True
+            return
+        s.set(status=status)
+        self.send_json({'error': error}, status)
+
+    def wants_arrow(self) -> bool:
+        return self.query.get('format') == ['arrow'] or ARROW_MIME in self.headers.get('Accept', '')
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            # the body is left unread: the connection cannot carry another request
+            self.close_connection = True
+            raise BadRequest(f'body larger than {MAX_BODY_BYTES} bytes')
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            raise BadRequest(f'body is not JSON: {e}')
+        if not isinstance(body, dict):
+            raise BadRequest('body has to be a JSON object')
+        return body
+
+    ## -------- responses --------
+
+    def send_response(self, code: int, message: str = None) -> None:
+        super().send_response(code, message)
+        self.responded = True
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, value, status: int = 200) -> None:
+        self.send_body(json.dumps(value, default=str).encode(), JSON_MIME, status)
+
+    def send_arrow(self, table: pa.Table) -> None:
+        sink = pa.BufferOutputStream()
+        with ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        self.send_body(sink.getvalue().to_pybytes(), ARROW_MIME)
+
+    def send_chunked(self, content_type: str) -> 'ChunkedWriter':
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return ChunkedWriter(self.wfile)
+
+    ## -------- endpoints --------
+
+    def health(self, datasets: DataSets) -> None:
+        health = {'status': 'ok', 'version': datasets.version, 'last_refresh_error': self.server.live.last_error}
+        if datasets.stream is not None:
+            health.update(rows=datasets.stream.n_rows, first_sale=None, last_sale=None)
+        else:
+            dates = datasets.sales_index.dates
+            health.update(rows=len(dates), first_sale=pd.Timestamp(dates[0]) if len(dates) else None,
+                          last_sale=pd.Timestamp(dates[-1]) if len(dates) else None)
+        self.send_json(health)
+
+    def dimensions(self, datasets: DataSets) -> None:
+        self.send_json({name: {str(k): v for k, v in getattr(datasets, attr).items()} for name, attr in FILTER_DICTS.items()})
+
+    def analyze(self, datasets: DataSets) -> None:
+        job = self.read_json()
+        output = job.get('output', 'pivots')
+        if output not in OUTPUTS:
+            raise BadRequest(f'unknown output {output}, expected one of {OUTPUTS}')
+        result = evaluate(datasets, job)
+
+        if output == 'totals':
+            if self.wants_arrow():
+                return self.send_arrow(arrow_table(pd.DataFrame([result.totals]), {'mode': result.mode}))
+            return self.send_json(dict(result.totals, mode=result.mode))
+        if output == 'pivots':
+            if self.wants_arrow():
+                return self.send_arrow(arrow_table(cells_of(result), {'mode': result.mode, 'x_axis': result.x_ax, 'y_axis': result.y_ax}))
+            return self.send_json(pivots_of(result))
+        self.send_dm1(result.dm1)
+
+    def send_dm1(self, dm1: pd.DataFrame) -> None:
+        """
+        dm1 in chunks of CHUNK_ROWS, as a JSON array or Arrow record batches
+        """
+        if self.wants_arrow():
+            out = self.send_chunked(ARROW_MIME)
+            schema = pa.Schema.from_pandas(dm1, preserve_index=False)
+            with ipc.new_stream(out, schema) as writer:
+                for chunk in chunks(dm1):
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        else:
+            out = self.send_chunked(JSON_MIME)
+            out.write(b'[')
+            for n, chunk in enumerate(chunks(dm1)):
+                # each chunk is an array, written without its brackets
+                out.write((',' if n else '').encode() + chunk.to_json(orient='records').encode()[1:-1])
+            out.write(b']')
+        out.close()
+
+    def batch(self, datasets: DataSets) -> None:
+        spec = self.read_json()
+        output = spec.get('output', 'pivots')
+        if output not in ('pivots', 'totals'):
+            raise BadRequest("a batch returns 'pivots' or 'totals'")
+        try:
+            jobs = expand_jobs(spec, datasets)
+        except (KeyError, TypeError, ValueError) as e:
+            raise BadRequest(f'invalid batch: {type(e).__name__}: {e}')
+
+        def run_job(item: tuple) -> tuple:
+            job_id, job = item
+            try:
+                return job_id, evaluate(datasets, dict(job, mode=job.get('mode', spec.get('mode', 'exact')))), None
+            except Exception as e:
+                return job_id, None, f'{type(e).__name__}: {e}'
+
+        started = time.perf_counter()
+        # the slices of a batch share the rollup of their window pair (see rollup.py)
+        results = list(self.server.batch_pool.map(run_job, jobs))
+
+        if self.wants_arrow():
+            tables = []
+            for job_id, result, error in results:
+                if result is None:
+                    continue
+                part = pd.DataFrame([result.totals]) if output == 'totals' else cells_of(result)
+                part.insert(0, 'job', job_id)
+                tables.append(part)
+            frame = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame({'job': []})
+            failed = {job_id: error for job_id, _, error in results if error is not None}
+            return self.send_arrow(arrow_table(frame, {'version': datasets.version, 'failed': json.dumps(failed)}))
+
+        entries = []
+        for job_id, result, error in results:
+            entry = {'job': job_id, 'status': 'ok' if error is None else 'failed'}
+            if error is not None:
+                entry['error'] = error
+            elif output == 'totals':
+                entry['totals'] = dict(result.totals, mode=result.mode)
+            else:
+                entry.update(pivots_of(result))
+            entries.append(entry)
+        self.send_json({'version': datasets.version, 'seconds': time.perf_counter() - started, 'jobs': entries})
+
+
+class ChunkedWriter():
+    """
+    File-like sink writing HTTP/1.1 chunks, for pyarrow and JSON alike
+    """
+    closed = False
+
+    def __init__(self, wfile) -> None:
+        self.wfile = wfile
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        if data:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        return len(data)
+
+    def flush(self) -> None:
+        self.wfile.flush()
+
+    def close(self) -> None:
+        if not self.closed:
+            self.wfile.write(b'0\r\n\r\n')
+            self.closed = True
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int = DEFAULT_SERVER_WORKERS, streaming: bool = False) -> PooledHTTPServer:
+    """
+    Loads data/ and binds the server, serve_forever() starts answering
+    """
+    live = LiveDataSets(DataSets(streaming=streaming))
+    return PooledHTTPServer((host, port), live, workers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Factor analysis HTTP service')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'address to bind (default {DEFAULT_HOST}, local only)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=DEFAULT_SERVER_WORKERS, help='request worker threads')
+    parser.add_argument('--streaming', action='store_true', default=os.environ.get('FACTOR_STREAMING') == '1',
+                        help='aggregate from the Parquet file instead of keeping the sales in memory')
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.workers, args.streaming)
+    print(f'serving {server.live.current.version} on http://{args.host}:{args.port} with {args.workers} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,91 @@
+"""
+Hands read-only objects (DataSets and everything it holds) to worker
+processes through shared memory instead of pickling the data.
+
+`SharedPayload` pickles the object graph as usual except for large numeric NumPy
+arrays (the columns of df_sales, the index posting lists, the cube tables),
+which are copied once into multiprocessing.shared_memory blocks and replaced
+by a reference. `attach` in the worker rebuilds the graph with arrays that
+are views of those blocks, so every worker reads the same physical pages.
+Arrays that already are views of a memory-mapped file (see mapped.py) are
+not copied: the worker maps the same file.
+"""
+import io
+import pickle
+from multiprocessing import shared_memory
+import numpy as np
+from mapped import map_array, mapped_location
+
+# arrays smaller than this are pickled inline
+MIN_SHARED_BYTES = 1 << 16
+
+# blocks attached by this process, kept open for as long as the arrays are used
+_attached = []
+
+
+class _SharingPickler(pickle.Pickler):
+    def __init__(self, file, blocks: list) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.blocks = blocks
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject or obj.nbytes < MIN_SHARED_BYTES:
+            return None
+        location = mapped_location(obj)
+        if location is not None:
+            return ('mmap',) + location + (obj.dtype.str, obj.shape)
+        block = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        order = 'F' if obj.flags.f_contiguous and not obj.flags.c_contiguous else 'C'
+        view = np.ndarray(obj.shape, dtype=obj.dtype, buffer=block.buf, order=order)
+        view[...] = obj
+        self.blocks.append(block)
+        return ('shm', block.name, obj.dtype.str, obj.shape, order)
+
+
+class _AttachingUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if pid[0] == 'mmap':
+            return map_array(*pid[1:])
+        _, name, dtype, shape, order = pid
+        # pool workers share the resource tracker of the process that created
+        # the block, which stays responsible for unlinking it
+        block = shared_memory.SharedMemory(name=name)
+        _attached.append(block)
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, order=order)
+
+
+class SharedPayload():
+    def __init__(self, obj) -> None:
+        """
+        Publishes obj, self.payload is the small picklable handle for attach()
+        """
+        self.blocks = []
+        buffer = io.BytesIO()
+        _SharingPickler(buffer, self.blocks).dump(obj)
+        self.payload = buffer.getvalue()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.size for block in self.blocks)
+
+    def close(self) -> None:
+        """
+        Releases the shared blocks, workers must be done with them
+        """
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self) -> 'SharedPayload':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def attach(payload: bytes):
+    """
+    Rebuilds the object published by SharedPayload, without copying shared arrays
+    """
+    return _AttachingUnpickler(io.BytesIO(payload)).load()
@@ -0,0 +1,273 @@
+"""
+Offline build of the prepared sales store.
+
+The raw ``data/df-sales.pq`` only carries commodity and client ids. The app
+needs the branch/channel/brand/group/manager/mark of every row for filtering,
+so the store joins those in once, encodes them with the narrowest integer
+dtype, sorts the rows by date and writes the result next to the raw file.
+``DataSets`` then opens the store as is instead of redoing the joins on
+every start.
+
+New sales can also be dropped into ``data/sales-updates/`` as extra raw
+Parquet files (e.g. one per day): a running app appends them without a
+restart (see DataSets.refreshed), and the next build folds them into the
+store, which records the update files it contains.
+
+The build also writes the store and its posting lists as memory-mapped Arrow
+files (see mapped.py). DataSets maps them when they belong to the current
+store, so app replicas and workers on one host share a single copy of the
+sales instead of each parsing its own.
+
+Usage:
+    python store.py [--compare]
+"""
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from mapped import file_stamp, open_frame, open_table, write_table
+from sales_index import SalesIndex
+
+RAW_SALES_PATH = 'data/df-sales.pq'
+STORE_PATH = 'data/sales-store.pq'
+MAPPED_STORE_PATH = 'data/sales-store.arrow'
+MAPPED_INDEX_PATH = 'data/sales-index.arrow'
+PRODUCTS_PATH = 'data/products.pq'
+CLIENTS_PATH = 'data/clients.pq'
+UPDATES_DIR = 'data/sales-updates'
+DICTIONARY_PATHS = {name: f'data/{name}.csv' for name in ['branch', 'brand', 'manager', 'group', 'channel', 'mark']}
+
+# store metadata key listing the update files built into it
+UPDATES_METADATA_KEY = b'factor.updates'
+# the mapped files record the stamp of the store they were written with
+MAPPED_STORE_KEY = b'factor.store'
+POSTINGS_METADATA_KEY = b'factor.postings'
+
+PRODUCT_DIMS = ['id_brand', 'id_group', 'id_manager', 'id_mark']
+CLIENT_DIMS = ['id_branch', 'id_channel']
+MONEY_COLS = ['SalesAmount', 'SalesCost', 'SalesQty']
+
+# sales whose commodity/client is absent from the dictionaries get this code,
+# dm1 shows id_department 0 for them as before (see kernel.factor_table)
+MISSING_CODE = -1
+
+# rows per Parquet row group of the store, the unit streaming reads (see streaming.py)
+STORE_ROW_GROUP_ROWS = 1_000_000
+
+
+def narrowest_int(values: np.ndarray) -> np.dtype:
+    """
+    Smallest signed integer dtype that holds every value (and MISSING_CODE)
+    """
+    if len(values) == 0:
+        return np.dtype('int8')
+    lo, hi = min(int(values.min()), MISSING_CODE), int(values.max())
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def lookup_codes(keys: pd.Series, dictionary: pd.DataFrame, col: str) -> np.ndarray:
+    """
+    Positional take of dictionary[col] for every key, encoded with the narrowest int dtype
+    """
+    pos = dictionary.index.get_indexer(keys.to_numpy())
+    codes = dictionary[col].to_numpy()
+    dtype = narrowest_int(codes)
+    out = np.full(len(pos), MISSING_CODE, dtype=dtype)
+    found = pos >= 0
+    out[found] = codes[pos[found]]
+    return out
+
+
+def sort_by_date(df_sales: pd.DataFrame) -> pd.DataFrame:
+    """
+    Stable sort by DocumentDate, filtering relies on it for binary search
+    """
+    if df_sales['DocumentDate'].is_monotonic_increasing:
+        return df_sales.reset_index(drop=True)
+    return df_sales.sort_values('DocumentDate', kind='mergesort').reset_index(drop=True)
+
+
+def prepare_sales(df_sales: pd.DataFrame, df_products: pd.DataFrame, df_clients: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the dimension codes of every sale, narrows the id dtypes
+    and sorts the rows by DocumentDate. Money columns keep their dtype:
+    sums of float32 values drift from those of the raw data
+    """
+    df_sales = sort_by_date(df_sales)
+    sales = pd.DataFrame(index=df_sales.index)
+    for col in df_sales.columns:
+        values = df_sales[col]
+        if col in ('id_commodity', 'id_client'):
+            values = values.astype(narrowest_int(values.to_numpy()))
+        sales[col] = values
+
+    for col in CLIENT_DIMS:
+        sales[col] = lookup_codes(df_sales['id_client'], df_clients, col)
+    for col in PRODUCT_DIMS:
+        sales[col] = lookup_codes(df_sales['id_commodity'], df_products, col)
+
+    return sales
+
+
+def legacy_prepare_sales(df_sales: pd.DataFrame, df_products: pd.DataFrame, df_clients: pd.DataFrame) -> pd.DataFrame:
+    """
+    The dict-map assembly DataSets used before the store existed, kept for comparison
+    """
+    df_sales = df_sales.copy()
+    df_sales['id_branch']  = df_sales['id_client'].map(df_clients['id_branch'].to_dict())
+    df_sales['id_channel'] = df_sales['id_client'].map(df_clients['id_channel'].to_dict())
+    df_sales['id_brand']   = df_sales['id_commodity'].map(df_products['id_brand'].to_dict())
+    df_sales['id_group']   = df_sales['id_commodity'].map(df_products['id_group'].to_dict())
+    df_sales['id_manager'] = df_sales['id_commodity'].map(df_products['id_manager'].to_dict())
+    df_sales['id_mark']    = df_sales['id_commodity'].map(df_products['id_mark'].to_dict())
+    return df_sales
+
+
+def build_store(compare: bool = False) -> dict:
+    """
+    Purpose: build STORE_PATH from the raw sales and the update files and report the savings
+    Returns a dict with timings (seconds) and in-memory sizes (bytes)
+    """
+    updates = update_paths()
+    df_sales = pd.read_parquet(RAW_SALES_PATH)
+    if updates:
+        df_sales = pd.concat([df_sales] + [pd.read_parquet(path) for path in updates], ignore_index=True)
+    df_products = pd.read_parquet(PRODUCTS_PATH)
+    df_clients = pd.read_parquet(CLIENTS_PATH)
+
+    report = {'rows': len(df_sales), 'updates': len(updates)}
+
+    started = time.perf_counter()
+    sales = prepare_sales(df_sales, df_products, df_clients)
+    report['prepare_seconds'] = time.perf_counter() - started
+    report['store_bytes'] = int(sales.memory_usage(deep=True).sum())
+
+    if compare:
+        started = time.perf_counter()
+        legacy = legacy_prepare_sales(df_sales, df_products, df_clients)
+        report['legacy_seconds'] = time.perf_counter() - started
+        report['legacy_bytes'] = int(legacy.memory_usage(deep=True).sum())
+        report['bytes_saved'] = report['legacy_bytes'] - report['store_bytes']
+        del legacy
+
+    table = pa.Table.from_pandas(sales, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[UPDATES_METADATA_KEY] = json.dumps({os.path.basename(path): file_stamp(path) for path in updates}).encode()
+    # a running app may be refreshing from the store, it only ever sees a complete file
+    tmp_path = STORE_PATH + '.tmp'
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path, row_group_size=STORE_ROW_GROUP_ROWS)
+    os.replace(tmp_path, STORE_PATH)
+    report['store_file_bytes'] = os.path.getsize(STORE_PATH)
+
+    write_mapped(table, SalesIndex(sales))
+    report['mapped_file_bytes'] = os.path.getsize(MAPPED_STORE_PATH) + os.path.getsize(MAPPED_INDEX_PATH)
+    return report
+
+
+def write_mapped(table: pa.Table, sales_index: SalesIndex) -> None:
+    """
+    Mappable copies of the store just written and of its posting lists
+    """
+    build = {MAPPED_STORE_KEY: file_stamp(STORE_PATH).encode()}
+    write_table(table, MAPPED_STORE_PATH, build)
+    orders, slices = sales_index.posting_lists()
+    write_table(pa.table(orders), MAPPED_INDEX_PATH, {**build, POSTINGS_METADATA_KEY: json.dumps(slices).encode()})
+
+
+def open_mapped():
+    """
+    (df_sales, sales_index) mapped from the files write_mapped made for the
+    current store, None when they are missing or belong to another build
+    """
+    if not all(os.path.exists(path) for path in [STORE_PATH, MAPPED_STORE_PATH, MAPPED_INDEX_PATH]):
+        return None
+    df_sales, metadata = open_frame(MAPPED_STORE_PATH)
+    orders, index_metadata = open_table(MAPPED_INDEX_PATH)
+    # a build running right now may have replaced some of the files only
+    if not metadata.get(MAPPED_STORE_KEY) == index_metadata.get(MAPPED_STORE_KEY) == file_stamp(STORE_PATH).encode():
+        return None
+    slices = json.loads(index_metadata[POSTINGS_METADATA_KEY])
+    return df_sales, SalesIndex.from_posting_lists(df_sales, orders, slices)
+
+
+def update_paths() -> list:
+    """
+    Update files of new raw sales, in name order
+    """
+    return sorted(glob.glob(os.path.join(UPDATES_DIR, '*.pq')))
+
+
+def store_updates() -> dict:
+    """
+    {file name: stamp} of the update files built into the store
+    """
+    if not os.path.exists(STORE_PATH):
+        return {}
+    metadata = pq.read_schema(STORE_PATH).metadata or {}
+    return json.loads(metadata.get(UPDATES_METADATA_KEY, b'{}'))
+
+
+def source_stamps() -> dict:
+    """
+    {path: stamp} of every file DataSets loads, except the update files
+    """
+    paths = [sales_path(), PRODUCTS_PATH, CLIENTS_PATH] + list(DICTIONARY_PATHS.values())
+    return {path: file_stamp(path) for path in paths}
+
+
+def data_version(sources: dict = None, updates: dict = None) -> str:
+    """
+    Identifies the data DataSets was loaded from (source stamps plus the
+    applied update files), cached results are keyed on it
+    """
+    sources = source_stamps() if sources is None else sources
+    state = json.dumps([sorted(sources.items()), sorted((updates or {}).items())])
+    return hashlib.sha1(state.encode()).hexdigest()[:16]
+
+
+def sales_path() -> str:
+    """
+    The prepared store when built, the raw sales otherwise
+    """
+    return STORE_PATH if os.path.exists(STORE_PATH) else RAW_SALES_PATH
+
+
+def load_sales(df_products: pd.DataFrame, df_clients: pd.DataFrame) -> pd.DataFrame:
+    """
+    Opens the prepared store, falling back to preparing the raw sales in memory
+    when the offline build has not been run yet
+    """
+    if os.path.exists(STORE_PATH):
+        return sort_by_date(pd.read_parquet(STORE_PATH))
+    return prepare_sales(pd.read_parquet(RAW_SALES_PATH), df_products, df_clients)
+
+
+def load_dictionary(name: str) -> dict:
+    """
+    {id: name} of one dictionary CSV
+    """
+    return pd.read_csv(DICTIONARY_PATHS[name], index_col=0, header=None, names=['id', 'name'])['name'].to_dict()
+
+
+if __name__ == '__main__':
+    report = build_store(compare='--compare' in sys.argv[1:])
+    print(f"rows:            {report['rows']:,} ({report['updates']} update files)")
+    print(f"prepare time:    {report['prepare_seconds']:.2f} s")
+    print(f"store in memory: {report['store_bytes']:,} bytes")
+    print(f"store on disk:   {report['store_file_bytes']:,} bytes")
+    print(f"mapped files:    {report['mapped_file_bytes']:,} bytes")
+    if 'legacy_seconds' in report:
+        print(f"legacy time:     {report['legacy_seconds']:.2f} s "
+              f"({report['legacy_seconds'] - report['prepare_seconds']:.2f} s saved)")
+        print(f"legacy memory:   {report['legacy_bytes']:,} bytes "
+              f"({report['bytes_saved']:,} bytes saved)")
@@ -0,0 +1,214 @@
+"""
+Out-of-core window aggregation straight from the Parquet sales files.
+
+Used instead of the resident df_sales when the history does not fit in
+memory. A window is answered by
+  * skipping row groups whose DocumentDate or dimension statistics cannot
+    match (the store is sorted by date, so a window touches few groups),
+  * reading only the columns the window needs, in batches sized from the
+    memory budget,
+  * summing every batch per (id_commodity, id_client) and merging the
+    partial sums, compacted whenever they grow past the budget.
+
+Sums are taken in float64 like the in-memory path; they can differ from it
+only in the last bits, from adding per-batch partial sums.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from store import CLIENT_DIMS, MONEY_COLS, lookup_codes
+from sales_index import to_datetime64
+
+DEFAULT_MEMORY_BUDGET = 256 << 20
+
+# working memory of a batch (mask, float64 copies, groupby) per byte read
+WORKING_SET_FACTOR = 8
+MIN_BATCH_ROWS = 10_000
+
+KEYS = ['id_commodity', 'id_client']
+AGGREGATIONS = {'SalesAmount': 'sum', 'SalesCost': 'sum', 'SalesQty': 'sum', 'id_branch': 'max'}
+# period sums carry the money columns only, as DataSets.period_sums does in memory
+PERIOD_AGGREGATIONS = {col: 'sum' for col in MONEY_COLS}
+
+
+def _stat_bounds(column_chunk, field):
+    """
+    (min, max) of a column chunk comparable with the column values, None without statistics
+    """
+    stats = column_chunk.statistics
+    if stats is None or not stats.has_min_max:
+        return None
+    if hasattr(field.type, 'unit'):
+        # exact timestamps, the python values of min/max are truncated to microseconds
+        return np.datetime64(stats.min_raw, field.type.unit), np.datetime64(stats.max_raw, field.type.unit)
+    return stats.min, stats.max
+
+
+def combine(partials: list, keys: list = KEYS, aggregations: dict = AGGREGATIONS) -> pd.DataFrame:
+    if len(partials) == 1:
+        return partials[0]
+    return pd.concat(partials, ignore_index=True).groupby(keys).agg(aggregations).reset_index()
+
+
+class SalesFile():
+    def __init__(self, path: str) -> None:
+        """
+        Schema and per row group statistics of one Parquet sales file
+        """
+        self.path = path
+        metadata = pq.ParquetFile(path).metadata
+        self.schema = metadata.schema.to_arrow_schema()
+        self.columns = self.schema.names
+        self.n_rows = metadata.num_rows
+
+        # per row group: {column: (min, max)}
+        self.bounds = []
+        for g in range(metadata.num_row_groups):
+            row_group = metadata.row_group(g)
+            bounds = {}
+            for c in range(row_group.num_columns):
+                name = row_group.column(c).path_in_schema
+                if name in self.columns:
+                    bounds[name] = _stat_bounds(row_group.column(c), self.schema.field(name))
+            self.bounds.append(bounds)
+
+    def row_groups(self, filters: dict, start: np.datetime64, end: np.datetime64) -> list:
+        """
+        Row groups that may hold sales of the window and filters
+        """
+        selected = []
+        for g, bounds in enumerate(self.bounds):
+            dates = bounds.get('DocumentDate')
+            if dates is not None and (dates[1] < start or dates[0] > end):
+                continue
+            skip = False
+            for col, values in filters.items():
+                if values and bounds.get(col) is not None:
+                    lo, hi = bounds[col]
+                    skip = skip or not any(lo <= value <= hi for value in values)
+            if not skip:
+                selected.append(g)
+        return selected
+
+
+class StreamingSales():
+    def __init__(self, paths, df_products: pd.DataFrame, df_clients: pd.DataFrame,
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET) -> None:
+        """
+        paths: the prepared store and/or raw sales files (a single path or a list);
+        dimension codes missing from a file are looked up per batch in df_products/df_clients
+        """
+        paths = [paths] if isinstance(paths, str) else list(paths)
+        self.files = [SalesFile(path) for path in paths]
+        self.df_products, self.df_clients = df_products, df_clients
+        self.memory_budget = memory_budget
+
+    @property
+    def n_rows(self) -> int:
+        return sum(f.n_rows for f in self.files)
+
+    def append(self, paths: list) -> 'StreamingSales':
+        """
+        New instance also streaming the given files
+        """
+        stream = StreamingSales([], self.df_products, self.df_clients, self.memory_budget)
+        stream.files = self.files + [SalesFile(path) for path in paths]
+        return stream
+
+    def batch_rows(self, schema, columns: list) -> int:
+        row_bytes = sum(schema.field(col).type.bit_width // 8 for col in columns)
+        return max(MIN_BATCH_ROWS, self.memory_budget // (row_bytes * WORKING_SET_FACTOR))
+
+    def _codes(self, batch: dict, col: str) -> np.ndarray:
+        if col in batch:
+            return batch[col]
+        if col in CLIENT_DIMS:
+            return lookup_codes(pd.Series(batch['id_client']), self.df_clients, col)
+        return lookup_codes(pd.Series(batch['id_commodity']), self.df_products, col)
+
+    def aggregate_window(self, filters: dict, dt_start, dt_end, s=None) -> pd.DataFrame:
+        """
+        Sums sales per (id_commodity, id_client) over dt_start <= DocumentDate <= dt_end,
+        same frame as DataSets' in-memory aggregation. s is an optional instrument span
+        """
+        return self._aggregate(filters, to_datetime64(dt_start), to_datetime64(dt_end), None, s)
+
+    def aggregate_periods(self, filters: dict, edges: pd.DatetimeIndex, s=None) -> pd.DataFrame:
+        """
+        Sums sales per (period, id_commodity, id_client) in one scan, period k
+        being edges[k] <= DocumentDate < edges[k + 1]
+        """
+        edges = edges.to_numpy()
+        return self._aggregate(filters, edges[0], edges[-1] - np.timedelta64(1, 'ns'), edges, s)
+
+    def _aggregate(self, filters: dict, start: np.datetime64, end: np.datetime64, edges, s) -> pd.DataFrame:
+        active = {col: values for col, values in filters.items() if values}
+        # windows carry id_branch, periods the money sums only
+        if edges is None:
+            keys, aggregations, dims = KEYS, AGGREGATIONS, ['id_branch']
+        else:
+            keys, aggregations, dims = ['period'] + KEYS, PERIOD_AGGREGATIONS, []
+        # dimension codes missing from a file are looked up from the ids
+        dims += [col for col in active if col not in dims]
+
+        partials, partial_rows, rows_read, groups_read, groups_total = [], 0, 0, 0, 0
+        compact_rows = None
+        for sales_file in self.files:
+            columns = ['DocumentDate'] + KEYS + MONEY_COLS + [col for col in dims if col in sales_file.columns]
+            groups = sales_file.row_groups(active, start, end)
+            groups_read, groups_total = groups_read + len(groups), groups_total + len(sales_file.bounds)
+            batch_rows = self.batch_rows(sales_file.schema, columns)
+            # partial sums are compacted when they hold this many rows
+            compact_rows = compact_rows or batch_rows
+            if not groups:
+                continue
+
+            parquet = pq.ParquetFile(sales_file.path)
+            for record_batch in parquet.iter_batches(batch_size=batch_rows, row_groups=groups, columns=columns):
+                batch = {col: record_batch.column(col).to_numpy(zero_copy_only=False) for col in columns}
+                rows_read += record_batch.num_rows
+
+                dates = batch['DocumentDate']
+                mask = (dates >= start) & (dates <= end)
+                for col, values in active.items():
+                    mask &= np.isin(self._codes(batch, col), values)
+                if not mask.any():
+                    continue
+
+                d_w = pd.DataFrame({col: batch[col][mask] for col in KEYS})
+                if edges is not None:
+                    d_w.insert(0, 'period', np.searchsorted(edges, dates[mask], side='right') - 1)
+                for col in MONEY_COLS:
+                    d_w[col] = batch[col][mask].astype(np.float64)
+                if edges is None:
+                    d_w['id_branch'] = self._codes(batch, 'id_branch')[mask]
+
+                partials.append(d_w.groupby(keys).agg(aggregations).reset_index())
+                partial_rows += len(partials[-1])
+                if partial_rows > compact_rows:
+                    partials = [combine(partials, keys, aggregations)]
+                    partial_rows = len(partials[0])
+                    # the result itself may outgrow the budget, doubling keeps compaction linear
+                    compact_rows = max(compact_rows, 2 * partial_rows)
+
+        if s is not None:
+            s.set(source='stream', row_groups=groups_read, row_groups_skipped=groups_total - groups_read)
+            s.rows_in = rows_read
+
+        if not partials:
+            d_w = self._empty()
+            if edges is not None:
+                d_w = d_w[KEYS + MONEY_COLS]
+                d_w.insert(0, 'period', np.zeros(0, dtype=np.int64))
+            return d_w
+        return combine(partials, keys, aggregations)
+
+    def _empty(self) -> pd.DataFrame:
+        sales_file = self.files[0]
+        columns = [col for col in KEYS + MONEY_COLS + ['id_branch'] if col in sales_file.columns]
+        empty = sales_file.schema.empty_table().select(columns).to_pandas()
+        d_w = pd.DataFrame({col: empty[col] for col in KEYS})
+        for col in MONEY_COLS:
+            d_w[col] = empty[col].astype(np.float64)
+        d_w['id_branch'] = self._codes({col: empty[col].to_numpy() for col in empty.columns}, 'id_branch')
+        return d_w.groupby(KEYS).agg(AGGREGATIONS).reset_index()
@@ -0,0 +1,196 @@
+"""
+The analysis as the app computed it before the optimizations: the DataSets
+of the first version of datasets.py, reading the raw files of data/. Every
+path of the current code is checked against it.
+"""
+import numpy as np
+import pandas as pd
+from kernel import FACTOR_COLS
+
+T = pd.Timestamp
+
+# (channels, depts, brands, managers, groups, marks, base start, base end, fact start, fact end, x axis, y axis)
+CASES = [
+    # whole quarters, answered from the cube
+    ([], [], [], [], [], [], T('2021-03-01'), T('2021-05-31 23:59:59'), T('2021-06-01'), T('2021-08-31 23:59:59'), 'Brand', 'Branch'),
+    ([1], [], [2, 3], [], [], [], T('2021-03-01'), T('2021-05-31 23:59:59'), T('2021-06-01'), T('2021-08-31 23:59:59'), 'Group', 'Brand'),
+    # windows cutting through days, answered from the rows
+    ([1, 2], [0, 3], [], [1], [], [2], T('2021-03-10 12:00'), T('2021-05-20 23:59:59'), T('2021-06-03'), T('2021-08-15 06:00'), 'Mark', 'Channel'),
+    ([], [], [], [], [4], [], T('2021-01-01'), T('2021-01-31 23:59:59'), T('2021-02-01'), T('2021-02-28 23:59:59'), 'Manager', 'Group'),
+]
+
+# dm1 columns compared with the baseline
+COMPARED_COLS = ['id_department', 'Revenue base', 'Cost of Sales base', 'Sales base, pcs', 'Revenue fact',
+                 'Profit base', 'Profit fact', 'Profitability base'] + FACTOR_COLS
+
+
+class Baseline():
+    def __init__(self) -> None:
+        self.df_sales = pd.read_parquet('data/df-sales.pq')
+        self.df_products = pd.read_parquet('data/products.pq')
+        self.df_clients = pd.read_parquet('data/clients.pq')
+
+        self.branch_dict = pd.read_csv('data/branch.csv', index_col=0, header=None, names=['id', 'name'])['name'].to_dict()
+
+        ## -------- Assemble working Dataframe ---------
+        self.df_sales['id_branch']  = self.df_sales['id_client'].map(self.df_clients['id_branch'].to_dict())
+        self.df_sales['id_channel'] = self.df_sales['id_client'].map(self.df_clients['id_channel'].to_dict())
+        self.df_sales['id_brand']   = self.df_sales['id_commodity'].map(self.df_products['id_brand'].to_dict())
+        self.df_sales['id_group']   = self.df_sales['id_commodity'].map(self.df_products['id_group'].to_dict())
+        self.df_sales['id_manager'] = self.df_sales['id_commodity'].map(self.df_products['id_manager'].to_dict())
+        self.df_sales['id_mark']    = self.df_sales['id_commodity'].map(self.df_products['id_mark'].to_dict())
+
+        self.axes_options = {
+            'Branch': 'branch',
+            'Channel': 'Channel',
+            'Brand': 'Brand',
+            'Group': 'Product_group',
+            'Mark': 'Mark',
+            'Manager': 'Manager_Marketing'
+        }
+
+    def filter_data(self, channels, depts, brands, managers, groups, marks, dt_base_start, dt_base_end, dt_fact_start, dt_fact_end):
+        d_a = self.df_sales
+
+        if channels:
+            d_a = d_a.loc[d_a.id_channel.isin(channels)]
+        if depts:
+            d_a = d_a.loc[d_a.id_branch.isin(depts)]
+        if brands:
+            d_a = d_a.loc[d_a.id_brand.isin(brands)]
+        if managers:
+            d_a = d_a.loc[d_a.id_manager.isin(managers)]
+        if groups:
+            d_a = d_a.loc[d_a.id_group.isin(groups)]
+        if marks:
+            d_a = d_a.loc[d_a.id_mark.isin(marks)]
+
+        d_b = d_a.loc[(d_a.DocumentDate >= dt_base_start) & (d_a.DocumentDate <= dt_base_end)].copy(deep=True)
+        d_f = d_a.loc[(d_a.DocumentDate >= dt_fact_start) & (d_a.DocumentDate <= dt_fact_end)].copy(deep=True)
+
+        d_b = d_b.groupby(['id_commodity', 'id_client']).agg({'SalesAmount': 'sum', 'SalesCost': 'sum', 'SalesQty': 'sum', 'id_branch': 'max'}).reset_index()
+        d_f = d_f.groupby(['id_commodity', 'id_client']).agg({'SalesAmount': 'sum', 'SalesCost': 'sum', 'SalesQty': 'sum', 'id_branch': 'max'}).reset_index()
+
+        dm = pd.merge(d_b, d_f, left_on=['id_commodity', 'id_client'], right_on=['id_commodity', 'id_client'], how='outer', suffixes=('_base', '_fact'))
+        return dm
+
+    def preprocess_data(self, dm: pd.DataFrame, df_products, df_clients, branch_dict, x_ax, y_ax):
+        dm['comm_cl'] = dm.id_commodity.astype(str) + dm.id_client.astype(str)
+        dm['id_department'] = dm.id_branch_base
+        dm.loc[dm.id_department.isnull() == True, 'id_department'] = dm.id_branch_fact
+
+        dm['price_base'] = dm.SalesAmount_base/dm.SalesQty_base
+        dm['price_fact'] = dm.SalesAmount_fact/dm.SalesQty_fact
+        dm['cost_base'] = dm.SalesCost_base/dm.SalesQty_base
+        dm['cost_fact'] = dm.SalesCost_fact/dm.SalesQty_fact
+
+        dm.replace([np.inf, -np.inf], np.nan, inplace=True)
+        dm.fillna(0, inplace=True)
+
+        dm['pr_base'] = dm.SalesAmount_base - dm.SalesCost_base
+        dm['pr_fact'] = dm.SalesAmount_fact - dm.SalesCost_fact
+        dm['rent_base'] = dm.pr_base / dm.SalesCost_base
+        dm['rent_fact'] = dm.pr_fact / dm.SalesCost_fact
+
+        dm.reset_index(inplace=True)
+        order_col = ['id_commodity', 'id_client', 'comm_cl', 'id_department',
+                     'SalesAmount_base', 'SalesCost_base', 'SalesQty_base', 'pr_base', 'rent_base',
+                     'SalesAmount_fact', 'SalesCost_fact', 'SalesQty_fact', 'pr_fact', 'rent_fact',
+                     'price_base', 'price_fact', 'cost_base', 'cost_fact']
+        dm = dm[order_col].copy()
+
+        dm['is_absent'] = (dm.SalesQty_base == 0) + (dm.SalesQty_fact == 0) + (dm.SalesCost_base < 0) + (dm.SalesCost_fact < 0)
+        dm['delta_price'] = np.where(dm.is_absent > 0, 0, (dm.price_fact - dm.price_base) * dm.SalesQty_fact)
+        dm['delta_cost'] = np.where(dm.is_absent > 0, 0, (dm.cost_base - dm.cost_fact) * dm.SalesQty_fact)
+        dm['delta_vol'] = np.where(dm.is_absent > 0, dm.pr_fact - dm.pr_base, (dm.SalesQty_fact - dm.SalesQty_base) * (dm.price_base - dm.cost_base))
+
+        my_cols_eng = ['Article', 'Brand', 'Product_group', 'Mark', 'Manager_Marketing', 'Manager_Supply', 'ABC_XYZ']
+        my_cl_cols_eng = ['id_branch', 'Channel', 'Client_name']
+
+        dm1 = df_products[my_cols_eng].join(dm.set_index('id_commodity'), how='right').reset_index().set_index('id_client').join(df_clients[my_cl_cols_eng]).reset_index()
+        dm1.rename(columns = {'level_0': 'id_client', 'index':'id_commodity'}, inplace=True)
+
+        dm1['branch'] = dm1.id_branch.map(branch_dict)
+
+        dm1.rename(columns = {
+            'SalesAmount_base':'Revenue base',
+            'SalesCost_base': 'Cost of Sales base',
+            'SalesQty_base': 'Sales base, pcs',
+            'pr_base': 'Profit base',
+            'rent_base': 'Profitability base',
+            'SalesAmount_fact' : 'Revenue fact',
+            'SalesCost_fact': 'Cost of Sales fact',
+            'SalesQty_fact': 'Sales fact, pcs',
+            'pr_fact': 'Profit fact',
+            'rent_fact': 'Profitability fact',
+            'price_base': 'Price 1 piece base',
+            'price_fact': 'Price 1 piece fact',
+            'cost_base': 'Cost 1 piece base',
+            'cost_fact': 'Cost 1 piece fact',
+            'delta_price': 'Сhange in profit due to price',
+            'delta_cost': 'Сhange in profit due to cost',
+            'delta_vol': 'Сhange in profit due to structure',
+            'comm_cl': 'id product-client',
+        }, inplace=True)
+
+        x_axis = self.axes_options[x_ax]
+        y_axis = self.axes_options[y_ax]
+        pivots = [pd.pivot_table(dm1.groupby([x_axis, y_axis])[[col]].sum().reset_index().dropna(),
+                                 values=col, columns=x_axis, index=y_axis, aggfunc='sum') for col in FACTOR_COLS]
+        return (dm1, *pivots)
+
+    def analyze(self, case: tuple) -> tuple:
+        """
+        (dm1, pivot_price, pivot_cost, pivot_vol) of one of CASES
+        """
+        dm = self.filter_data(*case[:10])
+        return self.preprocess_data(dm, self.df_products, self.df_clients, self.branch_dict, case[10], case[11])
+
+
+def by_pair(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values(['id_commodity', 'id_client']).reset_index(drop=True)
+
+
+def assert_filter_data(got: pd.DataFrame, want: pd.DataFrame) -> None:
+    """
+    filter_data outputs hold the same pairs and sums, in any row order
+    """
+    assert len(got) == len(want)
+    got, want = by_pair(got), by_pair(want)
+    for col in want.columns:
+        np.testing.assert_allclose(got[col].to_numpy(float), want[col].to_numpy(float), rtol=1e-9, atol=1e-6, err_msg=col)
+
+
+def assert_dm1(got: pd.DataFrame, want: pd.DataFrame) -> None:
+    """
+    Product-client tables with the same pairs and measures, in any row order
+    """
+    assert len(got) == len(want)
+    got, want = by_pair(got), by_pair(want)
+    assert (got[['id_commodity', 'id_client']].to_numpy() == want[['id_commodity', 'id_client']].to_numpy()).all()
+    for col in COMPARED_COLS:
+        np.testing.assert_allclose(got[col].to_numpy(float), want[col].to_numpy(float), rtol=1e-7, atol=1e-6, err_msg=col)
+    for col in ['Brand', 'Channel', 'branch']:
+        assert (got[col].astype(str).to_numpy() == want[col].astype(str).to_numpy()).all(), col
+
+
+def assert_pivot(got: pd.DataFrame, want: pd.DataFrame) -> None:
+    """
+    Same y by x cells with the same sums
+    """
+    got = got.sort_index().sort_index(axis=1)
+    want = want.sort_index().sort_index(axis=1)
+    assert list(got.index) == list(want.index)
+    assert list(got.columns) == list(want.columns)
+    np.testing.assert_allclose(got.to_numpy(float), want.to_numpy(float), rtol=1e-7, atol=1e-4)
+
+
+def assert_result(result, want: tuple) -> None:
+    """
+    An AnalysisResult against Baseline.analyze
+    """
+    dm1, pivot_price, pivot_cost, pivot_vol = want
+    assert_dm1(result.dm1, dm1)
+    assert_pivot(result.pivot_price, pivot_price)
+    assert_pivot(result.pivot_cost, pivot_cost)
+    assert_pivot(result.pivot_vol, pivot_vol)
@@ -0,0 +1,105 @@
+"""
+Synthetic data (benchmarks/synthetic.py) for the tests, generated once per
+session. The code reads data/ relative to the working directory, so every
+test runs in the directory of the data it uses.
+"""
+import contextlib
+import os
+import shutil
+import sys
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import parallel
+from benchmarks.synthetic import generate
+from store import build_store
+from cube import SalesCube
+from datasets import DataSets
+from baseline import Baseline
+
+ROWS = 40_000
+PRODUCTS = 300
+CLIENTS = 800
+DIMENSIONS = {'branch': 6, 'channel': 4, 'brand': 5, 'group': 6, 'manager': 3, 'mark': 3}
+
+# how DataSets holds the sales: prepared in memory from the raw files, mapped
+# from the store, streamed from it, or mapped and split over threads
+MODES = ['memory', 'mapped', 'streaming', 'parallel']
+PARALLEL_WORKERS = 4
+
+
+@contextlib.contextmanager
+def working_dir(path: str):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(cwd)
+
+
+def copy_data(source: str, target: str) -> str:
+    shutil.copytree(os.path.join(source, 'data'), os.path.join(target, 'data'))
+    return target
+
+
+def build(path: str) -> None:
+    """
+    The prepared store, its mapped files and the cube, as store.py and cube.py write them
+    """
+    with working_dir(path):
+        build_store()
+        SalesCube.build(pd.read_parquet('data/sales-store.pq')).save()
+
+
+@pytest.fixture(scope='session')
+def raw_dir(tmp_path_factory) -> str:
+    """
+    Raw files only: DataSets prepares the sales in memory
+    """
+    path = str(tmp_path_factory.mktemp('raw'))
+    generate(path, ROWS, PRODUCTS, CLIENTS, start='2021-01-01', days=400, dimensions=DIMENSIONS)
+    return path
+
+
+@pytest.fixture(scope='session')
+def built_dir(raw_dir, tmp_path_factory) -> str:
+    """
+    The same data with the prepared store, mapped files and cube
+    """
+    path = copy_data(raw_dir, str(tmp_path_factory.mktemp('built')))
+    build(path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def baseline(raw_dir) -> Baseline:
+    with working_dir(raw_dir):
+        return Baseline()
+
+
+@pytest.fixture
+def data_copy(raw_dir, tmp_path) -> str:
+    """
+    A copy of the raw data the test may change
+    """
+    return copy_data(raw_dir, str(tmp_path))
+
+
+@pytest.fixture(params=MODES)
+def datasets(request, raw_dir, built_dir, monkeypatch) -> DataSets:
+    """
+    DataSets in every mode, the test running in its data directory
+    """
+    mode = request.param
+    monkeypatch.chdir(raw_dir if mode == 'memory' else built_dir)
+    if mode == 'parallel':
+        # the test data would be processed in one piece
+        monkeypatch.setattr(parallel, 'MIN_PARALLEL_ROWS', 100)
+    datasets = DataSets(streaming=mode == 'streaming', workers=PARALLEL_WORKERS if mode == 'parallel' else 1)
+    assert datasets.mapped == (mode in ('mapped', 'parallel'))
+    return datasets
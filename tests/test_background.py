@@ -0,0 +1,60 @@
+import time
+import pytest
+from background import BackgroundExecutor, SessionToken, Cancelled
+from instrument import span
+
+STAGE_SECONDS = 0.01
+
+
+def work(value, seconds: float = STAGE_SECONDS, stages: int = 5):
+    for stage in range(stages):
+        with span(f'stage{stage}'):
+            time.sleep(seconds)
+    return value
+
+
+def test_burst_computes_the_last_request():
+    executor = BackgroundExecutor(2, debounce=0.1)
+    session = SessionToken()
+    calls = []
+    jobs = [executor.submit(session, ('key', n), lambda n: calls.append(n) or work(n), n) for n in range(5)]
+    assert jobs[-1].result(5) == 4
+    assert calls == [4]
+    assert [job.cancelled for job in jobs] == [True] * 4 + [False]
+
+
+def test_debouncing_jobs_hold_no_pool_thread():
+    # one pool thread, many sessions clicking twice: only the last jobs queue for it
+    executor = BackgroundExecutor(1, debounce=0.2)
+    sessions = [SessionToken() for _ in range(5)]
+    started = time.monotonic()
+    jobs = []
+    for n, session in enumerate(sessions):
+        executor.submit(session, ('first', n), work, n, 0)
+        jobs.append(executor.submit(session, ('second', n), work, n, 0))
+    assert [job.result(5) for job in jobs] == list(range(5))
+    # cancelled jobs waiting out the debounce one after the other would take 5 x 0.2 s
+    assert time.monotonic() - started < 0.8
+
+
+def test_running_job_stops_at_next_stage():
+    executor = BackgroundExecutor(2, debounce=0.01)
+    session = SessionToken()
+    slow = executor.submit(session, 'slow', work, 'slow', 0.1, 10)
+    while slow.stage is None:
+        time.sleep(0.01)
+    fast = executor.submit(session, 'fast', work, 'fast')
+    with pytest.raises(Cancelled):
+        slow.result(5)
+    assert len(slow.spans) < 10
+    assert fast.result(5) == 'fast'
+
+
+def test_sessions_share_a_job():
+    executor = BackgroundExecutor(2, debounce=0.05)
+    a, b = SessionToken(), SessionToken()
+    job = executor.submit(a, 'shared', work, 'shared')
+    assert executor.submit(b, 'shared', work, 'shared') is job
+    # a moves on, b still waits for the job
+    executor.submit(a, 'other', work, 'other')
+    assert job.result(5) == 'shared' and not job.cancelled
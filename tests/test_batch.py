@@ -0,0 +1,53 @@
+import json
+import os
+from multiprocessing import shared_memory
+import pandas as pd
+import pytest
+import batch
+from batch import run_batch, FILTER_DICTS
+from kernel import FACTOR_COLS
+from shared import SharedPayload
+from baseline import CASES, assert_dm1
+
+
+def case_job(n: int, case: tuple) -> dict:
+    job = dict(zip(FILTER_DICTS, case[:6]))
+    job.update({'name': f'case{n}', 'base': [str(case[6]), str(case[7])], 'fact': [str(case[8]), str(case[9])],
+                'x_ax': case[10], 'y_ax': case[11]})
+    return job
+
+
+@pytest.mark.parametrize('data', ['raw', 'built'])
+def test_run_batch(data, raw_dir, built_dir, baseline, tmp_path, monkeypatch):
+    # raw files are prepared in memory and copied to shared memory, the built
+    # store and cube are memory-mapped files the workers map again
+    monkeypatch.chdir(raw_dir if data == 'raw' else built_dir)
+    blocks = []
+
+    class RecordedPayload(SharedPayload):
+        def __init__(self, obj) -> None:
+            super().__init__(obj)
+            blocks.extend(block.name for block in self.blocks)
+
+    monkeypatch.setattr(batch, 'SharedPayload', RecordedPayload)
+    out_dir = str(tmp_path / 'out')
+    manifest = run_batch({'jobs': [case_job(n, case) for n, case in enumerate(CASES)]}, out_dir, workers=2)
+
+    assert manifest['failed'] == 0
+    with open(os.path.join(out_dir, 'manifest.json')) as f:
+        assert [job['job'] for job in json.load(f)['jobs']] == [f'case{n}' for n in range(len(CASES))]
+    for summary, case in zip(manifest['jobs'], CASES):
+        dm1 = pd.read_parquet(os.path.join(out_dir, summary['product_client_path']))
+        assert_dm1(dm1, baseline.analyze(case)[0])
+        cells = pd.read_parquet(os.path.join(out_dir, summary['cells_path']))
+        for col in FACTOR_COLS:
+            assert cells[col].sum() == pytest.approx(dm1[col].sum(), rel=1e-7, abs=1e-4)
+
+    if data == 'raw':
+        assert blocks and manifest['shared_bytes'] > 0
+    else:
+        assert not blocks and manifest['shared_bytes'] == 0
+    # the blocks are unlinked once the workers are done
+    for name in blocks:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
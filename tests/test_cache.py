@@ -0,0 +1,25 @@
+import logging
+import numpy as np
+from cache import ResultCache
+
+
+def test_retain_version():
+    cache = ResultCache()
+    cache.put(('result', 'v1', 'a'), 1)
+    cache.put(('result', 'v2', 'a'), 2)
+    cache.retain_version('v2')
+    assert cache.get(('result', 'v1', 'a')) is None
+    assert cache.get(('result', 'v2', 'a')) == 2
+    assert cache.get_or_compute(('result', 'v2', 'b'), lambda: 3) == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_too_large_values_are_rejected(caplog):
+    cache = ResultCache(max_bytes=1000)
+    with caplog.at_level(logging.WARNING, logger='factor.cache'):
+        for n in range(3):
+            cache.put(('window', 'v1', n), np.zeros(1000))
+    cache.put(('window', 'v1', 'small'), np.zeros(10))
+    stats = cache.stats()
+    assert (stats['entries'], stats['rejected'], stats['evictions']) == (1, 3, 0)
+    assert len(caplog.records) == 1
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+import pytest
+from cube import SalesCube, CUBE_KEYS
+from store import MONEY_COLS, load_sales
+
+
+@pytest.mark.parametrize('edges', [
+    pd.date_range('2021-02-01', '2021-09-01', freq='MS'),
+    pd.date_range('2021-02-03', '2021-04-14', freq='W-WED'),
+])
+def test_periods(built_dir, monkeypatch, edges):
+    monkeypatch.chdir(built_dir)
+    df_sales = load_sales(pd.read_parquet('data/products.pq'), pd.read_parquet('data/clients.pq'))
+    filters = {'id_brand': [1, 2]}
+    d_p = SalesCube.load(df_sales).periods(filters, edges)
+
+    rows = df_sales.loc[(df_sales['DocumentDate'] >= edges[0]) & (df_sales['DocumentDate'] < edges[-1])
+                        & df_sales['id_brand'].isin(filters['id_brand'])]
+    period = np.searchsorted(edges.to_numpy(), rows['DocumentDate'].to_numpy(), side='right') - 1
+    want = rows.groupby([period] + [rows[col] for col in CUBE_KEYS])[MONEY_COLS].sum()
+    got = d_p.set_index(['period'] + CUBE_KEYS)[MONEY_COLS].sort_index()
+    np.testing.assert_allclose(got.to_numpy(), want.sort_index().to_numpy())
+    assert list(got.index) == list(want.sort_index().index)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from analysis import AnalysisRequest
+from kernel import FACTOR_COLS
+from baseline import CASES, assert_filter_data, assert_result
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_filter_data(datasets, baseline, case):
+    assert_filter_data(datasets.filter_data(*case[:10]), baseline.filter_data(*case[:10]))
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_preprocess_data(datasets, baseline, case):
+    dm = datasets.filter_data(*case[:10])
+    result = datasets.preprocess_data(dm, datasets.df_products, datasets.df_clients, datasets.branch_dict, case[10], case[11])
+    assert_result(result, baseline.analyze(case))
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_analyze(datasets, baseline, case):
+    request = AnalysisRequest.create(*case)
+    result = datasets.analyze(request)
+    want = baseline.analyze(case)
+    assert_result(result, want)
+
+    dm1 = want[0]
+    assert result.totals['pairs'] == len(dm1)
+    for col in FACTOR_COLS + ['Profit base', 'Profit fact']:
+        assert np.isclose(result.totals[col], dm1[col].sum(), rtol=1e-7, atol=1e-4), col
+    # shared through the result cache
+    assert datasets.analyze(request) is result
+    assert datasets.analyzed(request) is result
+
+
+def test_filters_only_regroup_the_rollup(datasets, baseline):
+    """
+    Requests of one window pair are answered from one rollup
+    """
+    unfiltered, filtered = CASES[0], CASES[1]
+    datasets.analyze(AnalysisRequest.create(*unfiltered))
+    entries = datasets.cache.stats()['entries']
+    assert_result(datasets.analyze(AnalysisRequest.create(*filtered)), baseline.analyze(filtered))
+    # the new result and its filtered product-client table, no new rollup
+    assert datasets.cache.stats()['entries'] <= entries + 2
+
+
+def test_cell_rows(datasets):
+    result = datasets.analyze(AnalysisRequest.create(*CASES[0]))
+    x_axis, y_axis = result.pivots.x_axis, result.pivots.y_axis
+    y_value, x_value = result.pivot_price.stack().index[0]
+    rows = result.cell(x_value, y_value).frame()
+    assert len(rows) and (rows[x_axis] == x_value).all() and (rows[y_axis] == y_value).all()
+    assert np.isclose(rows[FACTOR_COLS[0]].sum(), result.pivot_price.loc[y_value, x_value])
@@ -0,0 +1,76 @@
+import io
+import threading
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+import export
+from export import Exporter
+from analysis import AnalysisRequest
+from baseline import CASES
+
+
+@pytest.fixture
+def dm1(datasets) -> pd.DataFrame:
+    dm1 = datasets.analyze(AnalysisRequest.create(*CASES[1])).dm1.copy()
+    # text that a spreadsheet would take for a formula or a link
+    dm1.loc[0, 'Article'] = '=1+1'
+    dm1.loc[1, 'Article'] = 'http://example.com'
+    # a column name that has to be quoted and escaped in CSV
+    return dm1.rename(columns={'Article': 'Article "code", short'})
+
+
+def assert_same(got: pd.DataFrame, want: pd.DataFrame) -> None:
+    assert list(got.columns) == list(want.columns) and len(got) == len(want)
+    for col in want.columns:
+        if want[col].dtype.kind == 'f':
+            np.testing.assert_allclose(got[col].to_numpy(float), want[col].to_numpy(float), rtol=1e-12, err_msg=col)
+        else:
+            assert got[col].astype(str).tolist() == want[col].astype(str).tolist(), col
+
+
+@pytest.mark.parametrize('fmt', ['CSV', 'Parquet'])
+def test_export(dm1, fmt, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 100)
+    path = Exporter(str(tmp_path)).export(dm1, ('key',), fmt)
+    got = pd.read_csv(path) if fmt == 'CSV' else pd.read_parquet(path)
+    assert_same(got, dm1)
+
+
+def test_export_xlsx(dm1, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 100)
+    path = Exporter(str(tmp_path)).export(dm1, ('key',), 'Excel')
+    sheet = zipfile.ZipFile(path).read('xl/worksheets/sheet1.xml').decode()
+    # a header row plus one row per pair, text never written as a formula
+    assert sheet.count('<row ') == len(dm1) + 1
+    assert '<f>' not in sheet
+
+
+def test_export_once_per_key(dm1, tmp_path, monkeypatch):
+    calls = []
+    write_csv = export.WRITERS['CSV']
+    monkeypatch.setitem(export.WRITERS, 'CSV', lambda df, path: calls.append(path) or write_csv(df, path))
+    exporter = Exporter(str(tmp_path))
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(exporter.export(dm1, ('key',), 'CSV'))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and set(paths) == set(calls)
+
+
+def test_served_file_is_reused(dm1, tmp_path, monkeypatch):
+    calls = []
+    write_csv = export.WRITERS['CSV']
+    monkeypatch.setitem(export.WRITERS, 'CSV', lambda df, path: calls.append(path) or write_csv(df, path))
+    exporter = Exporter(str(tmp_path))
+    for _ in range(2):
+        with exporter.served(dm1, ('key',), 'CSV') as f:
+            assert_same(pd.read_csv(io.BytesIO(f.read())), dm1)
+    assert len(calls) == 1
+
+
+def test_export_empty_csv(dm1, tmp_path):
+    path = Exporter(str(tmp_path)).export(dm1.iloc[:0], ('key',), 'CSV')
+    assert list(pd.read_csv(path).columns) == list(dm1.columns)
@@ -0,0 +1,58 @@
+import json
+import logging
+import tracemalloc
+import numpy as np
+import pytest
+from instrument import Trace, span
+
+
+@pytest.fixture
+def tracing():
+    tracemalloc.start()
+    yield
+    tracemalloc.stop()
+
+
+def allocate(nbytes: int) -> None:
+    block = np.ones(nbytes, dtype=np.uint8)
+    del block
+
+
+def test_nested_peaks(tracing):
+    with Trace() as trace:
+        with span('outer') as outer:
+            with span('first') as first:
+                allocate(4 << 20)
+            with span('second') as second:
+                with span('inner') as inner:
+                    allocate(8 << 20)
+                allocate(1 << 20)
+            allocate(2 << 20)
+
+    # each allocation was freed before the next one: the outer peak is the largest inner one
+    assert inner.alloc_peak >= 8 << 20
+    assert second.alloc_peak >= inner.alloc_peak
+    assert first.alloc_peak >= 4 << 20
+    assert outer.alloc_peak >= max(first.alloc_peak, second.alloc_peak)
+    assert outer.alloc_peak < 12 << 20
+
+    # finishing order: inner spans before the span holding them
+    assert [s.stage for s in trace.spans] == ['first', 'inner', 'second', 'outer']
+    assert [s.depth for s in trace.spans] == [1, 2, 1, 0]
+
+
+def test_span_log_lines(caplog):
+    with caplog.at_level(logging.INFO, logger='factor.spans'):
+        with span('quiet'):
+            pass
+    assert caplog.records == []
+
+    with caplog.at_level(logging.DEBUG, logger='factor.spans'):
+        with span('outer', rows_in=3) as s:
+            with span('inner'):
+                pass
+            s.rows_out = 2
+            s.set(cached=False)
+    records = [json.loads(record.getMessage()) for record in caplog.records]
+    assert [record['stage'] for record in records] == ['inner', 'outer']
+    assert records[1]['rows_in'] == 3 and records[1]['rows_out'] == 2 and records[1]['cached'] is False
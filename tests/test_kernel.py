@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from benchmarks.kernel import synthetic_merge, legacy_factor_table, check_same
+from kernel import factor_table, pair_key, PAIR_KEY_BASE
+from store import MISSING_CODE
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_factor_table(workers, monkeypatch):
+    monkeypatch.setattr('parallel.MIN_PARALLEL_ROWS', 100)
+    dm, df_products, df_clients, branch_dict = synthetic_merge(20_000, n_products=500, n_clients=2000)
+    new = factor_table(dm, df_products, df_clients, branch_dict, workers)
+    check_same(new, legacy_factor_table(dm.copy(), df_products, df_clients, branch_dict))
+
+
+def test_unknown_branch_is_department_zero():
+    dm, df_products, df_clients, branch_dict = synthetic_merge(100)
+    dm['id_branch_base'] = MISSING_CODE
+    dm['id_branch_fact'] = np.nan
+    assert (factor_table(dm, df_products, df_clients, branch_dict)['id_department'] == 0).all()
+
+
+def test_pair_key():
+    keys = pair_key(np.array([1, 12, 12]), np.array([23, 3, 0]))
+    assert len(set(keys.tolist())) == 3
+    assert keys[1] == 12 * PAIR_KEY_BASE + 3
+    with pytest.raises(ValueError):
+        pair_key(np.array([1]), np.array([PAIR_KEY_BASE]))
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from analysis import AnalysisRequest
+from kernel import FACTOR_COLS
+from preview import preview
+from baseline import CASES, assert_filter_data, assert_pivot, by_pair
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_sample_data(datasets, case):
+    """
+    The sampled pairs have the rows filter_data gives them
+    """
+    request = AnalysisRequest.create(*case)
+    dm, p, pairs_total = datasets.sample_data(request, n=200)
+    full = datasets.filter_data(*request.filter_args())
+    assert pairs_total == len(full)
+    assert len(p) == len(dm) and ((p > 0) & (p <= 1)).all()
+    sampled = by_pair(full).merge(dm[['id_commodity', 'id_client']], on=['id_commodity', 'id_client'])
+    assert_filter_data(dm, sampled)
+    # the same request draws the same sample
+    again, _, _ = datasets.sample_data(request, n=200)
+    assert by_pair(again)[['id_commodity', 'id_client']].equals(by_pair(dm)[['id_commodity', 'id_client']])
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_preview_of_every_pair_is_exact(datasets, baseline, case):
+    request = AnalysisRequest.create(*case)
+    dm, p, pairs_total = datasets.sample_data(request, n=10 ** 9)
+    assert (p == 1).all() and len(dm) == pairs_total
+    pivots, totals, bounds = preview(dm, p, pairs_total, datasets.df_products, datasets.df_clients, datasets.branch_dict,
+                                     datasets.axes_options[request.x_ax], datasets.axes_options[request.y_ax])
+
+    _, pivot_price, pivot_cost, pivot_vol = baseline.analyze(case)
+    assert_pivot(pivots.pivot_price, pivot_price)
+    assert_pivot(pivots.pivot_cost, pivot_cost)
+    assert_pivot(pivots.pivot_vol, pivot_vol)
+    assert all(bound == 0 for bound in bounds.totals.values())
+
+
+def test_preview_within_bounds(datasets, baseline):
+    request = AnalysisRequest.create(*CASES[0])
+    dm, p, pairs_total = datasets.sample_data(request, n=1000)
+    pivots, totals, bounds = preview(dm, p, pairs_total, datasets.df_products, datasets.df_clients, datasets.branch_dict,
+                                     datasets.axes_options[request.x_ax], datasets.axes_options[request.y_ax])
+    dm1 = baseline.analyze(CASES[0])[0]
+    assert bounds.pairs_total == len(dm1) and bounds.pairs_sampled < len(dm1) / 2
+    for col in FACTOR_COLS:
+        # four times the 95% bound: fails by chance far less than once in a million
+        assert abs(totals[col] - dm1[col].sum()) <= 4 * bounds.totals[col], col
+
+
+def test_preview_result(datasets, baseline):
+    request = AnalysisRequest.create(*CASES[1])
+    result = datasets.preview(request)
+    assert result.mode == 'preview'
+    assert datasets.preview(request) is result
+    # the product-client table is the exact one
+    assert len(result.dm1) == len(baseline.analyze(CASES[1])[0])
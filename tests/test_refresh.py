@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from analysis import AnalysisRequest
+from datasets import DataSets, LiveDataSets
+from store import build_store, UPDATES_DIR
+from baseline import T, assert_result
+from conftest import build
+
+# sales from this date on arrive as update files
+SPLIT = T('2021-10-01')
+
+# windows on both sides of SPLIT
+CASES = [
+    ([], [], [], [], [], [], T('2021-08-01'), T('2021-09-30 23:59:59'), T('2021-10-01'), T('2021-11-30 23:59:59'), 'Brand', 'Branch'),
+    ([1], [], [2], [], [], [], T('2021-07-29 21:00'), T('2021-09-30 19:00'), T('2021-09-30 19:00'), T('2021-12-31 23:59:59'), 'Channel', 'Group'),
+]
+
+
+@pytest.fixture
+def held_back(data_copy, monkeypatch) -> tuple:
+    """
+    The data directory with the sales before SPLIT in the store, except 1% of
+    them that arrive late. Returns the (new, late) sales
+    """
+    monkeypatch.chdir(data_copy)
+    raw = pd.read_parquet('data/df-sales.pq')
+    late = (raw['DocumentDate'] < SPLIT) & (np.random.default_rng(0).random(len(raw)) < 0.01)
+    raw[(raw['DocumentDate'] < SPLIT) & ~late].to_parquet('data/df-sales.pq', index=False)
+    build(data_copy)
+    os.makedirs(UPDATES_DIR)
+    return raw[raw['DocumentDate'] >= SPLIT], raw[late]
+
+
+def assert_cases(datasets: DataSets, baseline) -> None:
+    for case in CASES:
+        assert_result(datasets.analyze(AnalysisRequest.create(*case)), baseline.analyze(case))
+
+
+def test_incremental_refresh(held_back, baseline):
+    new, late = held_back
+    live = LiveDataSets(DataSets(), check_seconds=0)
+    first = live.current
+    rows, version = len(first.df_sales), first.version
+
+    new.to_parquet(os.path.join(UPDATES_DIR, '001-new.pq'), index=False)
+    second = live.refresh()
+    assert second is not first and live.last_error is None
+    # sessions still on the first snapshot are not affected
+    assert len(first.df_sales) == rows and first.version == version
+    assert len(second.df_sales) == rows + len(new)
+    second.analyze(AnalysisRequest.create(*CASES[0]))
+
+    late.to_parquet(os.path.join(UPDATES_DIR, '002-late.pq'), index=False)
+    third = live.refresh()
+    # the shared cache keeps no results of the old version
+    assert third.cache is second.cache
+    assert all(key[1] == third.version for key in third.cache._items)
+    assert_cases(third, baseline)
+    assert live.refresh() is third
+
+    # a new process loads the store and the pending updates
+    assert_cases(DataSets(), baseline)
+
+
+def test_refresh_after_rebuild(held_back, baseline):
+    new, late = held_back
+    live = LiveDataSets(DataSets(), check_seconds=0)
+    pd.concat([new, late]).to_parquet(os.path.join(UPDATES_DIR, '001-new.pq'), index=False)
+    updated = live.refresh()
+    assert_cases(updated, baseline)
+
+    # the store folds the update files in: a full reload with a cache of its own
+    build_store()
+    rebuilt = live.refresh()
+    assert rebuilt is not updated and rebuilt.cache is not updated.cache
+    assert rebuilt.pending_updates() == ([], False)
+    assert_cases(rebuilt, baseline)
+
+
+def test_dictionary_refresh(held_back):
+    datasets = DataSets()
+    brands = pd.read_csv('data/brand.csv', header=None)
+    brands.iloc[0, 1] = 'Renamed brand'
+    brands.to_csv('data/brand.csv', header=False, index=False)
+
+    refreshed = datasets.refreshed()
+    assert refreshed.df_sales is datasets.df_sales
+    assert refreshed.brand_dict[brands.iloc[0, 0]] == 'Renamed brand'
+    assert refreshed.version != datasets.version
+
+
+def test_streaming_refresh(held_back, baseline):
+    new, late = held_back
+    datasets = DataSets(streaming=True)
+    pd.concat([new, late]).to_parquet(os.path.join(UPDATES_DIR, '001-new.pq'), index=False)
+    refreshed = datasets.refreshed()
+    assert refreshed is not datasets
+    assert_cases(refreshed, baseline)
+
+    # a removed update file needs a full reload
+    os.remove(os.path.join(UPDATES_DIR, '001-new.pq'))
+    reloaded = refreshed.refreshed()
+    assert reloaded is not refreshed and reloaded.pending_updates() == ([], False)
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+from kernel import FACTOR_COLS
+from series import SeriesRequest, chained, CHANGE_COL
+
+FILTERS = [([], [], [], [], [], []), ([1], [], [2], [], [], [])]
+
+# (start, periods, freq): months from the cube, periods cutting through days from the rows
+PERIODS = [('2021-02-01', 4, 'MS'), ('2021-03-03 06:00', 3, '10D')]
+
+
+@pytest.mark.parametrize('mode', ['adjacent', 'fixed'])
+@pytest.mark.parametrize('periods', PERIODS)
+@pytest.mark.parametrize('filters', FILTERS)
+def test_series(datasets, baseline, filters, periods, mode):
+    request = SeriesRequest.create(*filters, *periods, mode)
+    table = datasets.series(request)
+    edges = request.edges
+    assert len(table) == len(edges) - 2
+
+    for i, row in table.reset_index(drop=True).iterrows():
+        base = i if mode == 'adjacent' else 0
+        end = pd.Timedelta(1, 'ns')
+        case = (*filters, edges[base], edges[base + 1] - end, edges[i + 1], edges[i + 2] - end, 'Brand', 'Branch')
+        dm1 = baseline.analyze(case)[0]
+        for col in FACTOR_COLS + ['Profit base', 'Profit fact', 'Revenue fact']:
+            assert np.isclose(row[col], dm1[col].sum(), rtol=1e-7, atol=1e-4), (i, col)
+        assert row['pairs'] == len(dm1)
+
+    if mode == 'adjacent':
+        assert np.isclose(table[chained(CHANGE_COL)].iloc[-1], table['Profit fact'].iloc[-1] - table['Profit base'].iloc[0])
+
+    by_brand = datasets.series(request._replace(by='Brand'))
+    for col in FACTOR_COLS + ['pairs']:
+        np.testing.assert_allclose(by_brand.groupby('fact')[col].sum().to_numpy(), table[col].to_numpy(), rtol=1e-7, atol=1e-4)
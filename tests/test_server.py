@@ -0,0 +1,119 @@
+import http.client
+import json
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+import pytest
+import parallel
+import server
+from datasets import DataSets, LiveDataSets
+from kernel import FACTOR_COLS
+from baseline import CASES, assert_pivot
+
+# a deadlocked request fails the test instead of hanging it
+TIMEOUT_SECONDS = 60
+
+JOB = {'base': [str(CASES[0][6]), str(CASES[0][7])], 'fact': [str(CASES[0][8]), str(CASES[0][9])], 'x_ax': 'Brand', 'y_ax': 'Branch'}
+
+
+def start(workers: int = 1) -> tuple:
+    httpd = server.PooledHTTPServer(('127.0.0.1', 0), LiveDataSets(DataSets(workers=workers)), 4)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f'http://127.0.0.1:{httpd.server_address[1]}'
+
+
+@pytest.fixture
+def service(built_dir, monkeypatch):
+    monkeypatch.chdir(built_dir)
+    httpd, url = start()
+    yield url
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(url: str, body: dict):
+    request = urllib.request.Request(url, json.dumps(body).encode(), {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=TIMEOUT_SECONDS) as response:
+        return json.load(response)
+
+
+def test_health(service, baseline):
+    health = json.load(urllib.request.urlopen(f'{service}/health', timeout=TIMEOUT_SECONDS))
+    assert health['status'] == 'ok' and health['rows'] == len(baseline.df_sales)
+
+
+def test_analyze(service, baseline):
+    _, pivot_price, pivot_cost, pivot_vol = baseline.analyze(CASES[0])
+    pivots = post(f'{service}/analyze', JOB)
+    assert pivots['mode'] == 'exact'
+    cells = pd.DataFrame(pivots['cells'])
+    for col, want in zip(FACTOR_COLS, [pivot_price, pivot_cost, pivot_vol]):
+        assert_pivot(cells.pivot(index='y', columns='x', values=col), want)
+
+
+def test_analyze_dm1(service, baseline):
+    dm1 = post(f'{service}/analyze', dict(JOB, output='dm1'))
+    assert len(dm1) == len(baseline.analyze(CASES[0])[0])
+
+
+def test_bad_job(service):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        post(f'{service}/analyze', dict(JOB, x_ax='Branch'))
+    assert error.value.code == 400
+
+
+def test_error_in_stream_closes_connection(service, monkeypatch):
+    def failing_chunks(df):
+        yield df.iloc[:10]
+        raise RuntimeError('failed while streaming')
+    monkeypatch.setattr(server, 'chunks', failing_chunks)
+
+    connection = http.client.HTTPConnection(service.split('//')[1], timeout=TIMEOUT_SECONDS)
+    connection.request('POST', '/analyze', json.dumps(dict(JOB, output='dm1')))
+    response = connection.getresponse()
+    assert response.status == 200
+    # cut short, not a 500 response written into the body
+    with pytest.raises(http.client.IncompleteRead) as error:
+        response.read()
+    assert b'error' not in error.value.partial
+
+
+def test_batch_with_parallel_shards(built_dir, baseline, monkeypatch):
+    """
+    Slices of a batch whose shards also run on a pool: the batch once ran on
+    the shard pool itself and deadlocked
+    """
+    monkeypatch.chdir(built_dir)
+    monkeypatch.setattr(parallel, 'MIN_PARALLEL_ROWS', 10)
+    httpd, url = start(workers=server.BATCH_WORKERS)
+    try:
+        spec = {'periods': [{'base': JOB['base'], 'fact': JOB['fact']}], 'axes': [['Brand', 'Branch']],
+                'each': ['channels', 'brands'], 'output': 'totals'}
+        batch = post(f'{url}/batch', spec)
+        assert len(batch['jobs']) > 2 * server.BATCH_WORKERS
+        assert all(job['status'] == 'ok' for job in batch['jobs'])
+
+        # channel and brand split the pairs: the slices add up to the whole
+        dm1 = baseline.analyze(CASES[0])[0]
+        assert sum(job['totals']['pairs'] for job in batch['jobs']) == len(dm1)
+        for col in FACTOR_COLS:
+            assert np.isclose(sum(job['totals'][col] for job in batch['jobs']), dm1[col].sum()), col
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_oversized_body_closes_connection(service, monkeypatch):
+    monkeypatch.setattr(server, 'MAX_BODY_BYTES', 100)
+    connection = http.client.HTTPConnection(service.split('//')[1], timeout=TIMEOUT_SECONDS)
+    connection.request('POST', '/analyze', json.dumps(dict(JOB, padding='x' * 1000)))
+    response = connection.getresponse()
+    assert response.status == 400 and response.getheader('Connection') == 'close'
+    assert 'larger than' in json.loads(response.read())['error']
+
+    # the unread body is not taken for the next request: it goes over a new connection
+    connection.request('GET', '/health')
+    response = connection.getresponse()
+    assert response.status == 200 and json.loads(response.read())['status'] == 'ok'
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+from store import prepare_sales, legacy_prepare_sales, load_sales
+
+
+def raw_sales() -> tuple:
+    return pd.read_parquet('data/df-sales.pq'), pd.read_parquet('data/products.pq'), pd.read_parquet('data/clients.pq')
+
+
+def test_prepare_sales(raw_dir, monkeypatch):
+    monkeypatch.chdir(raw_dir)
+    df_sales, df_products, df_clients = raw_sales()
+    new = prepare_sales(df_sales, df_products, df_clients)
+    old = legacy_prepare_sales(df_sales, df_products, df_clients).sort_values('DocumentDate', kind='stable').reset_index(drop=True)
+    assert new['DocumentDate'].is_monotonic_increasing
+    for col in old.columns:
+        np.testing.assert_array_equal(new[col].to_numpy(), old[col].to_numpy().astype(new[col].dtype), err_msg=col)
+
+
+def test_load_sales_from_store(built_dir, monkeypatch):
+    monkeypatch.chdir(built_dir)
+    df_sales, df_products, df_clients = raw_sales()
+    stored = load_sales(df_products, df_clients)
+    prepared = prepare_sales(df_sales, df_products, df_clients)
+    assert list(stored.columns) == list(prepared.columns)
+    for col in prepared.columns:
+        np.testing.assert_array_equal(stored[col].to_numpy(), prepared[col].to_numpy(), err_msg=col)
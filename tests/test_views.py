@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+import views
+from analysis import AnalysisResult
+from kernel import FACTOR_COLS
+from pivots import Pivots, fold_cells, REVENUE_COL, OTHER_LABEL
+from views import MAX_AXIS_LABELS, MIN_CELL_SHARE
+
+X_VALUES, Y_VALUES = 300, 150
+
+# serialized size allowed for one drawn cell and for the rest of the spec
+CELL_BYTES = 64
+SPEC_BYTES = 16 << 10
+
+
+@pytest.fixture(scope='module')
+def wide() -> AnalysisResult:
+    """
+    A result with far more x and y values than MAX_AXIS_LABELS
+    """
+    rng = np.random.default_rng(0)
+    n = 20_000
+    dm1 = pd.DataFrame({
+        'Article': [f'a{i}' for i in rng.integers(0, X_VALUES, n)],
+        'Client_name': [f'c{i}' for i in rng.integers(0, Y_VALUES, n)],
+    })
+    for col in FACTOR_COLS + [REVENUE_COL, 'Profit base', 'Profit fact']:
+        dm1[col] = rng.normal(0, 1000, n)
+    return AnalysisResult(dm1, Pivots(dm1, 'Article', 'Client_name'), 'Article', 'Client')
+
+
+def test_fold_cells(wide):
+    cells = wide.pivots.cells
+    folded = fold_cells(cells, 'Article', 'Client_name', MAX_AXIS_LABELS)
+
+    weight = pd.Series(np.abs(cells[FACTOR_COLS].to_numpy()).sum(axis=1))
+    for axis in ('Article', 'Client_name'):
+        labels = set(folded[axis])
+        assert len(labels) == MAX_AXIS_LABELS + 1 and OTHER_LABEL in labels
+        # the values with the largest total effect keep their label
+        largest = weight.groupby(cells[axis].to_numpy()).sum().nlargest(MAX_AXIS_LABELS).index
+        assert labels - {OTHER_LABEL} == set(largest)
+
+    assert not folded.duplicated(['Article', 'Client_name']).any()
+    for col in FACTOR_COLS + [REVENUE_COL]:
+        assert folded[col].sum() == pytest.approx(cells[col].sum(), rel=1e-9, abs=1e-6)
+
+
+def test_fold_cells_narrow(wide):
+    cells = wide.pivots.cells
+    assert fold_cells(cells, 'Article', 'Client_name', X_VALUES) is cells
+
+
+def test_significant():
+    values = np.array([0.0, 0.4, 0.9, 2.0, -5.0, 1000.0, -1000.0])
+    # MIN_CELL_SHARE of the peak and non-zero once rounded
+    peak = 1.5 / MIN_CELL_SHARE
+    assert views.significant(values, peak).tolist() == [False, False, False, True, True, True, True]
+    assert views.significant(values, 0.0).tolist() == [False, False, True, True, True, True, True]
+
+
+def test_altair_spec_budget(wide):
+    spec, info = views.AltairRenderer().spec(wide, -60)
+    data = next(iter(spec['datasets'].values()))
+
+    assert info['cells'] == len(FACTOR_COLS) * len(wide.pivots.cells)
+    assert info['cells_drawn'] == len(data) < len(FACTOR_COLS) * (MAX_AXIS_LABELS + 1) ** 2
+    assert {row['x'] for row in data} <= set(fold_cells(wide.pivots.cells, 'Article', 'Client_name', MAX_AXIS_LABELS)['Article'])
+    assert info['payload_bytes'] < len(FACTOR_COLS) * (MAX_AXIS_LABELS + 1) ** 2 * CELL_BYTES + SPEC_BYTES
@@ -1,161 +1,270 @@
+"""
+Heatmaps of the three factors, drawn with one of the registered renderers.
+
+Every renderer imports its plotting library the first time it is used, so
+starting the app does not load matplotlib, seaborn, plotly or altair. A
+renderer splits its work in two:
+  * spec(result, angle) builds what is drawn (PNG, plotly figures, Vega-Lite
+    dict) straight from the NumPy arrays of the pivots,
+  * show(st, spec) hands it to Streamlit.
+Specs are kept per analysis result and drawing method, so redrawing a
+result, or switching back to a method already used for it, only shows the
+kept spec. They go away with the result.
+
+The Plotly and Altair specs are sent to the browser as JSON, so their size
+is bounded whatever the cardinality of the axes:
+  * at most MAX_AXIS_LABELS values per axis, the rest folded into "Other",
+  * cells below MIN_CELL_SHARE of the largest effect of their factor left out,
+  * values rounded to VALUE_DECIMALS, short field names in the Altair data.
+The serialized size is reported on the render span as payload_bytes.
+
+trend_spec draws the decomposition of consecutive periods (see series.py).
+"""
+import io
+import json
+import threading
+import weakref
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-import matplotlib.pyplot as plt
-import seaborn as sns
-import altair as alt
-from datasets import DataSets
+from analysis import AnalysisResult
+from kernel import PRICE_COL, COST_COL, VOL_COL, FACTOR_COLS
+from pivots import axis_order, fold_cells
+from instrument import span
 
-class Render():
+TITLE_COLOR = '#518cc8'
 
-    def __init__(self, ds: DataSets) -> None:
-        self.pivot_price, self.pivot_cost, self.pivot_vol = ds.pivot_price, ds.pivot_cost, ds.pivot_vol
-        self.aa, self.bb, self.cc = ds.aa, ds.bb, ds.cc
-        self.x_ax, self.y_ax = ds.x_ax, ds.y_ax
-        self.dm1 = ds.dm1
+# payload budget of the specs sent to the browser
+MAX_AXIS_LABELS = 40
+MIN_CELL_SHARE = 0.001
+VALUE_DECIMALS = 0
 
+# drawing method -> renderer
+RENDERERS = {}
 
-    def _render_seaborn(self, st):
-        pivot_price, pivot_cost, pivot_vol = self.pivot_price, self.pivot_cost, self.pivot_vol
-        dm1 = self.dm1
-        x_ax, y_ax = self.x_ax, self.y_ax        
+# result -> {(method, angle): (spec, info)}
+_specs = weakref.WeakKeyDictionary()
+_specs_lock = threading.Lock()
 
-        plt.style.use('ggplot')
-        fig, ax = plt.subplots(1, 3, figsize=(20, 5))
-        fig.subplots_adjust(hspace=0.5, wspace=0.25)
 
-        ax[0].set_title(f'Price influence   ''{:,.0f}'.format(dm1['Сhange in profit due to price'].sum()), c='#518cc8')
-        ax[1].set_title(f'Cost influence   ''{:,.0f}'.format(dm1['Сhange in profit due to cost'].sum()), c='#518cc8')
-        ax[2].set_title(f'Structure influence ''{:,.0f}'.format(dm1['Сhange in profit due to structure'].sum()), c='#518cc8')
+def register(name: str):
+    """
+    Class decorator adding a renderer under the drawing method `name`
+    """
+    def add(cls):
+        RENDERERS[name] = cls()
+        return cls
+    return add
 
-        sns.heatmap(pivot_price, ax=ax[0], cmap='RdBu', cbar=False, annot=True, fmt='.0f', linewidths=.5)
-        sns.heatmap(pivot_cost, ax=ax[1], cmap='RdBu', cbar=False, annot=True, fmt='.0f', linewidths=.5, yticklabels=False)
-        sns.heatmap(pivot_vol.applymap(lambda x: x/1000), ax=ax[2], cmap='RdBu', cbar=False, annot=True, fmt='.1f', linewidths=.5, yticklabels=False)
-        for t in ax[2].texts: t.set_text(t.get_text() + "k")
 
-        ax[0].set_xlabel(x_ax)
-        ax[1].set_xlabel(x_ax)
-        ax[2].set_xlabel(x_ax + " (thousands)")
-        
-        ax[0].set_ylabel(y_ax)
-        ax[1].set_ylabel("")
-        ax[2].set_ylabel("")
+def titles(totals: dict, bounds=None) -> list:
+    """
+    Title of every factor with its total, in FACTOR_COLS order. Estimated
+    totals (bounds from preview.py) are marked as such with their bound
+    """
+    names = {PRICE_COL: 'Price influence   ', COST_COL: 'Cost influence   ', VOL_COL: 'Structure influence   '}
+    if bounds is None:
+        return [names[col] + '{:,.0f}'.format(totals[col]) for col in FACTOR_COLS]
+    return [names[col] + '≈{:,.0f} ± {:,.0f} (preview)'.format(totals[col], bounds.totals[col]) for col in FACTOR_COLS]
 
-        st.pyplot(fig)
 
-    
+def significant(values: np.ndarray, peak: float) -> np.ndarray:
+    """
+    Cells worth drawing: not zero once rounded and at least MIN_CELL_SHARE of peak,
+    the largest effect of a cell before folding (folded cells would dwarf the others)
+    """
+    return (np.abs(values) >= MIN_CELL_SHARE * peak) & (np.round(values, VALUE_DECIMALS) != 0)
 
-    def _render_plotly(self, st, angle=-60):
-        pivot_price, pivot_cost, pivot_vol = self.pivot_price, self.pivot_cost, self.pivot_vol
-        dm1 = self.dm1
 
-        left_col, mid_col, right_col = st.columns(3)
+def peaks(result: AnalysisResult) -> list:
+    """
+    Largest absolute effect of a cell of every factor, in FACTOR_COLS order
+    """
+    cells = result.pivots.cells
+    return [float(np.abs(cells[col].to_numpy(dtype=np.float64)).max()) if len(cells) else 0.0 for col in FACTOR_COLS]
 
-        with left_col:
-            data = go.Heatmap(
-                        x = pivot_price.columns.tolist(),
-                        y = pivot_price.index.tolist(),
-                        z = pivot_price.values.tolist(),
-                        zmid=0,
-                        xgap=3,
-                        ygap=3,
-                        colorscale='RdBu'            
-                    )
-            layout = go.Layout(                    
-                        title={'text':'Price influence   ''{:,.0f}'.format(dm1['Сhange in profit due to price'].sum()), 'xanchor':'left','yanchor':'bottom', 'y':0.87},
-                        titlefont=dict(size=20, color='#518cc8'),
-                        xaxis=dict(showgrid=False, tickangle = angle),
-                        yaxis=dict(showgrid=False, categoryorder='category descending'),
-                        font=dict(size=11),                   
-                        height= 550,
-                        width=550,
-                        margin=dict(l=0, b=0),                    
-                    )
-            fig = go.Figure(data=[data], layout=layout)
-            st.plotly_chart(fig, use_container_width=False)
 
-        with mid_col:
-            data = go.Heatmap(
-                        x = pivot_cost.columns.tolist(),
-                        y = pivot_cost.index.tolist(),
-                        z = pivot_cost.values.tolist(),
-                        zmid=0,
-                        xgap=3,
-                        ygap=3,
-                        colorscale='RdBu'            
-                    )
-            layout = go.Layout(                    
-                        title={'text':'Cost influence   ''{:,.0f}'.format(dm1['Сhange in profit due to cost'].sum()), 'xanchor':'left','yanchor':'bottom', 'y':0.87},
-                        titlefont=dict(size=20, color='#518cc8'),
-                        xaxis=dict(showgrid=False, tickangle = angle),
-                        yaxis=dict(showgrid=False, categoryorder='category descending'),
-                        font=dict(size=11),                   
-                        height= 550,
-                        width=550,
-                        margin=dict(l=0, b=0),                    
-                    )
-            fig = go.Figure(data=[data], layout=layout)
-            st.plotly_chart(fig, use_container_width=False)
+def rounded(values: np.ndarray) -> np.ndarray:
+    values = np.round(values, VALUE_DECIMALS)
+    # integers serialize without the trailing .0
+    return values.astype(np.int64) if VALUE_DECIMALS == 0 else values
+
+
+def figure_spec(result: AnalysisResult, method: str, angle: int = -60) -> tuple:
+    """
+    (spec of result for the drawing method, info about it, whether it was already built).
+    info holds payload_bytes and, for the budgeted specs, the cells before and after it
+    """
+    if method not in RENDERERS:
+        raise ValueError(f'Unknown drawing method {method}, expected one of {list(RENDERERS)}')
+    key = (method, angle)
+    with _specs_lock:
+        specs = _specs.setdefault(result, {})
+        if key in specs:
+            return specs[key] + (True,)
+    # built outside the lock, sessions drawing the same result at once may both build it
+    spec, info = RENDERERS[method].spec(result, angle)
+    with _specs_lock:
+        specs[key] = (spec, info)
+    return spec, info, False
+
 
-        with right_col:
+class Renderer():
+    def spec(self, result: AnalysisResult, angle: int) -> tuple:
+        """
+        (spec, info with at least payload_bytes)
+        """
+        raise NotImplementedError
+
+    def show(self, st, spec) -> None:
+        raise NotImplementedError
+
+
+@register('Seaborn')
+class SeabornRenderer(Renderer):
+    """
+    Spec: the PNG st.pyplot would make of the figure
+    """
+    def spec(self, result: AnalysisResult, angle: int) -> tuple:
+        import matplotlib
+        from matplotlib.figure import Figure
+        import seaborn as sns
+
+        x_ax, y_ax = result.x_ax, result.y_ax
+        price_title, cost_title, vol_title = titles(result.totals, result.bounds)
+
+        with matplotlib.style.context('ggplot'):
+            fig = Figure(figsize=(20, 5))
+            ax = fig.subplots(1, 3)
+            fig.subplots_adjust(hspace=0.5, wspace=0.25)
+
+            ax[0].set_title(price_title, c=TITLE_COLOR)
+            ax[1].set_title(cost_title, c=TITLE_COLOR)
+            ax[2].set_title(vol_title, c=TITLE_COLOR)
+
+            sns.heatmap(result.pivot_price, ax=ax[0], cmap='RdBu', cbar=False, annot=True, fmt='.0f', linewidths=.5)
+            sns.heatmap(result.pivot_cost, ax=ax[1], cmap='RdBu', cbar=False, annot=True, fmt='.0f', linewidths=.5, yticklabels=False)
+            sns.heatmap(result.pivot_vol / 1000, ax=ax[2], cmap='RdBu', cbar=False, annot=True, fmt='.1f', linewidths=.5, yticklabels=False)
+            for t in ax[2].texts: t.set_text(t.get_text() + "k")
+
+            ax[0].set_xlabel(x_ax)
+            ax[1].set_xlabel(x_ax)
+            ax[2].set_xlabel(x_ax + " (thousands)")
+
+            ax[0].set_ylabel(y_ax)
+            ax[1].set_ylabel("")
+            ax[2].set_ylabel("")
+
+            image = io.BytesIO()
+            fig.savefig(image, format='png', bbox_inches='tight', dpi=200)
+        png = image.getvalue()
+        return png, {'payload_bytes': len(png)}
+
+    def show(self, st, spec: bytes) -> None:
+        st.image(spec, use_column_width=True)
+
+
+@register('Plotly')
+class PlotlyRenderer(Renderer):
+    """
+    Spec: one figure per factor, st.plotly_chart only takes figures
+    """
+    def spec(self, result: AnalysisResult, angle: int) -> tuple:
+        import plotly.graph_objects as go
+
+        x, y = result.pivots.x_axis, result.pivots.y_axis
+        cells = fold_cells(result.pivots.cells, x, y, MAX_AXIS_LABELS)
+        x_order, y_order = axis_order(cells[x]), axis_order(cells[y])
+
+        figures, drawn = [], 0
+        for col, title, peak in zip(FACTOR_COLS, titles(result.totals, result.bounds), peaks(result)):
+            pivot = cells.pivot(index=y, columns=x, values=col).reindex(index=y_order, columns=x_order)
+            z = pivot.to_numpy(dtype=np.float64, na_value=np.nan)
+            keep = significant(z, peak)
+            drawn += int(keep.sum())
+            # left out cells are gaps, like pairs without sales
+            z = np.where(keep, np.round(z, VALUE_DECIMALS), np.nan)
             data = go.Heatmap(
-                        x = pivot_vol.columns.tolist(),
-                        y = pivot_vol.index.tolist(),
-                        z = pivot_vol.values.tolist(),
+                        x=pivot.columns.to_numpy(),
+                        y=pivot.index.to_numpy(),
+                        z=z,
                         zmid=0,
                         xgap=3,
                         ygap=3,
-                        colorscale='RdBu'            
+                        colorscale='RdBu'
                     )
-            layout = go.Layout(                    
-                        title={'text':'Structure influence   ''{:,.0f}'.format(dm1['Сhange in profit due to structure'].sum()), 'xanchor':'left','yanchor':'bottom', 'y':0.87},
-                        titlefont=dict(size=20, color='#518cc8'),
-                        xaxis=dict(showgrid=False, tickangle = angle),
+            layout = go.Layout(
+                        title={'text': title, 'xanchor': 'left', 'yanchor': 'bottom', 'y': 0.87,
+                               'font': dict(size=20, color=TITLE_COLOR)},
+                        xaxis=dict(showgrid=False, tickangle=angle),
                         yaxis=dict(showgrid=False, categoryorder='category descending'),
-                        font=dict(size=11),                   
-                        height= 550,
+                        font=dict(size=11),
+                        height=550,
                         width=550,
-                        margin=dict(l=0, b=0),                    
+                        margin=dict(l=0, b=0),
                     )
-            fig = go.Figure(data=[data], layout=layout)
-            st.plotly_chart(fig, use_container_width=False)
+            figures.append(go.Figure(data=[data], layout=layout))
 
+        info = {
+            'payload_bytes': sum(len(fig.to_json()) for fig in figures),
+            'cells': len(FACTOR_COLS) * len(result.pivots.cells),
+            'cells_drawn': drawn,
+        }
+        return tuple(figures), info
 
+    def show(self, st, spec: tuple) -> None:
+        for column, fig in zip(st.columns(3), spec):
+            with column:
+                st.plotly_chart(fig, use_container_width=False)
 
-    def _render_altair(self, st):
-        dm1, aa, bb, cc = self.dm1, self.aa, self.bb, self.cc
-        
-        x, y, v1, v2, v3 = aa.columns[0], aa.columns[1], aa.columns[2], bb.columns[2], cc.columns[2]
 
-        facets = ['Price influence   ''{:,.0f}'.format(dm1['Сhange in profit due to price'].sum()),
-                'Cost influence   ''{:,.0f}'.format(dm1['Сhange in profit due to cost'].sum()),
-                'Structure influence  ''{:,.0f}'.format(dm1['Сhange in profit due to structure'].sum()) ]
+@register('Altair')
+class AltairRenderer(Renderer):
+    """
+    Spec: the Vega-Lite dict of the faceted chart, data included
+    """
+    def spec(self, result: AnalysisResult, angle: int) -> tuple:
+        import altair as alt
 
-        aa['facet'], bb['facet'], cc['facet'] = facets
-        decimals = 1
-        aa[v1], bb[v2], cc[v3] = aa[v1].round(decimals), bb[v2].round(decimals), cc[v3].round(decimals)
+        x, y = result.pivots.x_axis, result.pivots.y_axis
+        cells = fold_cells(result.pivots.cells, x, y, MAX_AXIS_LABELS)
+        facets = titles(result.totals, result.bounds)
 
-        aa.rename(columns={v1: 'value'}, inplace=True)
-        bb.rename(columns={v2: 'value'}, inplace=True)
-        cc.rename(columns={v3: 'value'}, inplace=True)
+        # long form of the three factors with short field names: x, y, value, facet number
+        n = len(cells)
+        values = np.concatenate([cells[col].to_numpy(dtype=np.float64) for col in FACTOR_COLS])
+        keep = np.concatenate([significant(values[k * n:(k + 1) * n], peak) for k, peak in enumerate(peaks(result))])
+        tt = pd.DataFrame({
+            'x': np.tile(cells[x].to_numpy(), len(FACTOR_COLS))[keep],
+            'y': np.tile(cells[y].to_numpy(), len(FACTOR_COLS))[keep],
+            'v': rounded(values[keep]),
+            'f': np.repeat(np.arange(len(FACTOR_COLS)), n)[keep],
+        })
+        tooltip = [alt.Tooltip('x:O', title=x), alt.Tooltip('y:O', title=y), alt.Tooltip('v:Q', title='value', format=',')]
+        if result.bounds is not None:
+            # bound of every estimated cell, none for cells folded here
+            located = result.bounds.cells.set_index([x, y]).reindex(pd.MultiIndex.from_frame(cells[[x, y]]))
+            bounds = np.concatenate([located[col].to_numpy(dtype=np.float64) for col in FACTOR_COLS])
+            tt['b'] = np.round(bounds[keep], VALUE_DECIMALS)
+            tooltip.append(alt.Tooltip('b:Q', title='± (preview)', format=','))
 
-        tt = pd.concat([aa, bb, cc])
-        
         heatmap = alt.Chart(tt).mark_rect(stroke='lightgray').encode(
-            alt.X(x, type='ordinal'),
-            alt.Y(y, type='ordinal'),
-            alt.Color('value:Q', scale=alt.Scale(
+            alt.X('x:O', title=x),
+            alt.Y('y:O', title=y),
+            alt.Color('v:Q', title='value', scale=alt.Scale(
                                     clamp=True,
                                     domainMid=0,
                                     scheme=alt.SchemeParams(name='redblue'),
                                     ), #legend=None
                                     ),
-            tooltip=[x, y, 'value']
+            tooltip=tooltip
         ).properties(
             width=400,
             height=400
         ).facet(
-            column=alt.Column('facet', sort=facets, 
-                        header=alt.Header(labelFontSize=20, title=None, labelColor='#518cc8'))
+            # facet titles are stored once, in the header expression
+            column=alt.Column('f:O', sort=list(range(len(FACTOR_COLS))),
+                        header=alt.Header(labelExpr=f'{json.dumps(facets)}[datum.value]',
+                                          labelFontSize=20, title=None, labelColor=TITLE_COLOR))
         ).resolve_scale(
             x="independent",
             y="independent",
@@ -164,17 +273,62 @@ class Render():
             bandPaddingInner=0.01
         ).configure_view(
             stroke=None
-        ).interactive()
-        st.altair_chart(heatmap)
+        )
 
+        # the budget bounds the table, it is inlined whatever its size
+        with alt.data_transformers.disable_max_rows():
+            spec = heatmap.to_dict()
+        info = {
+            'payload_bytes': len(json.dumps(spec, separators=(',', ':'))),
+            'cells': len(FACTOR_COLS) * len(result.pivots.cells),
+            'cells_drawn': len(tt),
+        }
+        return spec, info
 
+    def show(self, st, spec: dict) -> None:
+        st.vega_lite_chart(spec=spec)
 
-    def render(self, st, method="Altair", angle=-60):
-        if method=="Seaborn":
-            self._render_seaborn(st)
 
-        if method=="Plotly":
-            self._render_plotly(st, angle)
+def trend_spec(table: pd.DataFrame) -> dict:
+    """
+    Vega-Lite dict of a series table (see series.py): the three effects of every
+    comparison as stacked bars at its fact period, the profit change as a line
+    """
+    import altair as alt
+    from series import CHANGE_COL
+
+    sums = table.groupby('fact', sort=True)[FACTOR_COLS + [CHANGE_COL]].sum()
+    names = ['Price', 'Cost', 'Structure']
+    effects = pd.DataFrame({
+        'p': np.tile(sums.index.strftime('%Y-%m-%d').to_numpy(), len(FACTOR_COLS)),
+        'v': rounded(np.concatenate([sums[col].to_numpy(dtype=np.float64) for col in FACTOR_COLS])),
+        'e': np.repeat(names, len(sums)),
+    })
+    change = pd.DataFrame({'p': sums.index.strftime('%Y-%m-%d').to_numpy(), 'v': rounded(sums[CHANGE_COL].to_numpy(dtype=np.float64))})
+
+    bars = alt.Chart(effects).mark_bar().encode(
+        alt.X('p:O', title='Period'),
+        alt.Y('v:Q', title='Change in profit', stack='zero'),
+        alt.Color('e:N', title='Effect', sort=names, scale=alt.Scale(scheme='tableau10')),
+        tooltip=[alt.Tooltip('p:O', title='Period'), alt.Tooltip('e:N', title='Effect'), alt.Tooltip('v:Q', title='value', format=',')]
+    )
+    line = alt.Chart(change).mark_line(point=True, color='black').encode(
+        alt.X('p:O'),
+        alt.Y('v:Q'),
+        tooltip=[alt.Tooltip('p:O', title='Period'), alt.Tooltip('v:Q', title='Profit change', format=',')]
+    )
+    return (bars + line).properties(height=400).to_dict()
 
-        if method=="Altair":
-            self._render_altair(st)
\ No newline at end of file
+
+class Render():
+
+    def __init__(self, result: AnalysisResult) -> None:
+        self.result = result
+        self.x_ax, self.y_ax = result.x_ax, result.y_ax
+        self.totals = result.totals
+
+    def render(self, st, method="Altair", angle=-60):
+        with span(f'render.{method}', rows_in=len(self.result.pivots.cells)) as s:
+            spec, info, cached = figure_spec(self.result, method, angle)
+            s.set(cached=cached, **info)
+            RENDERERS[method].show(st, spec)